@@ -0,0 +1,329 @@
+import argparse
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+
+ROM_SIZE = 32768
+RAM_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+
+
+def _alu(
+    zx: int, nx: int, zy: int, ny: int, f: int, no: int
+) -> Callable[[int, int], int]:
+    def compute(x: int, y: int) -> int:
+        if zx:
+            x = 0
+        if nx:
+            x = ~x
+        if zy:
+            y = 0
+        if ny:
+            y = ~y
+        out = x + y if f else x & y
+        if no:
+            out = ~out
+        return out
+    return compute
+
+
+# comp bits (zx nx zy ny f no) -> function of (x=D, y=A or M); the result
+# is not yet truncated to 16 bits
+_COMP: Dict[int, Callable[[int, int], int]] = {
+    0b101010: lambda x, y: 0,
+    0b111111: lambda x, y: 1,
+    0b111010: lambda x, y: -1,
+    0b001100: lambda x, y: x,
+    0b110000: lambda x, y: y,
+    0b001101: lambda x, y: ~x,
+    0b110001: lambda x, y: ~y,
+    0b001111: lambda x, y: -x,
+    0b110011: lambda x, y: -y,
+    0b011111: lambda x, y: x + 1,
+    0b110111: lambda x, y: y + 1,
+    0b001110: lambda x, y: x - 1,
+    0b110010: lambda x, y: y - 1,
+    0b000010: lambda x, y: x + y,
+    0b010011: lambda x, y: x - y,
+    0b000111: lambda x, y: y - x,
+    0b000000: lambda x, y: x & y,
+    0b010101: lambda x, y: x | y,
+}
+
+
+def _comp(bits: int) -> Callable[[int, int], int]:
+    if bits in _COMP:
+        return _COMP[bits]
+    # undocumented combinations still do what the ALU does
+    return _alu(*((bits >> i) & 1 for i in range(5, -1, -1)))
+
+
+# the same functions as Python source, used when translating basic blocks
+_COMP_SOURCE: Dict[int, str] = {
+    0b101010: "0",
+    0b111111: "1",
+    0b111010: "-1",
+    0b001100: "{x}",
+    0b110000: "{y}",
+    0b001101: "~{x}",
+    0b110001: "~{y}",
+    0b001111: "-{x}",
+    0b110011: "-{y}",
+    0b011111: "{x} + 1",
+    0b110111: "{y} + 1",
+    0b001110: "{x} - 1",
+    0b110010: "{y} - 1",
+    0b000010: "{x} + {y}",
+    0b010011: "{x} - {y}",
+    0b000111: "{y} - {x}",
+    0b000000: "{x} & {y}",
+    0b010101: "{x} | {y}",
+}
+
+
+# jump bits -> (jump if out < 0, jump if out == 0, jump if out > 0)
+_JUMP: List[Tuple[bool, bool, bool]] = [
+    (bool(j & 4), bool(j & 2), bool(j & 1)) for j in range(8)
+]
+
+
+def decode(word: int) -> tuple:
+    """Predecodes an instruction word for the emulator's run loop."""
+    if not word & 0x8000:
+        return (False, word)
+    return (
+        True,
+        _comp((word >> 6) & 0b111111),
+        bool(word & 0x1000),  # y is M instead of A
+        bool(word & 0x20),  # dest A
+        bool(word & 0x10),  # dest D
+        bool(word & 0x08),  # dest M
+        _JUMP[word & 0b111],
+    )
+
+
+class CPUEmulator:
+    def __init__(self, translate: bool = True):
+        """`translate` runs code as basic blocks compiled to Python
+        functions; pass False to use the plain interpreter instead."""
+        self.ram = array("h", bytes(2 * RAM_SIZE))
+        self.rom = array("H", bytes(2 * ROM_SIZE))
+        self.translate = translate
+        self._code: List[tuple] = []
+        self._blocks: Dict[int, Tuple[Callable, int, bool]] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        # A is kept unsigned since it is mostly used as an address
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.time = 0
+
+    def load(self, program: Union[str, Iterable[int]]) -> None:
+        """Loads a .hack file, or a sequence of instruction words, into ROM."""
+        if isinstance(program, str):
+            with open(program) as f:
+                words = [int(l.strip(), 2) for l in f if l.strip()]
+        else:
+            words = list(program)
+        if len(words) > ROM_SIZE:
+            raise ValueError(f"program has {len(words)} words, ROM holds {ROM_SIZE}")
+        self.rom = array("H", bytes(2 * ROM_SIZE))
+        self.rom[: len(words)] = array("H", words)
+        self._code = [decode(w) for w in words]
+        self._blocks = {}
+        self.reset()
+
+    def peek(self, address: int) -> int:
+        return self.ram[address]
+
+    def poke(self, address: int, value: int) -> None:
+        self.ram[address] = ((value + 0x8000) & 0xFFFF) - 0x8000
+
+    def step(self) -> None:
+        self.run(1)
+
+    def run(self, cycles: int, stop_at_halt: bool = True) -> int:
+        """Executes up to `cycles` instructions and returns how many ran.
+
+        Stops early when the program runs past the end of the loaded code
+        or, if `stop_at_halt`, enters the `(END) @END 0;JMP` idiom.
+        """
+        if not self.translate:
+            return self._interpret(cycles, stop_at_halt)
+        blocks = self._blocks
+        size = len(self._code)
+        ram = self.ram
+        a = self.a
+        d = self.d
+        pc = self.pc
+        executed = 0
+        halted = False
+        while pc < size:
+            block = blocks.get(pc)
+            if block is None:
+                block = blocks[pc] = self._translate(pc)
+            function, length, halts = block
+            if executed + length > cycles:
+                break
+            executed += length
+            pc, a, d = function(ram, a, d)
+            if halts and stop_at_halt:
+                halted = True
+                break
+        self.a = a
+        self.d = d
+        self.pc = pc
+        self.time += executed
+        if not halted and executed < cycles and pc < size:
+            # finish the last, partial block one instruction at a time
+            executed += self._interpret(cycles - executed, stop_at_halt)
+        return executed
+
+    def _translate(self, start: int) -> Tuple[Callable, int, bool]:
+        # Compiles the instructions from `start` up to the next jump into
+        # a Python function (ram, a, d) -> (pc, a, d). A values loaded by
+        # @xxx are folded into the generated code as constants.
+        code = self._code
+        namespace: Dict[str, Callable] = {}
+        lines = ["def block(ram, a, d):"]
+        known_a: Optional[int] = None
+        pc = start
+        jump = None
+        while pc < len(code):
+            instruction = code[pc]
+            pc += 1
+            if not instruction[0]:
+                known_a = instruction[1]
+                continue
+            _, comp, use_m, dest_a, dest_d, dest_m, jump = instruction
+            a_expr = "a" if known_a is None else str(known_a)
+            m_expr = (
+                "ram[a & 32767]" if known_a is None else f"ram[{known_a & 0x7FFF}]"
+            )
+            bits = (self.rom[pc - 1] >> 6) & 0b111111
+            if bits in _COMP_SOURCE:
+                expr = _COMP_SOURCE[bits].format(x="d", y=m_expr if use_m else a_expr)
+            else:
+                namespace[f"comp{pc - 1}"] = comp
+                expr = f"comp{pc - 1}(d, {m_expr if use_m else a_expr})"
+            if expr in ["0", "1", "-1", "d", m_expr]:
+                lines.append(f"    out = {expr}")
+            else:
+                lines.append(f"    out = (({expr}) + 32768 & 65535) - 32768")
+            if dest_m:
+                lines.append(f"    {m_expr} = out")
+            if dest_a:
+                lines.append("    a = out & 65535")
+                known_a = None
+            if dest_d:
+                lines.append("    d = out")
+            if jump != (False, False, False):
+                break
+        if known_a is not None:
+            lines.append(f"    a = {known_a}")
+        halts = False
+        if jump is None or jump == (False, False, False):
+            lines.append(f"    return {pc}, a, d")
+        elif jump == (True, True, True):
+            lines.append("    return a & 32767, a, d")
+            halts = known_a == pc - 2 and pc - 2 >= start
+        else:
+            lt, eq, gt = jump
+            conditions = []
+            if lt:
+                conditions.append("out < 0")
+            if eq:
+                conditions.append("out == 0")
+            if gt:
+                conditions.append("out > 0")
+            lines.append(f"    if {' or '.join(conditions)}:")
+            lines.append("        return a & 32767, a, d")
+            lines.append(f"    return {pc}, a, d")
+        exec(compile("\n".join(lines), f"<block {start}>", "exec"), namespace)
+        return namespace["block"], pc - start, halts
+
+    def _interpret(self, cycles: int, stop_at_halt: bool) -> int:
+        code = self._code
+        size = len(code)
+        ram = self.ram
+        a = self.a
+        d = self.d
+        pc = self.pc
+        executed = 0
+        while executed < cycles and pc < size:
+            executed += 1
+            instruction = code[pc]
+            if not instruction[0]:
+                a = instruction[1]
+                pc += 1
+                continue
+            _, comp, use_m, dest_a, dest_d, dest_m, (lt, eq, gt) = instruction
+            out = comp(d, ram[a & 0x7FFF] if use_m else a)
+            out = ((out + 0x8000) & 0xFFFF) - 0x8000
+            if dest_m:
+                ram[a & 0x7FFF] = out
+            if dest_a:
+                a = out & 0xFFFF
+            if dest_d:
+                d = out
+            if (lt and out < 0) or (eq and out == 0) or (gt and out > 0):
+                if (
+                    stop_at_halt
+                    and lt and eq and gt
+                    and a == pc - 1
+                    and code[a] == (False, a)
+                ):
+                    pc = a
+                    break
+                pc = a & 0x7FFF
+            else:
+                pc += 1
+        self.a = a
+        self.d = d
+        self.pc = pc
+        self.time += executed
+        return executed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file")
+    parser.add_argument("--cycles", type=int, default=1_000_000)
+    parser.add_argument(
+        "--interpret",
+        action="store_true",
+        help="run one instruction at a time instead of translated blocks",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="ADDR=VALUE",
+        help="initialize RAM[ADDR] before running",
+    )
+    parser.add_argument(
+        "--peek",
+        action="append",
+        default=[],
+        metavar="ADDR[-ADDR]",
+        help="print RAM[ADDR] (or a range) after running",
+    )
+    args = parser.parse_args()
+    emulator = CPUEmulator(translate=not args.interpret)
+    emulator.load(args.input_file)
+    for s in args.set:
+        address, value = s.split("=")
+        emulator.poke(int(address), int(value))
+    executed = emulator.run(args.cycles)
+    print(f"cycles: {executed}")
+    for p in args.peek:
+        first, _, last = p.partition("-")
+        for address in range(int(first), int(last or first) + 1):
+            print(f"RAM[{address}] = {emulator.peek(address)}")
+
+
+if __name__ == "__main__":
+    main()
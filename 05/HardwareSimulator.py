@@ -0,0 +1,1330 @@
+import argparse
+import hashlib
+import importlib.util
+import marshal
+import os
+import re
+import random
+import sys
+import time
+from typing import (
+    Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+)
+
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# where parts are looked up after the directory of the chip being loaded
+SEARCH_PATH = [
+    os.path.join(_ROOT, d) for d in ["01", "02", os.path.join("03", "a"),
+                                     os.path.join("03", "b"), "05"]
+]
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__hdlcache__")
+
+# flattened netlists beyond this many nodes are refused rather than turned
+# into millions of lines of Python (RAM512 is about half of it)
+MAX_NODES = 1_000_000
+
+# EventChip compiles sequential parts larger than this separately
+LEAF_SIZE = 10000
+
+# bump when the generated code changes so stale cache entries are ignored
+_GENERATOR_VERSION = "3"
+
+_TOKENS = re.compile(
+    r"//[^\n]*|/\*.*?\*/|[A-Za-z_][\w\-]*|\d+|\.\.|[{}()\[\];,=:]", re.DOTALL
+)
+
+# chips the course tools provide as built-ins; ARegister and DRegister
+# behave exactly like Register
+_ALIASES = {"ARegister": "Register", "DRegister": "Register"}
+
+# built-in memories: name -> (address width, has in/load inputs)
+_MEMORIES = {
+    "ROM32K": (15, False),
+    "Screen": (13, True),
+    "Keyboard": (0, False),
+}
+
+
+class HDLError(Exception):
+    pass
+
+
+class _Connection(NamedTuple):
+    pin: str
+    pin_range: Optional[Tuple[int, int]]
+    net: str
+    net_range: Optional[Tuple[int, int]]
+
+
+class _PartInfo(NamedTuple):
+    # what EventChip needs to know of a separately simulated part: its
+    # hold pin (see _hold_pin) and the inputs its outputs depend on
+    hold: Optional[str]
+    sensitive: List[str]
+
+
+class _ChipDef(NamedTuple):
+    name: str
+    inputs: Dict[str, int]
+    outputs: Dict[str, int]
+    parts: List[Tuple[str, List[_Connection]]]
+    source: str
+
+
+def _parse_hdl(text: str) -> _ChipDef:
+    tokens = [
+        t for t in _TOKENS.findall(text)
+        if not t.startswith("//") and not t.startswith("/*")
+    ]
+    pos = 0
+
+    def take(expected: Optional[str] = None) -> str:
+        nonlocal pos
+        if pos >= len(tokens):
+            raise HDLError(f"unexpected end of file, expected {expected}")
+        t = tokens[pos]
+        if expected is not None and t != expected:
+            raise HDLError(f"expected {expected!r}, got {t!r}")
+        pos += 1
+        return t
+
+    def peek() -> Optional[str]:
+        return tokens[pos] if pos < len(tokens) else None
+
+    def sub_range() -> Optional[Tuple[int, int]]:
+        if peek() != "[":
+            return None
+        take("[")
+        lo = int(take())
+        hi = lo
+        if peek() == "..":
+            take("..")
+            hi = int(take())
+        take("]")
+        return lo, hi
+
+    def pin_list() -> Dict[str, int]:
+        pins = {}
+        while True:
+            name = take()
+            width = 1
+            if peek() == "[":
+                take("[")
+                width = int(take())
+                take("]")
+            pins[name] = width
+            if take() == ";":
+                return pins
+
+    take("CHIP")
+    name = take()
+    take("{")
+    inputs: Dict[str, int] = {}
+    outputs: Dict[str, int] = {}
+    if peek() == "IN":
+        take()
+        inputs = pin_list()
+    if peek() == "OUT":
+        take()
+        outputs = pin_list()
+    if peek() == "BUILTIN":
+        raise HDLError(f"{name} is a built-in chip")
+    take("PARTS")
+    take(":")
+    parts = []
+    while peek() != "}":
+        part = take()
+        take("(")
+        connections = []
+        while True:
+            pin = take()
+            pin_range = sub_range()
+            take("=")
+            net = take()
+            net_range = sub_range()
+            connections.append(_Connection(pin, pin_range, net, net_range))
+            if take() == ")":
+                break
+        take(";")
+        parts.append((part, connections))
+    take("}")
+    return _ChipDef(name, inputs, outputs, parts, text)
+
+
+class _Library:
+    # finds and parses chip definitions, remembering every file read so
+    # that the cache key covers the whole hierarchy
+    def __init__(self, search_path: List[str]):
+        self._search_path = search_path
+        self._defs: Dict[str, _ChipDef] = {}
+        self._sizes: Dict[str, int] = {}
+        self._sequential: Dict[str, bool] = {}
+
+    def get(self, name: str) -> Optional[_ChipDef]:
+        name = _ALIASES.get(name, name)
+        if name in ["Nand", "DFF"] or name in _MEMORIES:
+            return None
+        if name not in self._defs:
+            for d in self._search_path:
+                path = os.path.join(d, f"{name}.hdl")
+                if os.path.exists(path):
+                    with open(path) as f:
+                        self._defs[name] = _parse_hdl(f.read())
+                    break
+            else:
+                raise HDLError(f"no HDL file for chip {name}")
+        return self._defs[name]
+
+    def pins(self, name: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+        name = _ALIASES.get(name, name)
+        if name == "Nand":
+            return {"a": 1, "b": 1}, {"out": 1}
+        if name == "DFF":
+            return {"in": 1}, {"out": 1}
+        if name in _MEMORIES:
+            address_width, writable = _MEMORIES[name]
+            inputs = {"address": address_width} if address_width else {}
+            if writable:
+                inputs.update({"in": 16, "load": 1})
+            return inputs, {"out": 16}
+        chip = self.get(name)
+        return chip.inputs, chip.outputs
+
+    def size(self, name: str) -> int:
+        """Estimates the number of netlist nodes of the flattened chip."""
+        name = _ALIASES.get(name, name)
+        if name in ["Nand", "DFF"]:
+            return 1
+        if name in _MEMORIES:
+            return 17
+        if name not in self._sizes:
+            total = 0
+            for part, _ in self.get(name).parts:
+                total += self.size(part) + sum(self.pins(part)[1].values())
+            self._sizes[name] = total
+        return self._sizes[name]
+
+    def sequential(self, name: str) -> bool:
+        """Whether the chip contains DFFs or built-in memories."""
+        name = _ALIASES.get(name, name)
+        if name == "Nand":
+            return False
+        if name == "DFF" or name in _MEMORIES:
+            return True
+        if name not in self._sequential:
+            self._sequential[name] = any(
+                self.sequential(part) for part, _ in self.get(name).parts
+            )
+        return self._sequential[name]
+
+    def parts(self, name: str) -> Set[str]:
+        """The names of all chips used below `name`, aliases resolved."""
+        found: Set[str] = set()
+        stack = [name]
+        while stack:
+            chip = self.get(stack.pop())
+            if chip is None:
+                continue
+            for part, _ in chip.parts:
+                part = _ALIASES.get(part, part)
+                if part not in found:
+                    found.add(part)
+                    stack.append(part)
+        return found
+
+    def digest(self, name: str, opaque: FrozenSet[str] = frozenset()) -> str:
+        # hashes the sources of `name` and every chip below it, and the
+        # parts left out of its generated code
+        h = hashlib.sha256(_GENERATOR_VERSION.encode())
+        h.update(importlib.util.MAGIC_NUMBER)
+        h.update(",".join(sorted(opaque)).encode() + b"\0")
+        seen = set()
+        stack = [name]
+        while stack:
+            n = stack.pop()
+            chip = self.get(n)
+            if chip is None or chip.name in seen:
+                continue
+            seen.add(chip.name)
+            h.update(chip.name.encode() + b"\0" + chip.source.encode() + b"\0")
+            stack += [part for part, _ in chip.parts]
+        return h.hexdigest()
+
+
+# Netlist nodes are tuples indexed by position in a list:
+#   ("const", v) ("in", pin, bit) ("state", k) ("word", m, *address bits)
+#   ("bit", word node, i) ("not", x) ("and", x, y)
+# plus ("nand", x, y) and ("wire", target) while the netlist is built.
+
+
+class _Netlist:
+    # Parts named in `opaque` are not flattened: their input bits are kept
+    # in `children` and their outputs become ("in", "c<k>.<pin>", bit) nodes.
+    def __init__(self, library: _Library, opaque: FrozenSet[str] = frozenset()):
+        self._library = library
+        self._opaque = opaque
+        self.nodes: List[tuple] = [("const", 0), ("const", 1)]
+        self.wire_targets: Dict[int, int] = {}
+        self.dff_inputs: List[int] = []
+        # per memory: (name, size, address bits, in bits, load bit)
+        self.memories: List[Tuple[str, int, List[int], List[int], Optional[int]]] = []
+        self.children: List[Tuple[str, Dict[str, List[int]]]] = []
+
+    def _new(self, node: tuple) -> int:
+        self.nodes.append(node)
+        if len(self.nodes) > MAX_NODES:
+            raise HDLError(f"chip is too large to flatten (over {MAX_NODES} nodes)")
+        return len(self.nodes) - 1
+
+    def _wire(self) -> int:
+        return self._new(("wire",))
+
+    def instantiate(
+        self, name: str, inputs: Dict[str, List[int]]
+    ) -> Dict[str, List[int]]:
+        name = _ALIASES.get(name, name)
+        input_widths, output_widths = self._library.pins(name)
+        bits = {
+            pin: inputs.get(pin, [0] * width) for pin, width in input_widths.items()
+        }
+        if name == "Nand":
+            return {"out": [self._new(("nand", bits["a"][0], bits["b"][0]))]}
+        if name == "DFF":
+            self.dff_inputs.append(bits["in"][0])
+            return {"out": [self._new(("state", len(self.dff_inputs) - 1))]}
+        if name in _MEMORIES:
+            address_width, writable = _MEMORIES[name]
+            m = len(self.memories)
+            self.memories.append((
+                name,
+                1 << address_width,
+                bits.get("address", []),
+                bits.get("in", []),
+                bits["load"][0] if writable else None,
+            ))
+            word = self._new(("word", m, *bits.get("address", [])))
+            return {"out": [self._new(("bit", word, i)) for i in range(16)]}
+
+        chip = self._library.get(name)
+        nets: Dict[str, List[int]] = dict(bits)
+        outputs = {pin: [self._wire() for _ in range(w)] for pin, w in output_widths.items()}
+        # internal nets take the width of the part output driving them
+        for part, connections in chip.parts:
+            _, part_outputs = self._library.pins(part)
+            for c in connections:
+                if c.pin in part_outputs and c.net not in outputs and c.net not in nets:
+                    lo, hi = c.pin_range or (0, part_outputs[c.pin] - 1)
+                    nets[c.net] = [self._wire() for _ in range(hi - lo + 1)]
+        for part, connections in chip.parts:
+            part_inputs, part_outputs = self._library.pins(part)
+            given: Dict[str, List[int]] = {}
+            for c in connections:
+                if c.pin not in part_inputs:
+                    continue
+                width = part_inputs[c.pin]
+                lo, hi = c.pin_range or (0, width - 1)
+                pin_bits = given.setdefault(c.pin, [0] * width)
+                source = self._net_bits(chip, nets, c, hi - lo + 1)
+                pin_bits[lo : hi + 1] = source
+            if _ALIASES.get(part, part) in self._opaque:
+                produced = self._child(part, given)
+            else:
+                produced = self.instantiate(part, given)
+            for c in connections:
+                if c.pin not in part_outputs:
+                    if c.pin not in part_inputs:
+                        raise HDLError(f"{part} has no pin {c.pin} (in {chip.name})")
+                    continue
+                lo, hi = c.pin_range or (0, part_outputs[c.pin] - 1)
+                if c.net in outputs:
+                    targets = outputs[c.net]
+                    if c.net_range is not None:
+                        targets = targets[c.net_range[0] : c.net_range[1] + 1]
+                else:
+                    targets = nets[c.net]
+                for wire, bit in zip(targets, produced[c.pin][lo : hi + 1]):
+                    self.wire_targets[wire] = bit
+        return outputs
+
+    def _child(self, name: str, inputs: Dict[str, List[int]]) -> Dict[str, List[int]]:
+        name = _ALIASES.get(name, name)
+        input_widths, output_widths = self._library.pins(name)
+        k = len(self.children)
+        self.children.append((name, {
+            pin: inputs.get(pin, [0] * width) for pin, width in input_widths.items()
+        }))
+        return {
+            pin: [self._new(("in", f"c{k}.{pin}", i)) for i in range(width)]
+            for pin, width in output_widths.items()
+        }
+
+    def _net_bits(
+        self, chip: _ChipDef, nets: Dict[str, List[int]], c: _Connection, width: int
+    ) -> List[int]:
+        if c.net in ["true", "false"]:
+            return [1 if c.net == "true" else 0] * width
+        if c.net not in nets:
+            raise HDLError(f"{c.net} is never assigned in {chip.name}")
+        bits = nets[c.net]
+        if c.net_range is not None:
+            bits = bits[c.net_range[0] : c.net_range[1] + 1]
+        if len(bits) != width:
+            raise HDLError(f"width mismatch connecting {c.pin}={c.net} in {chip.name}")
+        return bits
+
+
+class _Graph:
+    # The simplified netlist: wires resolved, Nand rewritten as not/and,
+    # constants folded and identical nodes shared.
+    def __init__(self, netlist: _Netlist):
+        self.nodes: List[tuple] = [("const", 0), ("const", 1)]
+        self._index: Dict[tuple, int] = {self.nodes[0]: 0, self.nodes[1]: 1}
+        self._source = netlist
+        self._map: Dict[int, int] = {0: 0, 1: 1}
+
+    def _add(self, node: tuple) -> int:
+        n = self._index.get(node)
+        if n is None:
+            self.nodes.append(node)
+            n = self._index[node] = len(self.nodes) - 1
+        return n
+
+    def _not(self, x: int) -> int:
+        node = self.nodes[x]
+        if node[0] == "const":
+            return 1 - x
+        if node[0] == "not":
+            return node[1]
+        return self._add(("not", x))
+
+    def _and(self, x: int, y: int) -> int:
+        if x == 0 or y == 0:
+            return 0
+        if x == 1:
+            return y
+        if y == 1 or x == y:
+            return x
+        if self.nodes[x] == ("not", y) or self.nodes[y] == ("not", x):
+            return 0
+        return self._add(("and", min(x, y), max(x, y)))
+
+    def _resolve(self, n: int) -> int:
+        targets = self._source.wire_targets
+        seen = 0
+        while self._source.nodes[n][0] == "wire":
+            n = targets.get(n, 0)
+            seen += 1
+            if seen > len(targets) + 1:
+                raise HDLError("loop of unconnected wires")
+        return n
+
+    def convert(self, root: int) -> int:
+        """Maps a netlist node to the simplified graph (iteratively)."""
+        source = self._source.nodes
+        stack = [self._resolve(root)]
+        on_stack = set()
+        while stack:
+            n = stack[-1]
+            if n in self._map:
+                stack.pop()
+                continue
+            node = source[n]
+            kind = node[0]
+            if kind in ["in", "state", "const"]:
+                operands = []
+            elif kind == "word":
+                operands = [self._resolve(x) for x in node[2:]]
+            elif kind == "bit":
+                operands = [self._resolve(node[1])]
+            else:  # nand
+                operands = [self._resolve(node[1]), self._resolve(node[2])]
+            pending = [x for x in operands if x not in self._map]
+            if pending:
+                if n in on_stack:
+                    raise HDLError("combinational loop (a cycle without a DFF)")
+                on_stack.add(n)
+                stack += pending
+                continue
+            stack.pop()
+            mapped = [self._map[x] for x in operands]
+            if kind == "nand":
+                self._map[n] = self._not(self._and(*mapped))
+            elif kind == "word":
+                self._map[n] = self._add(("word", node[1], *mapped))
+            elif kind == "bit":
+                self._map[n] = self._add(("bit", mapped[0], node[2]))
+            else:
+                self._map[n] = self._add(node)
+        return self._map[self._resolve(root)]
+
+
+def _packed(bits: List[int], expr) -> str:
+    # Python expression packing bit nodes (LSB first) into an int
+    terms = []
+    for i, b in enumerate(bits):
+        if b == 0:
+            continue
+        e = expr(b)
+        terms.append(e if i == 0 else f"({e}) << {i}")
+    return " | ".join(terms) or "0"
+
+
+# inlined expressions are assigned to a local once they nest this deep,
+# keeping the generated code within the compiler's recursion limits
+_MAX_DEPTH = 40
+
+
+def _generate(
+    graph: _Graph,
+    inputs: Dict[str, int],
+    functions: Dict[str, List[List[int]]],
+    sliced: bool = False,
+) -> str:
+    # Emits one function per entry of `functions`, returning a tuple of
+    # packed results, with only the logic those results depend on.
+    # pins are passed positionally as i0, i1, ... since names such as
+    # `in` are not valid Python identifiers.
+    # With `sliced`, every bit is instead a bit-plane holding one bit of
+    # many independent vectors: pins are passed and results returned as
+    # lists of planes, and `ones` has a 1 in every lane in use.
+    names = {pin: f"i{k}" for k, pin in enumerate(inputs)}
+    params = ", ".join(list(names.values()) + (["ones"] if sliced else ["s", "m"]))
+    one = "ones" if sliced else "1"
+    lines = []
+    for fname, results in functions.items():
+        lines.append(f"def {fname}({params}):")
+        order: List[int] = []
+        uses: Dict[int, int] = {}
+        visited = set()
+        stack = [(b, False) for r in results for b in r]
+        for r in results:
+            for b in r:
+                uses[b] = uses.get(b, 0) + 2  # results are never inlined
+        while stack:
+            n, expanded = stack.pop()
+            if expanded:
+                order.append(n)
+                continue
+            if n in visited:
+                continue
+            visited.add(n)
+            stack.append((n, True))
+            node = graph.nodes[n]
+            if node[0] in ["not", "and", "word", "bit"]:
+                if node[0] == "word":
+                    operands = node[2:]
+                elif node[0] == "and":
+                    operands = node[1:3]
+                else:
+                    operands = node[1:2]
+                for x in operands:
+                    uses[x] = uses.get(x, 0) + 1
+                    stack.append((x, False))
+        exprs: Dict[int, Tuple[str, int]] = {}
+        for n in order:
+            node = graph.nodes[n]
+            kind = node[0]
+            if kind == "const":
+                e, depth = one if node[1] else "0", 0
+            elif kind == "in":
+                _, pin, bit = node
+                p = names[pin]
+                if sliced:
+                    e = f"{p}[{bit}]"
+                else:
+                    e = p if inputs[pin] == 1 else f"({p} >> {bit} & 1)"
+                depth = 0
+            elif sliced and kind in ["state", "word", "bit"]:
+                raise HDLError("only combinational chips can be bit-sliced")
+            elif kind == "state":
+                e, depth = f"s[{node[1]}]", 0
+            elif kind == "not":
+                x, d = exprs[node[1]]
+                e, depth = f"{one} ^ {x}" if d == 0 else f"{one} ^ ({x})", d + 1
+            elif kind == "and":
+                (x, dx), (y, dy) = exprs[node[1]], exprs[node[2]]
+                x = x if dx == 0 else f"({x})"
+                y = y if dy == 0 else f"({y})"
+                e, depth = f"{x} & {y}", max(dx, dy) + 1
+            elif kind == "word":
+                m = node[1]
+                address = _packed(list(node[2:]), lambda b: exprs[b][0])
+                e, depth = f"m[{m}][{address}]", 1
+            else:  # bit
+                x, _ = exprs[node[1]]
+                e, depth = f"({x} >> {node[2]} & 1)", 1
+            if depth > 0 and (uses.get(n, 0) > 1 or depth >= _MAX_DEPTH):
+                lines.append(f"    t{n} = {e}")
+                e, depth = f"t{n}", 0
+            exprs[n] = (e, depth)
+        if sliced:
+            packed = [f"[{', '.join(exprs[b][0] for b in r)}]" for r in results]
+        else:
+            packed = [_packed(r, lambda b: exprs[b][0]) for r in results]
+        lines.append(f"    return ({''.join(p + ', ' for p in packed)})")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _compile(
+    library: _Library,
+    name: str,
+    opaque: FrozenSet[str] = frozenset(),
+    describe: Optional[Callable[[str], _PartInfo]] = None,
+) -> str:
+    # Generates the module for chip `name`. evaluate() returns the outputs
+    # followed by the inputs of each part left in `opaque`, whose outputs
+    # are extra parameters. With `describe`, which gives the _PartInfo of
+    # such parts, the chip's own is worked out too.
+    inputs, output_pins = library.pins(name)
+    netlist = _Netlist(library, opaque)
+    bits = {
+        pin: [netlist._new(("in", pin, i)) for i in range(w)]
+        for pin, w in inputs.items()
+    }
+    outputs = netlist.instantiate(name, bits)
+    graph = _Graph(netlist)
+    out_results = [[graph.convert(b) for b in outputs[p]] for p in output_pins]
+    params = dict(inputs)
+    children = []
+    for k, (part, part_bits) in enumerate(netlist.children):
+        part_inputs, part_outputs = library.pins(part)
+        out_results += [[graph.convert(b) for b in part_bits[p]] for p in part_inputs]
+        params.update({f"c{k}.{p}": w for p, w in part_outputs.items()})
+        children.append((part, len(part_inputs), len(part_outputs)))
+    clock_results = [[graph.convert(b) for b in netlist.dff_inputs]]
+    writable = []
+    for m, (_, _, address, data, load) in enumerate(netlist.memories):
+        if load is None:
+            continue
+        writable.append(m)
+        clock_results += [
+            [graph.convert(load)],
+            [graph.convert(b) for b in address],
+            [graph.convert(b) for b in data],
+        ]
+    # clock returns each DFF input as its own element
+    dffs = clock_results[0]
+    clock_results = [[b] for b in dffs] + clock_results[1:]
+    source = _generate(graph, params, {
+        "evaluate": out_results,
+        "clock": clock_results,
+    })
+    if not dffs and not netlist.memories and not children:
+        source += _generate(graph, inputs, {"sweep": out_results}, sliced=True)
+    hold = None
+    sensitive = list(range(len(inputs)))
+    if describe is not None:
+        pin = _hold_pin(library, name, opaque, describe)
+        hold = None if pin is None else list(inputs).index(pin)
+        pins = _sensitive_pins(
+            graph, netlist, out_results[: len(output_pins)], describe
+        )
+        sensitive = [k for k, pin in enumerate(inputs) if pin in pins]
+    memories = [(name, size) for name, size, _, _, _ in netlist.memories]
+    return "\n".join([
+        source,
+        f"OUTPUT_COUNT = {len(output_pins)}",
+        f"STATE_SIZE = {len(dffs)}",
+        f"MEMORIES = {memories!r}",
+        f"WRITABLE = {writable!r}",
+        f"CHILDREN = {children!r}",
+        f"HOLD = {hold!r}",
+        f"SENSITIVE = {sensitive!r}",
+        "",
+    ])
+
+
+def _hold_pin(
+    library: _Library,
+    name: str,
+    opaque: FrozenSet[str],
+    describe: Callable[[str], _PartInfo],
+) -> Optional[str]:
+    # Finds a 1-bit input that, while 0, leaves every DFF, memory and
+    # opaque part of the chip unchanged by the clock (such as `load`), by
+    # tying it to 0 and letting constant folding do the proof.
+    inputs, _ = library.pins(name)
+    for pin, width in inputs.items():
+        if width != 1:
+            continue
+        netlist = _Netlist(library, opaque)
+        bits = {
+            p: [0] if p == pin else [netlist._new(("in", p, i)) for i in range(w)]
+            for p, w in inputs.items()
+        }
+        netlist.instantiate(name, bits)
+        graph = _Graph(netlist)
+        if all(
+            graph.nodes[graph.convert(b)] == ("state", k)
+            for k, b in enumerate(netlist.dff_inputs)
+        ) and all(
+            load is None or graph.convert(load) == 0
+            for _, _, _, _, load in netlist.memories
+        ) and all(
+            describe(part).hold in part_bits
+            and graph.convert(part_bits[describe(part).hold][0]) == 0
+            for part, part_bits in netlist.children
+        ):
+            return pin
+    return None
+
+
+def _sensitive_pins(
+    graph: _Graph,
+    netlist: _Netlist,
+    results: List[List[int]],
+    describe: Callable[[str], _PartInfo],
+) -> Set[str]:
+    # the input pins that the given results depend on, following the
+    # outputs of opaque parts back to the inputs they are sensitive to
+    found: Set[str] = set()
+    visited = set()
+    stack = [b for r in results for b in r]
+    while stack:
+        n = stack.pop()
+        if n in visited:
+            continue
+        visited.add(n)
+        node = graph.nodes[n]
+        kind = node[0]
+        if kind == "in":
+            pin = node[1]
+            if "." not in pin:
+                found.add(pin)
+                continue
+            part, part_bits = netlist.children[int(pin[1 : pin.index(".")])]
+            for p in describe(part).sensitive:
+                stack += [graph.convert(b) for b in part_bits[p]]
+        elif kind == "not":
+            stack.append(node[1])
+        elif kind == "and":
+            stack += node[1:3]
+        elif kind == "word":
+            stack += node[2:]
+        elif kind == "bit":
+            stack.append(node[1])
+    return found
+
+
+def _load_module(
+    library: _Library,
+    name: str,
+    cache_dir: Optional[str],
+    opaque: FrozenSet[str] = frozenset(),
+    describe: Optional[Callable[[str], _PartInfo]] = None,
+) -> Dict[str, object]:
+    # runs the generated module of a chip, compiling it unless cached
+    code = None
+    cache_file = None
+    if cache_dir is not None:
+        digest = library.digest(name, opaque)
+        cache_file = os.path.join(cache_dir, f"{name}-{digest}.bin")
+        if os.path.exists(cache_file):
+            with open(cache_file, "rb") as f:
+                code = marshal.load(f)
+    if code is None:
+        code = compile(_compile(library, name, opaque, describe), f"<{name}.hdl>", "exec")
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file + ".tmp", "wb") as f:
+                marshal.dump(code, f)
+            os.replace(cache_file + ".tmp", cache_file)
+    namespace: Dict[str, object] = {}
+    exec(code, namespace)
+    return namespace
+
+
+def _locate(name: str, search_path: Optional[List[str]]) -> Tuple[str, List[str]]:
+    # a path to an .hdl file is searched first for the chip's parts
+    if name.endswith(".hdl"):
+        directory = os.path.dirname(os.path.abspath(name))
+        name = os.path.splitext(os.path.basename(name))[0]
+        return name, [directory] + (search_path or SEARCH_PATH)
+    return name, search_path or SEARCH_PATH
+
+
+class Chip:
+    """A chip compiled from HDL into straight-line Python functions.
+
+    Buses are packed into ints. Sequential parts (DFFs and the built-in
+    memories) latch their inputs on tick() and update on tock().
+    """
+
+    def __init__(
+        self,
+        name: str,
+        search_path: Optional[List[str]] = None,
+        cache_dir: Optional[str] = CACHE_DIR,
+    ):
+        name, search_path = _locate(name, search_path)
+        self.name = name
+        library = _Library(search_path)
+        self.inputs, self.outputs = library.pins(name)
+        if library.size(name) > MAX_NODES:
+            raise HDLError(
+                f"{name} is too large to flatten (over {MAX_NODES} nodes);"
+                " use EventChip"
+            )
+        namespace = _load_module(library, name, cache_dir)
+        self._evaluate = namespace["evaluate"]
+        self._clock = namespace["clock"]
+        self._sweep = namespace.get("sweep")
+        self._state = [0] * namespace["STATE_SIZE"]
+        self._memory_names = [name for name, _ in namespace["MEMORIES"]]
+        self._memories = [[0] * size for _, size in namespace["MEMORIES"]]
+        self._writable = namespace["WRITABLE"]
+        self._values = {pin: 0 for pin in self.inputs}
+        self._output_index = {pin: k for k, pin in enumerate(self.outputs)}
+        self._outputs: Optional[tuple] = None
+        self._pending: Optional[tuple] = None
+
+    def set(self, pin: str, value: int) -> None:
+        if pin not in self.inputs:
+            raise HDLError(f"{self.name} has no input {pin}")
+        self._values[pin] = value & ((1 << self.inputs[pin]) - 1)
+        self._outputs = None
+
+    def get(self, pin: str) -> int:
+        """Returns a pin's value as an unsigned int of the pin's width."""
+        if pin in self._values:
+            return self._values[pin]
+        if pin not in self.outputs:
+            raise HDLError(f"{self.name} has no pin {pin}")
+        if self._outputs is None:
+            self.eval()
+        return self._outputs[self._output_index[pin]]
+
+    def eval(self) -> None:
+        self._outputs = self._evaluate(*self._values.values(), self._state, self._memories)
+
+    def tick(self) -> None:
+        self._pending = self._clock(*self._values.values(), self._state, self._memories)
+
+    def tock(self) -> None:
+        if self._pending is None:
+            return
+        n = len(self._state)
+        self._state[:] = self._pending[:n]
+        writes = self._pending[n:]
+        for i, m in enumerate(self._writable):
+            load, address, data = writes[3 * i : 3 * i + 3]
+            if load:
+                self._memories[m][address] = data
+        self._pending = None
+        self._outputs = None
+
+    def sweep(self, planes: Dict[str, List[int]], lanes: int) -> Dict[str, List[int]]:
+        """Evaluates `lanes` input vectors at once.
+
+        Each input pin is given as a list of bit-planes, one int per bit of
+        the pin, where bit k of a plane is that bit's value in vector k.
+        The outputs come back the same way. Only combinational chips can
+        be swept.
+        """
+        if self._sweep is None:
+            raise HDLError(f"{self.name} is sequential and cannot be swept")
+        ones = (1 << lanes) - 1
+        results = self._sweep(*(planes[pin] for pin in self.inputs), ones)
+        return dict(zip(self.outputs, results))
+
+    def memory(self, name: str, index: int = 0) -> List[int]:
+        """Returns the contents of the `index`-th built-in memory `name`
+        (ROM32K, Screen or Keyboard), which may be modified in place."""
+        return [
+            m for n, m in zip(self._memory_names, self._memories) if n == name
+        ][index]
+
+    @property
+    def size(self) -> int:
+        return len(self._state)
+
+
+# chips that EventChip can replace with array-backed models: name -> words
+MODELS = {
+    "Bit": 1,
+    "Register": 1,
+    "RAM8": 8,
+    "RAM64": 64,
+    "RAM512": 512,
+    "RAM4K": 4096,
+    "RAM16K": 16384,
+}
+
+
+class _Level:
+    # One chip in an EventChip's hierarchy: its own logic compiled as for
+    # Chip, with its large parts as child _Level or _Model instances.
+    def __init__(self, module: Dict[str, object], children: list):
+        self._evaluate = module["evaluate"]
+        self._clock = module["clock"]
+        self._state = [0] * module["STATE_SIZE"]
+        self._memory_names = [name for name, _ in module["MEMORIES"]]
+        self._memories = [[0] * size for _, size in module["MEMORIES"]]
+        self._writable = module["WRITABLE"]
+        self.hold: Optional[int] = module["HOLD"]
+        self._sensitive = module["SENSITIVE"]
+        self._children = children
+        # (child, slice of evaluate()'s results, slice of _child_outputs)
+        self._wiring = []
+        results = module["OUTPUT_COUNT"]
+        outputs = 0
+        for child, (_, n_inputs, n_outputs) in zip(children, module["CHILDREN"]):
+            self._wiring.append((
+                child,
+                slice(results, results + n_inputs),
+                slice(outputs, outputs + n_outputs),
+            ))
+            results += n_inputs
+            outputs += n_outputs
+        self._child_outputs = [0] * outputs
+        self.inputs: Optional[tuple] = None
+        self.outputs: tuple = ()
+        self._output_count = module["OUTPUT_COUNT"]
+        self._valid = False
+        # the inputs changed but not in a way that changes the outputs, so
+        # the parts' inputs are out of date until the next clock
+        self._stale = False
+        self._pending: Optional[tuple] = None
+        self._clocked: Optional[tuple] = None
+        self._stable = False
+
+    def evaluate(self, inputs: tuple) -> tuple:
+        if self._valid:
+            if inputs == self.inputs:
+                return self.outputs
+            previous = self.inputs
+            if all(inputs[k] == previous[k] for k in self._sensitive):
+                self.inputs = inputs
+                self._stale = True
+                return self.outputs
+        self.inputs = inputs
+        self._stale = False
+        child_outputs = self._child_outputs
+        # repeat until the parts' outputs settle; the parts are not sorted,
+        # so one may feed another that was evaluated before it
+        for _ in range(len(self._wiring) + 2):
+            results = self._evaluate(*inputs, *child_outputs, self._state, self._memories)
+            settled = True
+            for child, given, produced in self._wiring:
+                out = child.evaluate(results[given])
+                if out != tuple(child_outputs[produced]):
+                    child_outputs[produced] = out
+                    settled = False
+            if settled:
+                break
+        else:
+            raise HDLError("combinational loop between parts")
+        self.outputs = results[: self._output_count]
+        self._valid = True
+        return self.outputs
+
+    def tick(self) -> None:
+        # Expects evaluate() to have seen the current inputs. The clock is
+        # skipped when it cannot change anything: the hold pin is 0, or
+        # the last clock with the same inputs and state changed nothing.
+        if self.hold is not None and not self.inputs[self.hold]:
+            return
+        if self._stable and self.inputs == self._clocked:
+            return
+        if self._stale:
+            self._valid = False
+            self.evaluate(self.inputs)
+        self._clocked = self.inputs
+        self._pending = self._clock(
+            *self.inputs, *self._child_outputs, self._state, self._memories
+        )
+        for child in self._children:
+            child.tick()
+
+    def tock(self) -> bool:
+        """Commits the pending clock and returns whether any state changed."""
+        pending = self._pending
+        if pending is None:
+            return False
+        self._pending = None
+        n = len(self._state)
+        changed = pending[:n] != tuple(self._state)
+        if changed:
+            self._state[:] = pending[:n]
+        writes = pending[n:]
+        for i, m in enumerate(self._writable):
+            load, address, data = writes[3 * i : 3 * i + 3]
+            if load and self._memories[m][address] != data:
+                self._memories[m][address] = data
+                changed = True
+        for child in self._children:
+            if child.tock():
+                changed = True
+        self._stable = not changed
+        if changed:
+            self._valid = False
+        return changed
+
+    def invalidate(self) -> None:
+        self._valid = False
+        self._stale = False
+        self._stable = False
+        for child in self._children:
+            child.invalidate()
+
+    def memories(self) -> Iterable[Tuple[str, List[int]]]:
+        yield from zip(self._memory_names, self._memories)
+        for child in self._children:
+            yield from child.memories()
+
+    @property
+    def size(self) -> int:
+        return len(self._state) + sum(child.size for child in self._children)
+
+
+class _Model:
+    # array-backed stand-in for Bit, Register and the RAM chips
+    def __init__(self, name: str, words: int, inputs: Dict[str, int]):
+        pins = list(inputs)
+        self.name = name
+        self.memory = [0] * words
+        self._width = inputs["in"]
+        self._in = pins.index("in")
+        self.hold = pins.index("load")
+        self._address = pins.index("address") if "address" in pins else None
+        self.inputs: Optional[tuple] = None
+        self.outputs = (0,)
+        self._pending: Optional[Tuple[int, int]] = None
+
+    def evaluate(self, inputs: tuple) -> tuple:
+        self.inputs = inputs
+        address = 0 if self._address is None else inputs[self._address]
+        self.outputs = (self.memory[address],)
+        return self.outputs
+
+    def tick(self) -> None:
+        if self.inputs[self.hold]:
+            address = 0 if self._address is None else self.inputs[self._address]
+            self._pending = (address, self.inputs[self._in])
+
+    def tock(self) -> bool:
+        if self._pending is None:
+            return False
+        address, value = self._pending
+        self._pending = None
+        if self.memory[address] == value:
+            return False
+        self.memory[address] = value
+        return True
+
+    def invalidate(self) -> None:
+        pass
+
+    def memories(self) -> Iterable[Tuple[str, List[int]]]:
+        yield self.name, self.memory
+
+    @property
+    def size(self) -> int:
+        return len(self.memory) * self._width
+
+
+class EventChip(Chip):
+    """A chip simulated as a hierarchy of separately compiled parts.
+
+    Sequential parts of more than LEAF_SIZE nodes keep their own
+    compiled code, so chips too large to flatten (RAM4K, RAM16K, Memory,
+    Computer) can be simulated. A part is only re-evaluated when its
+    inputs or state changed, and only clocked when that may change its
+    state: not while its hold pin (found by constant folding, e.g. `load`
+    of the RAMs) is 0, nor again after a clock with the same inputs left
+    it unchanged. Parts named in `models` are replaced by array-backed
+    models (see MODELS).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        search_path: Optional[List[str]] = None,
+        cache_dir: Optional[str] = CACHE_DIR,
+        models: Iterable[str] = (),
+    ):
+        name, search_path = _locate(name, search_path)
+        self.name = name
+        library = _Library(search_path)
+        self.inputs, self.outputs = library.pins(name)
+        models = {_ALIASES.get(m, m) for m in models} - {name}
+        for m in models:
+            if m not in MODELS:
+                raise HDLError(f"no model for {m}")
+        opaque = frozenset(
+            part for part in library.parts(name)
+            if part in models
+            or (library.sequential(part) and library.size(part) > LEAF_SIZE)
+        )
+        modules: Dict[str, Dict[str, object]] = {}
+
+        def module(chip: str) -> Dict[str, object]:
+            if chip not in modules:
+                modules[chip] = _load_module(library, chip, cache_dir, opaque, describe)
+            return modules[chip]
+
+        def describe(chip: str) -> _PartInfo:
+            pins = list(library.pins(chip)[0])
+            if chip in models:
+                return _PartInfo("load", [p for p in pins if p == "address"])
+            m = module(chip)
+            return _PartInfo(
+                None if m["HOLD"] is None else pins[m["HOLD"]],
+                [pins[k] for k in m["SENSITIVE"]],
+            )
+
+        def build(chip: str):
+            if chip in models:
+                return _Model(chip, MODELS[chip], library.pins(chip)[0])
+            m = module(chip)
+            return _Level(m, [build(part) for part, _, _ in m["CHILDREN"]])
+
+        self._root = build(name)
+        self._sweep = None
+        self._values = {pin: 0 for pin in self.inputs}
+        self._output_index = {pin: k for k, pin in enumerate(self.outputs)}
+        self._outputs: Optional[tuple] = None
+
+    def eval(self) -> None:
+        self._outputs = self._root.evaluate(tuple(self._values.values()))
+
+    def tick(self) -> None:
+        self.eval()
+        self._root.tick()
+
+    def tock(self) -> None:
+        self._root.tock()
+        self._outputs = None
+
+    def memory(self, name: str, index: int = 0) -> List[int]:
+        """Also returns the contents of parts replaced by models, such as
+        RAM16K."""
+        # the caller may change the memory, so nothing cached can be trusted
+        self._root.invalidate()
+        self._outputs = None
+        return [m for n, m in self._root.memories() if n == name][index]
+
+    @property
+    def size(self) -> int:
+        return self._root.size
+
+
+def exhaustive_planes(widths: Dict[str, int]) -> Tuple[Dict[str, List[int]], int]:
+    """Bit-planes enumerating every input combination: vector k has the
+    bits of k spread over the pins in order, LSB first."""
+    lanes = 1 << sum(widths.values())
+    ones = (1 << lanes) - 1
+    planes: Dict[str, List[int]] = {}
+    j = 0
+    for pin, width in widths.items():
+        planes[pin] = []
+        for _ in range(width):
+            # 2^j zeros then 2^j ones, repeated across all lanes
+            half = 1 << j
+            pattern = ((1 << half) - 1) << half
+            planes[pin].append(pattern * (ones // ((1 << 2 * half) - 1)))
+            j += 1
+    return planes, lanes
+
+
+def random_planes(
+    widths: Dict[str, int], lanes: int, rng: random.Random
+) -> Dict[str, List[int]]:
+    return {
+        pin: [rng.getrandbits(lanes) for _ in range(width)]
+        for pin, width in widths.items()
+    }
+
+
+def lane(planes: List[int], k: int) -> int:
+    """Extracts vector k's value of a pin from its bit-planes."""
+    return sum((p >> k & 1) << i for i, p in enumerate(planes))
+
+
+# Specifications of the project 1 chips over bit-planes, used to check
+# the HDL implementations with sweeps. Each maps the input planes and
+# `ones` to the expected output planes.
+Spec = Callable[[Dict[str, List[int]], int], Dict[str, List[int]]]
+
+
+def _select(sel: List[int], k: int, ones: int) -> int:
+    # the lanes in which the sel bus equals k
+    chosen = ones
+    for j, bit in enumerate(sel):
+        chosen &= bit if k >> j & 1 else ones ^ bit
+    return chosen
+
+
+def _mux(buses: List[List[int]], sel: List[int], ones: int) -> List[int]:
+    out = [0] * len(buses[0])
+    for k, bus in enumerate(buses):
+        chosen = _select(sel, k, ones)
+        out = [o | b & chosen for o, b in zip(out, bus)]
+    return out
+
+
+def _dmux(names: str, p: Dict[str, List[int]], ones: int) -> Dict[str, List[int]]:
+    return {
+        name: [p["in"][0] & _select(p["sel"], k, ones)]
+        for k, name in enumerate(names)
+    }
+
+
+SPECS: Dict[str, Spec] = {
+    "Not": lambda p, ones: {"out": [ones ^ p["in"][0]]},
+    "And": lambda p, ones: {"out": [p["a"][0] & p["b"][0]]},
+    "Or": lambda p, ones: {"out": [p["a"][0] | p["b"][0]]},
+    "Xor": lambda p, ones: {"out": [p["a"][0] ^ p["b"][0]]},
+    "Mux": lambda p, ones: {"out": _mux([p["a"], p["b"]], p["sel"], ones)},
+    "DMux": lambda p, ones: _dmux("ab", p, ones),
+    "Not16": lambda p, ones: {"out": [ones ^ x for x in p["in"]]},
+    "And16": lambda p, ones: {"out": [x & y for x, y in zip(p["a"], p["b"])]},
+    "Or16": lambda p, ones: {"out": [x | y for x, y in zip(p["a"], p["b"])]},
+    "Mux16": lambda p, ones: {"out": _mux([p["a"], p["b"]], p["sel"], ones)},
+    "Or8Way": lambda p, ones: {
+        "out": [p["in"][0] | p["in"][1] | p["in"][2] | p["in"][3]
+                | p["in"][4] | p["in"][5] | p["in"][6] | p["in"][7]]
+    },
+    "Mux4Way16": lambda p, ones: {
+        "out": _mux([p[x] for x in "abcd"], p["sel"], ones)
+    },
+    "Mux8Way16": lambda p, ones: {
+        "out": _mux([p[x] for x in "abcdefgh"], p["sel"], ones)
+    },
+    "DMux4Way": lambda p, ones: _dmux("abcd", p, ones),
+    "DMux8Way": lambda p, ones: _dmux("abcdefgh", p, ones),
+}
+
+
+def verify(
+    chip: Chip,
+    spec: Spec,
+    max_bits: int = 20,
+    samples: int = 1 << 16,
+    seed: int = 0,
+) -> Tuple[int, bool, Optional[str]]:
+    """Checks a combinational chip against `spec` in one sweep.
+
+    Every input combination is tried if there are at most `max_bits`
+    input bits, otherwise `samples` random vectors. Returns the number of
+    vectors, whether that was exhaustive, and a description of the first
+    failing vector (None if all passed).
+    """
+    exhaustive = sum(chip.inputs.values()) <= max_bits
+    if exhaustive:
+        planes, lanes = exhaustive_planes(chip.inputs)
+    else:
+        lanes = samples
+        planes = random_planes(chip.inputs, lanes, random.Random(seed))
+    ones = (1 << lanes) - 1
+    got = chip.sweep(planes, lanes)
+    expected = spec(planes, ones)
+    diff = 0
+    for pin in chip.outputs:
+        for x, y in zip(got[pin], expected[pin]):
+            diff |= x ^ y
+    if not diff:
+        return lanes, exhaustive, None
+    k = (diff & -diff).bit_length() - 1
+    values = " ".join(f"{pin}={lane(planes[pin], k)}" for pin in chip.inputs)
+    outputs = " ".join(
+        f"{pin}={lane(got[pin], k)} (expected {lane(expected[pin], k)})"
+        for pin in chip.outputs
+    )
+    return lanes, exhaustive, f"{values}: {outputs}"
+
+
+def _bench(chip: Chip, cycles: int) -> None:
+    pins = list(chip.inputs.items())
+    start = time.perf_counter()
+    for i in range(cycles):
+        for j, (pin, width) in enumerate(pins):
+            chip.set(pin, (i * 40503 + j * 9973) & ((1 << width) - 1))
+        chip.tick()
+        chip.tock()
+        chip.eval()
+    elapsed = time.perf_counter() - start
+    print(f"{cycles / elapsed:.0f} cycles/s, {elapsed / cycles * 1e6:.1f} us/cycle")
+
+
+def _sweep(chip: Chip, max_bits: int, samples: int) -> bool:
+    if chip.name not in SPECS:
+        print(f"{chip.name}: no specification, skipped")
+        return True
+    start = time.perf_counter()
+    lanes, exhaustive, failure = verify(chip, SPECS[chip.name], max_bits, samples)
+    elapsed = time.perf_counter() - start
+    kind = "all" if exhaustive else "random"
+    print(
+        f"{chip.name}: {kind} {lanes} vectors of {sum(chip.inputs.values())} bits"
+        f" in {elapsed:.3f}s: {failure or 'ok'}"
+    )
+    return failure is None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("hdl_files", nargs="+")
+    parser.add_argument(
+        "--bench",
+        type=int,
+        default=10000,
+        metavar="N",
+        help="time N tick/tock cycles with changing inputs",
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="check combinational chips against their specification instead",
+    )
+    parser.add_argument(
+        "--max-bits",
+        type=int,
+        default=20,
+        help="sweep every input combination up to this many input bits",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=1 << 16,
+        help="random vectors to sweep for chips with more input bits",
+    )
+    parser.add_argument(
+        "--event",
+        action="store_true",
+        help="simulate as an EventChip (chips too large to flatten always are)",
+    )
+    parser.add_argument(
+        "--model",
+        action="append",
+        default=[],
+        choices=sorted(MODELS),
+        help="replace this part with an array-backed model (implies --event)",
+    )
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+    cache_dir = None if args.no_cache else CACHE_DIR
+    ok = True
+    for path in args.hdl_files:
+        start = time.perf_counter()
+        if args.event or args.model:
+            chip = EventChip(path, cache_dir=cache_dir, models=args.model)
+        else:
+            try:
+                chip = Chip(path, cache_dir=cache_dir)
+            except HDLError:
+                chip = EventChip(path, cache_dir=cache_dir)
+        if args.sweep:
+            ok = _sweep(chip, args.max_bits, args.samples) and ok
+            continue
+        print(f"loaded {chip.name} in {time.perf_counter() - start:.3f}s, {chip.size} DFFs")
+        _bench(chip, args.bench)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
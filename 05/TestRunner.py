@@ -0,0 +1,710 @@
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from CPUEmulator import KBD, CPUEmulator, decode
+from HardwareSimulator import MODELS, Chip, EventChip, HDLError
+from VMEmulator import VMEmulator, VMError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "06"))
+import Assembler  # noqa: E402
+
+
+_TOKENS = re.compile(r'//[^\n]*|/\*.*?\*/|"[^"]*"|[{},;]|[^\s{},;]+', re.DOTALL)
+_PIN = re.compile(r"([\w-]+)(?:\[(\d*)\])?$")
+_FORMAT = re.compile(r"%([BDXS])(\d+)\.(\d+)\.(\d+)$")
+
+# cap on `while` iterations; scripts that wait for a key press never finish
+_MAX_WHILE_ITERATIONS = 1_000_000
+
+
+class ScriptError(Exception):
+    pass
+
+
+class UnsupportedScript(ScriptError):
+    pass
+
+
+def _to_signed(value: int) -> int:
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+def _parse_value(s: str) -> int:
+    if s.startswith("%B"):
+        return _to_signed(int(s[2:], 2))
+    elif s.startswith("%X"):
+        return _to_signed(int(s[2:], 16))
+    elif s.startswith("%D"):
+        return int(s[2:])
+    return int(s)
+
+
+def _split_pin(pin: str) -> Tuple[str, Optional[str]]:
+    m = _PIN.match(pin)
+    if not m:
+        raise ScriptError(f"bad pin name: {pin}")
+    return m.group(1), m.group(2)
+
+
+class _Chip:
+    """A simulated part as seen by a test script."""
+
+    def get(self, name: str, index: Optional[str]) -> int:
+        raise ScriptError(f"unknown pin: {name}")
+
+    def set(self, name: str, index: Optional[str], value: int) -> None:
+        raise ScriptError(f"cannot set pin: {name}")
+
+    def eval(self) -> None:
+        pass
+
+    def tick(self) -> None:
+        pass
+
+    def tock(self) -> None:
+        pass
+
+    def run(self, cycles: int) -> None:
+        for _ in range(cycles):
+            self.tick()
+            self.tock()
+
+    def press_key(self, code: int) -> None:
+        raise ScriptError("no keyboard to press keys on")
+
+
+class _ProgramChip(_Chip):
+    # the CPU emulator itself, as used by `load Xxx.hack/asm` scripts
+    def __init__(self, program: Union[str, List[int]]):
+        self._emulator = CPUEmulator()
+        self._emulator.load(program)
+
+    def get(self, name: str, index: Optional[str]) -> int:
+        e = self._emulator
+        if name == "RAM":
+            return e.peek(int(index))
+        elif name == "ROM":
+            return _to_signed(e.rom[int(index)])
+        elif name == "PC":
+            return e.pc
+        elif name == "A":
+            return _to_signed(e.a)
+        elif name == "D":
+            return e.d
+        return super().get(name, index)
+
+    def set(self, name: str, index: Optional[str], value: int) -> None:
+        e = self._emulator
+        if name == "RAM":
+            e.poke(int(index), value)
+        elif name == "PC":
+            e.pc = value
+        elif name == "A":
+            e.a = value & 0xFFFF
+        elif name == "D":
+            e.d = value
+        else:
+            super().set(name, index, value)
+
+    def run(self, cycles: int) -> None:
+        self._emulator.run(cycles)
+
+    def press_key(self, code: int) -> None:
+        self._emulator.poke(KBD, code)
+
+    def tock(self) -> None:
+        e = self._emulator
+        if e.run(1, stop_at_halt=False) == 0:
+            # past the end of the program ROM holds 0, i.e. @0
+            e.a = e.rom[e.pc]
+            e.pc = (e.pc + 1) & 0x7FFF
+
+
+class _ComputerChip(_ProgramChip):
+    # Computer.hdl: the emulator plus the reset input and the part names
+    # (ARegister, DRegister, PC, RAM16K, ROM32K) used by Computer*.tst
+    def __init__(self):
+        super().__init__([])
+        self._reset = 0
+
+    def get(self, name: str, index: Optional[str]) -> int:
+        if name == "reset":
+            return self._reset
+        return super().get(
+            {"ARegister": "A", "DRegister": "D", "RAM16K": "RAM"}.get(name, name),
+            index,
+        )
+
+    def set(self, name: str, index: Optional[str], value: int) -> None:
+        if name == "reset":
+            self._reset = value
+        else:
+            super().set({"RAM16K": "RAM"}.get(name, name), index, value)
+
+    def load_rom(self, program: str) -> None:
+        ram = self._emulator.ram
+        self._emulator.load(program)
+        self._emulator.ram = ram
+
+    def run(self, cycles: int) -> None:
+        _Chip.run(self, cycles)
+
+    def tock(self) -> None:
+        super().tock()
+        if self._reset:
+            self._emulator.pc = 0
+
+
+class _CPUChip(_Chip):
+    # CPU.hdl: registers latch their inputs on tick and drive their outputs
+    # on tock; DRegister[] shows the latched value, as the Java simulator does
+    def __init__(self):
+        self._pins = {"inM": 0, "instruction": 0, "reset": 0}
+        self._a = 0
+        self._d = 0
+        self._pc = 0
+        self._next_a = 0
+        self._next_d = 0
+        self._next_pc = 0
+
+    def _alu(self) -> Tuple[int, bool, tuple]:
+        instruction = decode(self._pins["instruction"] & 0xFFFF)
+        if not instruction[0]:
+            return 0, False, instruction
+        _, comp, use_m, _, _, dest_m, _ = instruction
+        out = _to_signed(comp(self._d, self._pins["inM"] if use_m else self._a))
+        return out, dest_m, instruction
+
+    def get(self, name: str, index: Optional[str]) -> int:
+        if name in self._pins:
+            return self._pins[name]
+        elif name == "outM":
+            return self._alu()[0]
+        elif name == "writeM":
+            return int(self._alu()[1])
+        elif name == "addressM":
+            return self._a & 0x7FFF
+        elif name == "pc" or name == "PC":
+            return self._pc
+        elif name == "DRegister":
+            return self._next_d
+        elif name == "ARegister":
+            return _to_signed(self._a)
+        return super().get(name, index)
+
+    def set(self, name: str, index: Optional[str], value: int) -> None:
+        if name in self._pins:
+            self._pins[name] = value
+        else:
+            super().set(name, index, value)
+
+    def tick(self) -> None:
+        out, _, instruction = self._alu()
+        next_pc = self._pc + 1
+        if not instruction[0]:
+            self._next_a = instruction[1]
+        else:
+            _, _, _, dest_a, dest_d, _, (lt, eq, gt) = instruction
+            self._next_a = out & 0xFFFF if dest_a else self._a
+            if (lt and out < 0) or (eq and out == 0) or (gt and out > 0):
+                next_pc = self._a
+            if dest_d:
+                self._next_d = out
+        self._next_pc = 0 if self._pins["reset"] else next_pc & 0x7FFF
+
+    def tock(self) -> None:
+        self._a = self._next_a
+        self._d = self._next_d
+        self._pc = self._next_pc
+
+
+class _MemoryChip(_Chip):
+    # Memory.hdl: 16K RAM, 8K screen and the keyboard register
+    def __init__(self):
+        self._pins = {"in": 0, "load": 0, "address": 0}
+        self._memory = [0] * (KBD + 1)
+        self._pending: Optional[Tuple[int, int]] = None
+
+    def get(self, name: str, index: Optional[str]) -> int:
+        if name in self._pins:
+            return self._pins[name]
+        elif name == "out":
+            address = self._pins["address"] & 0x7FFF
+            return self._memory[address] if address <= KBD else 0
+        return super().get(name, index)
+
+    def set(self, name: str, index: Optional[str], value: int) -> None:
+        if name in self._pins:
+            self._pins[name] = value
+        else:
+            super().set(name, index, value)
+
+    def press_key(self, code: int) -> None:
+        self._memory[KBD] = code
+
+    def tick(self) -> None:
+        address = self._pins["address"] & 0x7FFF
+        if self._pins["load"] and address < KBD:
+            self._pending = (address, self._pins["in"])
+
+    def tock(self) -> None:
+        if self._pending is not None:
+            address, value = self._pending
+            self._memory[address] = value
+            self._pending = None
+
+
+class _HDLChip(_Chip):
+    # a chip compiled from its HDL by the hardware simulator; chips too
+    # large to flatten, and `behavioral` runs, use an EventChip
+    def __init__(self, path: str, behavioral: bool = False):
+        if behavioral:
+            self._chip = EventChip(path, models=MODELS)
+            return
+        try:
+            self._chip = Chip(path)
+        except HDLError:
+            self._chip = EventChip(path)
+
+    def get(self, name: str, index: Optional[str]) -> int:
+        widths = {**self._chip.inputs, **self._chip.outputs}
+        if name not in widths:
+            memory = self._part_memory(name, index)
+            if memory is None:
+                return super().get(name, index)
+            return _to_signed(memory[int(index)])
+        value = self._chip.get(name)
+        return _to_signed(value) if widths[name] == 16 else value
+
+    def set(self, name: str, index: Optional[str], value: int) -> None:
+        if name not in self._chip.inputs:
+            memory = self._part_memory(name, index)
+            if memory is None:
+                super().set(name, index, value)
+            memory[int(index)] = value & 0xFFFF
+            return
+        self._chip.set(name, value)
+
+    def load_rom(self, program: str) -> None:
+        with open(program) as f:
+            words = [int(l.strip(), 2) for l in f if l.strip()]
+        try:
+            rom = self._chip.memory("ROM32K")
+        except IndexError:
+            raise ScriptError("ROM32K is only available on Computer")
+        rom[: len(words)] = words
+
+    def _part_memory(self, name: str, index: Optional[str]) -> Optional[List[int]]:
+        # Screen[], RAM16K[] and the like, where the part is a built-in
+        # memory or replaced by a model
+        if index is None or not index.isdigit():
+            return None
+        try:
+            return self._chip.memory(name)
+        except IndexError:
+            return None
+
+    def eval(self) -> None:
+        self._chip.eval()
+
+    def tick(self) -> None:
+        self._chip.tick()
+
+    def tock(self) -> None:
+        self._chip.tock()
+
+    def press_key(self, code: int) -> None:
+        try:
+            self._chip.memory("Keyboard")[0] = code & 0xFFFF
+        except IndexError:
+            super().press_key(code)
+
+
+class _VMChip(_Chip):
+    # the VM emulator, as used by `load` and `load Xxx.vm` scripts; the
+    # segment names stand for the pointers, or with an index for the
+    # segment's entries
+    _POINTERS = {"sp": 0, "local": 1, "argument": 2, "this": 3, "that": 4}
+
+    def __init__(self, path: str):
+        self._emulator = VMEmulator()
+        self._emulator.load(path)
+
+    def _address(self, name: str, index: Optional[str]) -> Optional[int]:
+        ram = self._emulator.ram
+        if name == "RAM" and index is not None:
+            return int(index)
+        elif name == "temp" and index is not None:
+            return 5 + int(index)
+        elif name in self._POINTERS and index is None:
+            return self._POINTERS[name]
+        elif name in self._POINTERS and name != "sp":
+            return ram[self._POINTERS[name]] + int(index)
+        return None
+
+    def get(self, name: str, index: Optional[str]) -> int:
+        address = self._address(name, index)
+        if address is None:
+            return super().get(name, index)
+        return self._emulator.peek(address)
+
+    def set(self, name: str, index: Optional[str], value: int) -> None:
+        address = self._address(name, index)
+        if address is None:
+            super().set(name, index, value)
+        else:
+            self._emulator.poke(address, value)
+
+    def run(self, cycles: int) -> None:
+        self._emulator.run(cycles, stop_at_halt=False)
+
+    def press_key(self, code: int) -> None:
+        self._emulator.poke(KBD, code)
+
+
+_BUILTIN_CHIPS = {
+    "Computer": _ComputerChip,
+    "CPU": _CPUChip,
+    "Memory": _MemoryChip,
+}
+
+
+def _parse(tokens: List[str], i: int = 0) -> Tuple[List[list], int]:
+    # Parses commands up to a closing `}` (or the end) into a list of
+    # word lists; `repeat` and `while` carry their body as the last item.
+    commands: List[list] = []
+    words: List[str] = []
+    while i < len(tokens):
+        t = tokens[i]
+        i += 1
+        if t in [",", ";"]:
+            if words:
+                commands.append(words)
+            words = []
+        elif t == "{":
+            body, i = _parse(tokens, i)
+            commands.append(words + [body])
+            words = []
+        elif t == "}":
+            break
+        else:
+            words.append(t)
+    if words:
+        commands.append(words)
+    return commands, i
+
+
+class TestScript:
+    def __init__(
+        self,
+        path: str,
+        simulate_hdl: bool = False,
+        behavioral: bool = False,
+        press_keys: bool = False,
+    ):
+        """`simulate_hdl` compiles Computer, CPU and Memory from their HDL
+        instead of using the emulator-backed models; `behavioral` swaps
+        the RAM chips and registers below the tested chip for models.
+        `press_keys` answers `while out <> K` keyboard waits by pressing K.
+        """
+        self._path = path
+        self._simulate_hdl = simulate_hdl
+        self._behavioral = behavioral
+        self._press_keys = press_keys
+        self._dir = os.path.dirname(path)
+        with open(path) as f:
+            tokens = [
+                t for t in _TOKENS.findall(f.read())
+                if not t.startswith("//") and not t.startswith("/*")
+            ]
+        self._commands, _ = _parse(tokens)
+        self._chip: Optional[_Chip] = None
+        self._output_file: Optional[str] = None
+        self._compare_file: Optional[str] = None
+        self._output_list: List[Tuple[str, Optional[str], str, int, int, int]] = []
+        self._lines: List[str] = []
+        self._time = 0
+        self._half_cycle = False
+        self._load_time = 0.0
+
+    @property
+    def time(self) -> int:
+        """Clock cycles run so far."""
+        return self._time
+
+    @property
+    def load_time(self) -> float:
+        """Seconds spent loading (and compiling) chips and programs."""
+        return self._load_time
+
+    def run(self) -> Tuple[bool, str]:
+        """Runs the script, writes its output file and compares it.
+
+        Returns whether the output matched and a short message.
+        """
+        self._execute(self._commands)
+        if self._output_file is not None:
+            with open(self._output_file, "w") as f:
+                f.write("".join(l + "\n" for l in self._lines))
+        if self._compare_file is None:
+            return True, "no compare file"
+        with open(self._compare_file) as f:
+            expected = [l.rstrip("\r\n") for l in f if l.strip()]
+        for lineno, (want, got) in enumerate(zip(expected, self._lines), 1):
+            if not _matches(want, got):
+                return False, f"line {lineno}: expected {want!r}, got {got!r}"
+        if len(expected) != len(self._lines):
+            return False, f"{len(self._lines)} lines output, {len(expected)} expected"
+        return True, f"{len(self._lines)} lines match"
+
+    def _execute(self, commands: List[list]) -> None:
+        for words in commands:
+            command = words[0]
+            if command == "load":
+                start = time.perf_counter()
+                self._load(words[1] if len(words) > 1 else None)
+                self._load_time += time.perf_counter() - start
+            elif command == "output-file":
+                self._output_file = os.path.join(self._dir, words[1])
+            elif command == "compare-to":
+                self._compare_file = os.path.join(self._dir, words[1])
+            elif command == "output-list":
+                self._set_output_list(words[1:])
+            elif command == "set":
+                name, index = _split_pin(words[1])
+                self._require_chip().set(name, index, _parse_value(words[2]))
+            elif command == "eval":
+                self._require_chip().eval()
+            elif command == "tick":
+                self._require_chip().tick()
+                self._half_cycle = True
+            elif command == "tock":
+                self._require_chip().tock()
+                self._half_cycle = False
+                self._time += 1
+            elif command == "ticktock":
+                self._require_chip().run(1)
+                self._time += 1
+            elif command == "output":
+                self._output()
+            elif command == "repeat":
+                self._repeat(words)
+            elif command == "while":
+                self._while(words)
+            elif command == "ROM32K" and words[1] == "load":
+                self._load_rom(os.path.join(self._dir, words[2]))
+            elif command in ["echo", "clear-echo"]:
+                pass
+            elif command == "vmstep":
+                self._require_chip().run(1)
+                self._time += 1
+            else:
+                raise ScriptError(f"unknown command: {' '.join(words)}")
+
+    def _require_chip(self) -> _Chip:
+        if self._chip is None:
+            raise ScriptError("no chip or program loaded")
+        return self._chip
+
+    def _load(self, name: Optional[str]) -> None:
+        if name is None or name.endswith(".vm"):
+            self._chip = _VMChip(os.path.join(self._dir, name or ""))
+            return
+        path = os.path.join(self._dir, name)
+        base, ext = os.path.splitext(name)
+        if ext == ".hack":
+            self._chip = _ProgramChip(path)
+        elif ext == ".asm":
+            if not os.path.exists(path):
+                raise ScriptError(f"{name} not found; translate the .vm files first")
+            self._chip = _ProgramChip(_assemble(path))
+        elif ext == ".hdl" and base in _BUILTIN_CHIPS and not self._simulate_hdl:
+            self._chip = _BUILTIN_CHIPS[base]()
+        elif ext == ".hdl":
+            self._chip = _HDLChip(path, self._behavioral)
+        else:
+            raise UnsupportedScript(f"cannot load {name}")
+
+    def _load_rom(self, path: str) -> None:
+        chip = self._require_chip()
+        if isinstance(chip, (_ComputerChip, _HDLChip)):
+            chip.load_rom(path)
+        else:
+            raise ScriptError("ROM32K is only available on Computer")
+
+    def _set_output_list(self, items: List[str]) -> None:
+        self._output_list = []
+        for item in items:
+            pin, _, fmt = item.partition("%")
+            m = _FORMAT.match("%" + fmt if fmt else "%B1.16.1")
+            if not m:
+                raise ScriptError(f"bad output format: {item}")
+            name, index = _split_pin(pin)
+            kind, left, width, right = m.groups()
+            self._output_list.append(
+                (name, index, kind, int(left), int(width), int(right))
+            )
+        header = []
+        for name, index, kind, left, width, right in self._output_list:
+            total = left + width + right
+            title = (name if index is None else f"{name}[{index}]")[:total]
+            padding = (total - len(title)) // 2
+            header.append(" " * padding + title + " " * (total - len(title) - padding))
+        self._lines.append("|" + "|".join(header) + "|")
+
+    def _output(self) -> None:
+        columns = []
+        for name, index, kind, left, width, right in self._output_list:
+            if name == "time":
+                s = f"{self._time}{'+' if self._half_cycle else ''}".ljust(width)
+            else:
+                value = self._require_chip().get(name, index)
+                if kind == "D":
+                    s = str(value).rjust(width)
+                elif kind == "X":
+                    s = format(value & 0xFFFF, f"0{width}X")[-width:]
+                elif kind == "B":
+                    s = format(value & 0xFFFF, f"0{width}b")[-width:]
+                else:
+                    s = str(value).ljust(width)
+            columns.append(" " * left + s + " " * right)
+        self._lines.append("|" + "|".join(columns) + "|")
+
+    def _repeat(self, words: list) -> None:
+        body = words[-1]
+        count = int(words[1]) if len(words) == 3 else None
+        if count is None:
+            raise UnsupportedScript("repeat without a count never ends")
+        if body in [[["ticktock"]], [["vmstep"]]]:
+            # `repeat n { ticktock; }` runs the chip at full speed
+            self._require_chip().run(count)
+            self._time += count
+            return
+        for _ in range(count):
+            self._execute(body)
+
+    def _while(self, words: list) -> None:
+        _, pin, op, value, body = words
+        name, index = _split_pin(pin)
+        value = _parse_value(value)
+        compare = {
+            "=": lambda x: x == value,
+            "<>": lambda x: x != value,
+            "<": lambda x: x < value,
+            ">": lambda x: x > value,
+            "<=": lambda x: x <= value,
+            ">=": lambda x: x >= value,
+        }[op]
+        if self._press_keys and op == "<>":
+            self._require_chip().press_key(value)
+        for _ in range(_MAX_WHILE_ITERATIONS):
+            if not compare(self._require_chip().get(name, index)):
+                return
+            self._execute(body)
+        raise ScriptError(
+            f"while {pin} {op} {words[3]} did not end; the script may wait for input"
+        )
+
+
+def _matches(expected: str, actual: str) -> bool:
+    # `*` in a compare file matches any character
+    if len(expected) != len(actual):
+        return False
+    return all(e == a or e == "*" for e, a in zip(expected, actual))
+
+
+def _assemble(path: str) -> List[int]:
+    with open(path) as f:
+        return list(Assembler.assemble(f))
+
+
+def run_script(
+    path: str,
+    simulate_hdl: bool = False,
+    behavioral: bool = False,
+    press_keys: bool = False,
+    timed: bool = False,
+) -> Tuple[str, str, str]:
+    """Returns (path, status, message) where status is ok, FAIL, skip or ERROR.
+
+    With `timed` the message also gives the clock rate of the script.
+    """
+    start = time.perf_counter()
+    try:
+        script = TestScript(path, simulate_hdl, behavioral, press_keys)
+        passed, message = script.run()
+    except UnsupportedScript as e:
+        return path, "skip", str(e)
+    except (ScriptError, HDLError, VMError, OSError, ValueError) as e:
+        return path, "ERROR", str(e)
+    except (KeyError, IndexError) as e:
+        # a malformed script, such as an address out of range, stops only
+        # itself and not the other scripts of the run
+        return path, "ERROR", f"{type(e).__name__}: {e}"
+    if timed:
+        elapsed = time.perf_counter() - start - script.load_time
+        message += (
+            f" (loaded in {script.load_time:.2f}s, {script.time} ticks"
+            f" in {elapsed:.2f}s, {script.time / elapsed:.0f} ticks/s)"
+        )
+    return path, "ok" if passed else "FAIL", message
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help=".tst files or directories")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--hdl",
+        action="store_true",
+        help="simulate Computer, CPU and Memory from their HDL as well",
+    )
+    parser.add_argument(
+        "--behavioral",
+        action="store_true",
+        help="replace RAMs and registers below the tested chip with models",
+    )
+    parser.add_argument(
+        "--press-keys",
+        action="store_true",
+        help="press the key a script waits for with `while out <> K`",
+    )
+    parser.add_argument(
+        "--time",
+        action="store_true",
+        help="report the ticks per second of each script",
+    )
+    args = parser.parse_args()
+    scripts = []
+    for p in args.paths:
+        if os.path.isdir(p):
+            for root, _, files in os.walk(p):
+                scripts += [os.path.join(root, f) for f in files if f.endswith(".tst")]
+        else:
+            scripts.append(p)
+    scripts.sort()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        n = len(scripts)
+        results = list(executor.map(
+            run_script,
+            scripts,
+            [args.hdl] * n,
+            [args.behavioral] * n,
+            [args.press_keys] * n,
+            [args.time] * n,
+        ))
+    counts: Dict[str, int] = {}
+    for path, status, message in results:
+        print(f"{status:5} {path}: {message}")
+        counts[status] = counts.get(status, 0) + 1
+    print(", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    sys.exit(1 if counts.get("FAIL") or counts.get("ERROR") else 0)
+
+
+if __name__ == "__main__":
+    main()
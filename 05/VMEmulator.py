@@ -0,0 +1,1074 @@
+import argparse
+import os
+import sys
+from array import array
+from typing import Callable, Collection, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "08"))
+from vm_translator import Command, CommandType, Parser  # noqa: E402
+
+
+RAM_SIZE = 32768
+SP = 0
+LCL = 1
+ARG = 2
+THIS = 3
+THAT = 4
+TEMP = 5
+STATIC = 16
+SCREEN = 16384
+KBD = 24576
+
+# opcodes of predecoded commands, roughly in order of how often compiled
+# Jack code runs them; the run loop tests them in this order
+(
+    _PUSH_CONSTANT,
+    _PUSH_LOCAL,
+    _PUSH_ARGUMENT,
+    _POP_LOCAL,
+    _ADD,
+    _IF_GOTO,
+    _GOTO,
+    _PUSH_RAM,
+    _POP_RAM,
+    _PUSH_THAT,
+    _PUSH_THIS,
+    _POP_THAT,
+    _POP_THIS,
+    _POP_ARGUMENT,
+    _SUB,
+    _LT,
+    _GT,
+    _EQ,
+    _NOT,
+    _AND,
+    _OR,
+    _NEG,
+    _CALL,
+    _NATIVE,
+    _FUNCTION,
+    _RETURN,
+    _HALT,
+) = range(27)
+
+_ARITHMETIC = {
+    "add": _ADD,
+    "sub": _SUB,
+    "neg": _NEG,
+    "eq": _EQ,
+    "gt": _GT,
+    "lt": _LT,
+    "and": _AND,
+    "or": _OR,
+    "not": _NOT,
+}
+
+# segments addressed through a base pointer -> (push, pop) opcodes
+_POINTER_SEGMENTS = {
+    "local": (_PUSH_LOCAL, _POP_LOCAL),
+    "argument": (_PUSH_ARGUMENT, _POP_ARGUMENT),
+    "this": (_PUSH_THIS, _POP_THIS),
+    "that": (_PUSH_THAT, _POP_THAT),
+}
+
+
+# binary operations as Python source; both operands are 16-bit values
+_BINARY_SOURCE = {
+    _ADD: "(({a} + {b} + 32768) & 65535) - 32768",
+    _SUB: "(({a} - {b} + 32768) & 65535) - 32768",
+    _EQ: "-({a} == {b})",
+    _GT: "-({a} > {b})",
+    _LT: "-({a} < {b})",
+    _AND: "{a} & {b}",
+    _OR: "{a} | {b}",
+}
+
+
+class VMError(Exception):
+    pass
+
+
+def _word(value: int) -> int:
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+class _NativeOS:
+    # Python versions of the 12/ OS functions, which the emulator runs in
+    # place of calls of the compiled Jack code. They follow the Jack code
+    # step by step, with its 16-bit arithmetic and its statics, so that
+    # they leave RAM as the Jack code does, except for the temp segment
+    # and the stack above SP. Where the Jack code would loop forever,
+    # they raise VMError instead.
+
+    def __init__(self, ram: array, static: Callable[[str], int]):
+        self.ram = ram
+        self._memory = static("Memory.0")
+        self._free_list = static("Memory.1")
+        self._color = static("Screen.0")
+
+    # Math
+
+    def abs(self, x: int) -> int:
+        return _word(-x) if x < 0 else x
+
+    def multiply(self, x: int, y: int) -> int:
+        # adding the shifted x for each bit of y is x * y in 16 bits
+        return _word(x * y)
+
+    def divide(self, x: int, y: int) -> int:
+        call = f"Math.divide({x}, {y})"
+        neg = (x < 0 and y > 0) or (x > 0 and y < 0)
+        x = self.abs(x)
+        y = self.abs(y)
+        result = 0
+        seen = set()
+        while not x < y:
+            if x in seen:
+                raise VMError(f"{call} does not return")
+            seen.add(x)
+            i = 1
+            q = y
+            while _word(x - q) > q:
+                # q reaches 0 within 16 doublings and then stays there
+                if q == 0:
+                    raise VMError(f"{call} does not return")
+                q = _word(q + q)
+                i = _word(i + i)
+            x = _word(x - q)
+            result = _word(result + i)
+        return _word(-result) if neg else result
+
+    def sqrt(self, x: int) -> int:
+        call = f"Math.sqrt({x})"
+        x = _word(x - 1)
+        n = 0
+        j = 1
+        while not x < _word(j - 1):
+            if j == 0:
+                raise VMError(f"{call} does not return")
+            j = _word(j + j)
+            n = _word(n + 1)
+        j = self.divide(n, 2)
+        y = 0
+        while not j < 0:
+            i = j
+            n = 1
+            while i > 0:
+                n = _word(n + n)
+                i -= 1
+            val = _word(self.multiply(_word(y + n), _word(y + n)) - 1)
+            if not val > x and val > 0:
+                y = _word(y + n)
+            j -= 1
+        return y
+
+    def max(self, a: int, b: int) -> int:
+        return a if a > b else b
+
+    def min(self, a: int, b: int) -> int:
+        return b if a > b else a
+
+    # Memory
+
+    def _address(self, i: int) -> int:
+        # memory[i], where memory is Memory's base address static
+        return (self.ram[self._memory] + i) & 0x7FFF
+
+    def peek(self, address: int) -> int:
+        return self.ram[self._address(address)]
+
+    def poke(self, address: int, value: int) -> int:
+        self.ram[self._address(address)] = value
+        return 0
+
+    def alloc(self, size: int) -> int:
+        ram = self.ram
+        segment = ram[self._free_list]
+        # the walk does not change RAM, so it is stuck once it has taken
+        # more steps than there are segment values
+        for _ in range(0x10000):
+            if ram[self._address(segment)] > size:
+                break
+            segment = ram[self._address(segment + 1)]
+        else:
+            raise VMError(f"Memory.alloc({size}) does not return")
+        original_size = ram[self._address(segment)]
+        if original_size < _word(size + 3):
+            ram[self._free_list] = ram[self._address(segment + 1)]
+        else:
+            ram[self._address(segment)] = _word(size + 1)
+            ram[self._free_list] = _word(ram[self._free_list] + _word(size + 1))
+            ram[self._address(ram[self._free_list])] = _word(
+                original_size - _word(size + 1)
+            )
+        return _word(segment + 1)
+
+    def de_alloc(self, o: int) -> int:
+        ram = self.ram
+        original_free_list = ram[self._free_list]
+        ram[self._free_list] = _word(o - 1)
+        ram[self._address(o)] = original_free_list
+        return 0
+
+    # Array
+
+    def array_new(self, size: int) -> int:
+        return self.alloc(size)
+
+    def array_dispose(self, this: int) -> int:
+        return self.de_alloc(this)
+
+    # String: field 0 is the length, field 1 the character array; fields
+    # are read again wherever the Jack code reads them
+
+    def _field(self, this: int, i: int) -> int:
+        return (this + i) & 0x7FFF
+
+    def _char(self, this: int, j: int) -> int:
+        return (self.ram[self._field(this, 1)] + j) & 0x7FFF
+
+    def string_new(self, max_length: int) -> int:
+        ram = self.ram
+        this = self.alloc(2)
+        ram[self._field(this, 1)] = 0 if max_length == 0 else self.alloc(max_length)
+        ram[self._field(this, 0)] = 0
+        return this
+
+    def string_dispose(self, this: int) -> int:
+        s = self.ram[self._field(this, 1)]
+        if s != 0:
+            self.de_alloc(s)
+        return 0
+
+    def string_length(self, this: int) -> int:
+        return self.ram[self._field(this, 0)]
+
+    def char_at(self, this: int, j: int) -> int:
+        return self.ram[self._char(this, j)]
+
+    def set_char_at(self, this: int, j: int, c: int) -> int:
+        self.ram[self._char(this, j)] = c
+        return 0
+
+    def append_char(self, this: int, c: int) -> int:
+        ram = self.ram
+        ram[self._char(this, ram[self._field(this, 0)])] = c
+        ram[self._field(this, 0)] = _word(ram[self._field(this, 0)] + 1)
+        return this
+
+    def erase_last_char(self, this: int) -> int:
+        ram = self.ram
+        ram[self._field(this, 0)] = _word(ram[self._field(this, 0)] - 1)
+        return 0
+
+    def int_value(self, this: int) -> int:
+        ram = self.ram
+        i = 0
+        v = 0
+        neg = False
+        while i < ram[self._field(this, 0)]:
+            d = ram[self._char(this, i)]
+            if d == 45:
+                neg = True
+            else:
+                if 48 <= d <= 57:
+                    d -= 48
+                v = _word(self.multiply(v, 10) + d)
+            i += 1
+        return _word(-v) if neg else v
+
+    def _insert_first(self, this: int, c: int) -> None:
+        # one more character, with the others moved up to make room
+        ram = self.ram
+        ram[self._field(this, 0)] = _word(ram[self._field(this, 0)] + 1)
+        i = _word(ram[self._field(this, 0)] - 1)
+        while i > 0:
+            ram[self._char(this, i)] = ram[self._char(this, i - 1)]
+            i -= 1
+        ram[self._char(this, 0)] = c
+
+    def set_int(self, this: int, val: int) -> int:
+        self.ram[self._field(this, 0)] = 0
+        neg = False
+        if val < 0:
+            val = self.abs(val)
+            neg = True
+        while val > 0:
+            last_digit = _word(val - self.multiply(self.divide(val, 10), 10))
+            self._insert_first(this, 48 + last_digit)
+            val = self.divide(val, 10)
+        if neg:
+            self._insert_first(this, 45)
+        return 0
+
+    def new_line(self) -> int:
+        return 128
+
+    def back_space(self) -> int:
+        return 129
+
+    def double_quote(self) -> int:
+        return 34
+
+    # Screen
+
+    def screen_init(self) -> int:
+        self.clear_screen()
+        self.ram[self._color] = -1
+        return 0
+
+    def clear_screen(self) -> int:
+        for address in range(SCREEN, KBD):
+            self.poke(address, 0)
+        return 0
+
+    def set_color(self, b: int) -> int:
+        self.ram[self._color] = b
+        return 0
+
+    def draw_pixel(self, x: int, y: int) -> int:
+        x_divide_16 = self.divide(x, 16)
+        address = _word(_word(SCREEN + self.multiply(y, 32)) + x_divide_16)
+        bit = _word(x - self.multiply(x_divide_16, 16))
+        value_to_add = 1
+        for _ in range(bit):
+            value_to_add = _word(value_to_add + value_to_add)
+        word = self.peek(address)
+        if self.ram[self._color]:
+            if word & value_to_add == 0:
+                self.poke(address, _word(word + value_to_add))
+        else:
+            if word & value_to_add != 0:
+                self.poke(address, _word(word - value_to_add))
+        return 0
+
+    def draw_line(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        if x1 == x2:
+            return self.draw_vertical_line(x1, y1, x2, y2)
+        if y1 == y2:
+            return self.draw_horizontal_line(x1, y1, x2, y2)
+        if x1 < x2:
+            return self.draw_diagonal_line(x1, y1, _word(x2 - x1), _word(y2 - y1))
+        return self.draw_diagonal_line(x2, y2, _word(x1 - x2), _word(y1 - y2))
+
+    def draw_vertical_line(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        while y1 != y2:
+            self.draw_pixel(x1, y1)
+            y1 = _word(y1 + 1) if y1 < y2 else _word(y1 - 1)
+        return 0
+
+    def draw_horizontal_line(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        while x1 != x2:
+            self.draw_pixel(x1, y1)
+            x1 = _word(x1 + 1) if x1 < x2 else _word(x1 - 1)
+        return 0
+
+    def draw_diagonal_line(self, x: int, y: int, dx: int, dy: int) -> int:
+        a = 0
+        b = 0
+        adx_minus_bdx = 0
+        if dy < 0:
+            while a < _word(dx + 1) and b > _word(dy - 1):
+                self.draw_pixel(_word(x + a), _word(y + b))
+                if adx_minus_bdx < 0:
+                    a = _word(a + 1)
+                    adx_minus_bdx = _word(adx_minus_bdx - dy)
+                else:
+                    b = _word(b - 1)
+                    adx_minus_bdx = _word(adx_minus_bdx - dx)
+        else:
+            while a < _word(dx + 1) and b < _word(dy + 1):
+                self.draw_pixel(_word(x + a), _word(y + b))
+                if adx_minus_bdx < 0:
+                    a = _word(a + 1)
+                    adx_minus_bdx = _word(adx_minus_bdx + dy)
+                else:
+                    b = _word(b + 1)
+                    adx_minus_bdx = _word(adx_minus_bdx - dx)
+        return 0
+
+    def draw_rectangle(self, x1: int, y1: int, x2: int, y2: int) -> int:
+        x = x1
+        while x < _word(x2 + 1):
+            y = y1
+            while y < _word(y2 + 1):
+                self.draw_pixel(x, y)
+                y = _word(y + 1)
+            x = _word(x + 1)
+        return 0
+
+    def draw_circle(self, x: int, y: int, r: int) -> int:
+        dy = _word(-r)
+        while dy != r:
+            sqrt = self.sqrt(
+                _word(self.multiply(r, r) - self.multiply(dy, dy))
+            )
+            self.draw_line(
+                _word(x - sqrt), _word(dy + y), _word(x + sqrt), _word(dy + y)
+            )
+            dy = _word(dy + 1)
+        return 0
+
+
+# OS function -> (_NativeOS method, number of arguments, the OS functions
+# whose Jack code it also stands in for); a native version is only used
+# when those are native too, so that running one function as Jack code
+# runs everything that calls it as Jack code as well
+_NATIVE_OS = {
+    "Math.abs": ("abs", 1, []),
+    "Math.multiply": ("multiply", 2, []),
+    "Math.divide": ("divide", 2, ["Math.abs"]),
+    "Math.sqrt": ("sqrt", 1, ["Math.divide", "Math.multiply"]),
+    "Math.max": ("max", 2, []),
+    "Math.min": ("min", 2, []),
+    "Memory.peek": ("peek", 1, []),
+    "Memory.poke": ("poke", 2, []),
+    "Memory.alloc": ("alloc", 1, []),
+    "Memory.deAlloc": ("de_alloc", 1, []),
+    "Array.new": ("array_new", 1, ["Memory.alloc"]),
+    "Array.dispose": ("array_dispose", 1, ["Memory.deAlloc"]),
+    "String.new": ("string_new", 1, ["Memory.alloc", "Array.new"]),
+    "String.dispose": ("string_dispose", 1, ["Array.dispose"]),
+    "String.length": ("string_length", 1, []),
+    "String.charAt": ("char_at", 2, []),
+    "String.setCharAt": ("set_char_at", 3, []),
+    "String.appendChar": ("append_char", 2, []),
+    "String.eraseLastChar": ("erase_last_char", 1, []),
+    "String.intValue": ("int_value", 1, ["Math.multiply"]),
+    "String.setInt": ("set_int", 2, ["Math.abs", "Math.divide", "Math.multiply"]),
+    "String.newLine": ("new_line", 0, []),
+    "String.backSpace": ("back_space", 0, []),
+    "String.doubleQuote": ("double_quote", 0, []),
+    "Screen.init": ("screen_init", 0, ["Screen.clearScreen"]),
+    "Screen.clearScreen": (
+        "clear_screen",
+        0,
+        ["Math.divide", "Math.multiply", "Memory.poke"],
+    ),
+    "Screen.setColor": ("set_color", 1, []),
+    "Screen.drawPixel": (
+        "draw_pixel",
+        2,
+        ["Math.divide", "Math.multiply", "Memory.peek", "Memory.poke"],
+    ),
+    "Screen.drawLine": (
+        "draw_line",
+        4,
+        [
+            "Screen.drawVerticalLine",
+            "Screen.drawHorizontalLine",
+            "Screen.drawDiagonalLine",
+        ],
+    ),
+    "Screen.drawVerticalLine": ("draw_vertical_line", 4, ["Screen.drawPixel"]),
+    "Screen.drawHorizontalLine": ("draw_horizontal_line", 4, ["Screen.drawPixel"]),
+    "Screen.drawDiagonalLine": ("draw_diagonal_line", 4, ["Screen.drawPixel"]),
+    "Screen.drawRectangle": ("draw_rectangle", 4, ["Screen.drawPixel"]),
+    "Screen.drawCircle": (
+        "draw_circle",
+        3,
+        ["Math.multiply", "Math.sqrt", "Screen.drawLine"],
+    ),
+}
+
+
+class VMEmulator:
+    """Runs VM programs directly, from predecoded commands, on the same
+    RAM layout as the translated program."""
+
+    def __init__(
+        self,
+        translate: bool = True,
+        native_os: bool = False,
+        jack: Collection[str] = (),
+    ):
+        """`translate` runs code as basic blocks compiled to Python
+        functions; pass False to use the plain interpreter instead.
+
+        `native_os` runs calls of the 12/ OS functions that have a Python
+        version as one step each, except for the functions in `jack`,
+        which run their compiled Jack code as usual.
+        """
+        self.ram = array("h", bytes(2 * RAM_SIZE))
+        self.translate = translate
+        self.native_os = native_os
+        self.jack = set(jack)
+        self._code: List[Tuple[int, int, int]] = []
+        self._blocks: Dict[int, Tuple[Callable, int, bool]] = {}
+        self._functions: Dict[str, int] = {}
+        self._statics: Dict[str, int] = {}
+        self._natives: Dict[str, int] = {}
+        self._native_code: List[Callable] = []
+        self.reset()
+
+    def reset(self) -> None:
+        """Starts over at Sys.init, or at the first command if there is
+        none. RAM is left as it is; the VM emulator's scripts set it up."""
+        self.pc = self._functions.get("Sys.init", 0)
+        self.time = 0
+
+    def load(self, path: str) -> None:
+        """Loads a .vm file, or all the .vm files of a directory."""
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(path, f) for f in os.listdir(path) if f.endswith(".vm")
+            )
+            if not files:
+                raise VMError(f"no .vm files in {path}")
+        else:
+            files = [path]
+        self.load_commands(
+            (os.path.splitext(os.path.basename(f))[0], Parser(f).commands)
+            for f in files
+        )
+
+    def load_commands(self, programs) -> None:
+        """Loads (file name without .vm, commands) pairs as one program."""
+        programs = list(programs)
+        # first pass: where functions and labels are; labels are scoped
+        # to their function, as the translator does, and are not commands
+        # of their own, as in the course's VM emulator
+        self._functions = {}
+        labels: Dict[str, int] = {}
+        index = 0
+        for file, commands in programs:
+            scope = file
+            for command in commands:
+                if command.type == CommandType.C_FUNCTION:
+                    scope = command.arg1
+                    self._functions[command.arg1] = index
+                elif command.type == CommandType.C_LABEL:
+                    labels[f"{scope}${command.arg1}"] = index
+                    continue
+                index += 1
+        if index > 0xFFFF:
+            raise VMError(f"program has {index} commands, return addresses hold 65536")
+        self._natives = self._native_functions()
+        # second pass: the code, with statics placed in order of first use
+        # as the assembler would
+        self._statics = {}
+        self._code = []
+        for file, commands in programs:
+            scope = file
+            for command in commands:
+                if command.type == CommandType.C_FUNCTION:
+                    scope = command.arg1
+                elif command.type == CommandType.C_LABEL:
+                    continue
+                self._code.append(self._decode(command, file, scope, labels))
+        self._native_code = []
+        if self._natives:
+            native_os = _NativeOS(self.ram, self._static)
+            for name in self._natives:
+                self._native_code.append(getattr(native_os, _NATIVE_OS[name][0]))
+        self._blocks = {}
+        self.reset()
+
+    def _native_functions(self) -> Dict[str, int]:
+        # the OS functions to run natively -> index into _native_code
+        if not self.native_os:
+            return {}
+        names = {
+            name
+            for name in _NATIVE_OS
+            if name in self._functions and name not in self.jack
+        }
+        changed = True
+        while changed:
+            changed = False
+            for name in sorted(names):
+                if not set(_NATIVE_OS[name][2]) <= names:
+                    names.remove(name)
+                    changed = True
+        return {name: i for i, name in enumerate(sorted(names))}
+
+    def _static(self, name: str) -> int:
+        if name not in self._statics:
+            self._statics[name] = STATIC + len(self._statics)
+        return self._statics[name]
+
+    def _decode(
+        self, command: Command, file: str, scope: str, labels: Dict[str, int]
+    ) -> Tuple[int, int, int]:
+        t = command.type
+        if t == CommandType.C_ARITHMETIC:
+            return (_ARITHMETIC[command.arg1], 0, 0)
+        elif t in [CommandType.C_PUSH, CommandType.C_POP]:
+            push = t == CommandType.C_PUSH
+            segment = command.arg1
+            index = command.arg2
+            if segment in _POINTER_SEGMENTS:
+                return (_POINTER_SEGMENTS[segment][0 if push else 1], index, 0)
+            elif segment == "constant":
+                if not push:
+                    raise VMError("cannot pop to the constant segment")
+                return (_PUSH_CONSTANT, index, 0)
+            elif segment == "temp":
+                address = TEMP + index
+            elif segment == "pointer":
+                address = THIS + index
+            elif segment == "static":
+                address = self._static(f"{command.file or file}.{index}")
+            else:
+                raise VMError(f"unknown segment: {segment}")
+            return (_PUSH_RAM if push else _POP_RAM, address, 0)
+        elif t in [CommandType.C_GOTO, CommandType.C_IF]:
+            label = f"{scope}${command.arg1}"
+            if label not in labels:
+                raise VMError(f"unknown label {command.arg1} in {scope}")
+            target = labels[label]
+            if t == CommandType.C_IF:
+                return (_IF_GOTO, target, 0)
+            # `label L, goto L` is how programs stop
+            if target == len(self._code):
+                return (_HALT, target, 0)
+            return (_GOTO, target, 0)
+        elif t == CommandType.C_FUNCTION:
+            return (_FUNCTION, command.arg2, 0)
+        elif t == CommandType.C_CALL:
+            if command.arg1 not in self._functions:
+                raise VMError(f"unknown function: {command.arg1}")
+            native = self._natives.get(command.arg1)
+            if native is not None and command.arg2 == _NATIVE_OS[command.arg1][1]:
+                return (_NATIVE, native, command.arg2)
+            return (_CALL, self._functions[command.arg1], command.arg2)
+        return (_RETURN, 0, 0)
+
+    def bootstrap(self) -> None:
+        """Sets SP to 256 and calls Sys.init, as the translator's bootstrap
+        code does. Sys.init returns to the end of the program."""
+        if "Sys.init" not in self._functions:
+            raise VMError("no Sys.init to call")
+        ram = self.ram
+        sp = 256
+        ram[sp] = ((len(self._code) + 0x8000) & 0xFFFF) - 0x8000
+        ram[sp + 1 : sp + 5] = ram[LCL : THAT + 1]
+        ram[SP] = sp + 5
+        ram[ARG] = sp
+        ram[LCL] = sp + 5
+        self.pc = self._functions["Sys.init"]
+
+    def peek(self, address: int) -> int:
+        return self.ram[address]
+
+    def poke(self, address: int, value: int) -> None:
+        self.ram[address] = ((value + 0x8000) & 0xFFFF) - 0x8000
+
+    def step(self) -> None:
+        self.run(1, stop_at_halt=False)
+
+    def run(self, steps: int, stop_at_halt: bool = True) -> int:
+        """Executes up to `steps` commands and returns how many ran.
+
+        Stops early when the program runs past its last command or, if
+        `stop_at_halt`, calls Sys.halt or enters a `label L, goto L` loop.
+        """
+        if not self.translate:
+            return self._interpret(steps, stop_at_halt)
+        blocks = self._blocks
+        size = len(self._code)
+        ram = self.ram
+        sp = ram[SP]
+        pc = self.pc
+        executed = 0
+        halted = False
+        while pc < size:
+            block = blocks.get(pc)
+            if block is None:
+                block = blocks[pc] = self._translate(pc)
+            function, length, halts = block
+            if executed + length > steps:
+                break
+            executed += length
+            pc, sp = function(ram, sp)
+            if halts and stop_at_halt:
+                halted = True
+                break
+        ram[SP] = sp
+        self.pc = pc
+        self.time += executed
+        if not halted and executed < steps and pc < size:
+            # finish the last, partial block one command at a time
+            executed += self._interpret(steps - executed, stop_at_halt)
+        return executed
+
+    def _translate(self, start: int) -> Tuple[Callable, int, bool]:
+        # Compiles the commands from `start` up to the next jump, call or
+        # return into a Python function (ram, sp) -> (pc, sp). Values
+        # pushed in the block are written to the stack as the interpreter
+        # does, since programs may read what is left above SP, but are
+        # read back from Python variables until the block ends. Blocks
+        # that end in a `label L, goto L` loop or just before a call of
+        # Sys.halt are marked as halting.
+        code = self._code
+        halt = self._functions.get("Sys.halt", -1)
+        namespace: Dict[str, Callable] = {"VMError": VMError}
+        lines = ["def block(ram, sp):"]
+        stack: List[str] = []
+        # stack entries in RAM relative to sp on entry
+        offset = 0
+        temps = 0
+
+        def emit(line: str) -> None:
+            lines.append("    " + line)
+
+        def top(i: int = 0) -> str:
+            return f"sp + {offset + i}" if offset + i >= 0 else f"sp - {-offset - i}"
+
+        def value(expression: str) -> str:
+            nonlocal temps
+            temps += 1
+            emit(f"t{temps} = {expression}")
+            return f"t{temps}"
+
+        def push(v: str) -> None:
+            emit(f"ram[{top(len(stack))}] = {v}")
+            stack.append(v)
+
+        def pop() -> str:
+            nonlocal offset
+            if stack:
+                return stack.pop()
+            offset -= 1
+            return value(f"ram[{top()}]")
+
+        def flush() -> None:
+            # the values are in RAM already
+            nonlocal offset
+            offset += len(stack)
+            stack.clear()
+
+        pc = start
+        halts = False
+        while pc < len(code):
+            op, x, y = code[pc]
+            if op == _CALL and x == halt and pc > start:
+                flush()
+                emit(f"return {pc}, {top()}")
+                halts = True
+                break
+            pc += 1
+            if op == _PUSH_CONSTANT:
+                push(str(x))
+            elif op == _PUSH_LOCAL:
+                push(value(f"ram[ram[{LCL}] + {x}]"))
+            elif op == _PUSH_ARGUMENT:
+                push(value(f"ram[ram[{ARG}] + {x}]"))
+            elif op == _PUSH_THIS:
+                push(value(f"ram[(ram[{THIS}] + {x}) & 32767]"))
+            elif op == _PUSH_THAT:
+                push(value(f"ram[(ram[{THAT}] + {x}) & 32767]"))
+            elif op == _PUSH_RAM:
+                push(value(f"ram[{x}]"))
+            elif op == _POP_LOCAL:
+                emit(f"ram[ram[{LCL}] + {x}] = {pop()}")
+            elif op == _POP_ARGUMENT:
+                emit(f"ram[ram[{ARG}] + {x}] = {pop()}")
+            elif op == _POP_THIS:
+                emit(f"ram[(ram[{THIS}] + {x}) & 32767] = {pop()}")
+            elif op == _POP_THAT:
+                emit(f"ram[(ram[{THAT}] + {x}) & 32767] = {pop()}")
+            elif op == _POP_RAM:
+                emit(f"ram[{x}] = {pop()}")
+            elif op in _BINARY_SOURCE:
+                b = pop()
+                a = pop()
+                push(value(_BINARY_SOURCE[op].format(a=a, b=b)))
+            elif op == _NOT:
+                push(value(f"~{pop()}"))
+            elif op == _NEG:
+                push(value(f"((32768 - {pop()}) & 65535) - 32768"))
+            elif op == _FUNCTION:
+                # locals live on the stack, where the function reads them
+                flush()
+                for i in range(x):
+                    emit(f"ram[{top(i)}] = 0")
+                offset += x
+            elif op == _GOTO or op == _HALT:
+                flush()
+                emit(f"return {x}, {top()}")
+                halts = op == _HALT
+                break
+            elif op == _IF_GOTO:
+                condition = pop()
+                flush()
+                emit(f"if {condition}:")
+                emit(f"    return {x}, {top()}")
+                emit(f"return {pc}, {top()}")
+                break
+            elif op == _CALL:
+                flush()
+                # the slice copies below would resize RAM out of range
+                emit(f"if not 0 <= {top()} < {RAM_SIZE - 5}:")
+                emit(f"    raise VMError('SP out of range: ' + str({top()}))")
+                # return address, LCL, ARG, THIS, THAT
+                emit(f"ram[{top()}] = {((pc + 0x8000) & 0xFFFF) - 0x8000}")
+                emit(f"ram[{top(1)} : {top(5)}] = ram[{LCL} : {THAT + 1}]")
+                emit(f"ram[{ARG}] = {top(-y)}")
+                emit(f"ram[{LCL}] = {top(5)}")
+                emit(f"return {x}, {top(5)}")
+                break
+            elif op == _NATIVE:
+                arguments = [pop() for _ in range(y)][::-1]
+                # the OS function may read or write any of RAM
+                flush()
+                emit(f"ram[{SP}] = {top()}")
+                namespace[f"native{x}"] = self._native_code[x]
+                push(value(f"native{x}({', '.join(arguments)})"))
+            elif op == _RETURN:
+                result = pop()
+                emit(f"frame = ram[{LCL}]")
+                emit("if frame < 5:")
+                emit("    raise VMError('LCL out of range: ' + str(frame))")
+                emit("pc = ram[frame - 5] & 65535")
+                emit(f"ram[ram[{ARG}]] = {result}")
+                emit(f"sp = ram[{ARG}] + 1")
+                emit(f"ram[{LCL} : {THAT + 1}] = ram[frame - 4 : frame]")
+                emit("return pc, sp")
+                break
+        else:
+            flush()
+            emit(f"return {pc}, {top()}")
+        exec(compile("\n".join(lines), f"<block {start}>", "exec"), namespace)
+        return namespace["block"], pc - start, halts
+
+    def _interpret(self, steps: int, stop_at_halt: bool) -> int:
+        code = self._code
+        size = len(code)
+        ram = self.ram
+        natives = self._native_code
+        halt = self._functions.get("Sys.halt", -1) if stop_at_halt else -1
+        sp = ram[SP]
+        pc = self.pc
+        executed = 0
+        while executed < steps and pc < size:
+            op, x, y = code[pc]
+            executed += 1
+            pc += 1
+            if op == _PUSH_CONSTANT:
+                ram[sp] = x
+                sp += 1
+            elif op == _PUSH_LOCAL:
+                ram[sp] = ram[ram[LCL] + x]
+                sp += 1
+            elif op == _PUSH_ARGUMENT:
+                ram[sp] = ram[ram[ARG] + x]
+                sp += 1
+            elif op == _POP_LOCAL:
+                sp -= 1
+                ram[ram[LCL] + x] = ram[sp]
+            elif op == _ADD:
+                sp -= 1
+                ram[sp - 1] = ((ram[sp - 1] + ram[sp] + 0x8000) & 0xFFFF) - 0x8000
+            elif op == _IF_GOTO:
+                sp -= 1
+                if ram[sp]:
+                    pc = x
+            elif op == _GOTO:
+                pc = x
+            elif op == _PUSH_RAM:
+                ram[sp] = ram[x]
+                sp += 1
+            elif op == _POP_RAM:
+                sp -= 1
+                ram[x] = ram[sp]
+            elif op == _PUSH_THAT:
+                ram[sp] = ram[(ram[THAT] + x) & 0x7FFF]
+                sp += 1
+            elif op == _PUSH_THIS:
+                ram[sp] = ram[(ram[THIS] + x) & 0x7FFF]
+                sp += 1
+            elif op == _POP_THAT:
+                sp -= 1
+                ram[(ram[THAT] + x) & 0x7FFF] = ram[sp]
+            elif op == _POP_THIS:
+                sp -= 1
+                ram[(ram[THIS] + x) & 0x7FFF] = ram[sp]
+            elif op == _POP_ARGUMENT:
+                sp -= 1
+                ram[ram[ARG] + x] = ram[sp]
+            elif op == _SUB:
+                sp -= 1
+                ram[sp - 1] = ((ram[sp - 1] - ram[sp] + 0x8000) & 0xFFFF) - 0x8000
+            elif op == _LT:
+                sp -= 1
+                ram[sp - 1] = -1 if ram[sp - 1] < ram[sp] else 0
+            elif op == _GT:
+                sp -= 1
+                ram[sp - 1] = -1 if ram[sp - 1] > ram[sp] else 0
+            elif op == _EQ:
+                sp -= 1
+                ram[sp - 1] = -1 if ram[sp - 1] == ram[sp] else 0
+            elif op == _NOT:
+                ram[sp - 1] = ~ram[sp - 1]
+            elif op == _AND:
+                sp -= 1
+                ram[sp - 1] &= ram[sp]
+            elif op == _OR:
+                sp -= 1
+                ram[sp - 1] |= ram[sp]
+            elif op == _NEG:
+                ram[sp - 1] = ((0x8000 - ram[sp - 1]) & 0xFFFF) - 0x8000
+            elif op == _CALL:
+                if x == halt:
+                    pc -= 1
+                    executed -= 1
+                    break
+                # the slice copies below would resize RAM out of range
+                if not 0 <= sp < RAM_SIZE - 5:
+                    raise VMError(f"SP out of range: {sp}")
+                # return address, LCL, ARG, THIS, THAT
+                ram[sp] = ((pc + 0x8000) & 0xFFFF) - 0x8000
+                ram[sp + 1 : sp + 5] = ram[LCL : THAT + 1]
+                sp += 5
+                ram[ARG] = sp - 5 - y
+                ram[LCL] = sp
+                pc = x
+            elif op == _NATIVE:
+                sp -= y
+                ram[SP] = sp
+                ram[sp] = natives[x](*ram[sp : sp + y])
+                sp += 1
+            elif op == _FUNCTION:
+                for _ in range(x):
+                    ram[sp] = 0
+                    sp += 1
+            elif op == _RETURN:
+                frame = ram[LCL]
+                if frame < 5:
+                    raise VMError(f"LCL out of range: {frame}")
+                # read before the result may overwrite it, with no arguments
+                pc = ram[frame - 5] & 0xFFFF
+                ram[ram[ARG]] = ram[sp - 1]
+                sp = ram[ARG] + 1
+                ram[LCL : THAT + 1] = ram[frame - 4 : frame]
+            elif op == _HALT:
+                if stop_at_halt:
+                    pc -= 1
+                    executed -= 1
+                    break
+                pc = x
+        ram[SP] = sp
+        self.pc = pc
+        self.time += executed
+        return executed
+
+
+def compare_ram(jack: VMEmulator, native: VMEmulator) -> List[int]:
+    """Returns the addresses where two runs of a program, one with Jack OS
+    code and one with native OS calls, left different RAM. The temp
+    segment and the stack above SP are not compared: the Jack code uses
+    them as scratch space, which the native versions do not need."""
+    sp = jack.ram[SP]
+    addresses = [a for a in range(RAM_SIZE) if not TEMP <= a < TEMP + 8]
+    return [
+        a
+        for a in addresses
+        if (a < sp or not 256 <= a < 2048) and jack.ram[a] != native.ram[a]
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file_or_dir")
+    parser.add_argument("--steps", type=int, default=100_000_000)
+    parser.add_argument(
+        "--interpret",
+        action="store_true",
+        help="run one command at a time instead of translated blocks",
+    )
+    parser.add_argument(
+        "--native-os",
+        action="store_true",
+        help="run calls of Math, Memory, Array, String and Screen functions "
+        "in Python instead of their Jack code",
+    )
+    parser.add_argument(
+        "--jack",
+        action="append",
+        default=[],
+        metavar="FUNCTION",
+        help="with --native-os, still run FUNCTION's Jack code",
+    )
+    parser.add_argument(
+        "--check-native",
+        action="store_true",
+        help="run the program with and without --native-os and compare RAM",
+    )
+    parser.add_argument(
+        "--check-interpret",
+        action="store_true",
+        help="also run the program one command at a time and compare RAM",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="ADDR=VALUE",
+        help="initialize RAM[ADDR] before running",
+    )
+    parser.add_argument(
+        "--peek",
+        action="append",
+        default=[],
+        metavar="ADDR[-ADDR]",
+        help="print RAM[ADDR] (or a range) after running",
+    )
+    args = parser.parse_args()
+    try:
+        _run(args)
+    except VMError as e:
+        print(f"error: {e}")
+        sys.exit(1)
+
+
+def _run(args: argparse.Namespace) -> None:
+    def start(native_os: bool, translate: bool) -> VMEmulator:
+        emulator = VMEmulator(translate=translate, native_os=native_os, jack=args.jack)
+        emulator.load(args.input_file_or_dir)
+        if "Sys.init" in emulator._functions:
+            emulator.bootstrap()
+        for s in args.set:
+            address, value = s.split("=")
+            emulator.poke(int(address), int(value))
+        return emulator
+
+    native_os = args.native_os or args.check_native
+    emulator = start(native_os, not args.interpret)
+    executed = emulator.run(args.steps)
+    print(f"steps: {executed}")
+    if args.check_interpret:
+        other = start(native_os, args.interpret)
+        other_executed = other.run(args.steps)
+        mode = "translated" if args.interpret else "interpreted"
+        print(f"steps {mode}: {other_executed}")
+        differences = [a for a in range(RAM_SIZE) if emulator.ram[a] != other.ram[a]]
+        for address in differences[:20]:
+            print(
+                f"RAM[{address}] = {emulator.ram[address]}, "
+                f"{other.ram[address]} {mode}"
+            )
+        print(f"RAM differs at {len(differences)} addresses")
+    if args.check_native:
+        jack = start(False, not args.interpret)
+        jack_executed = jack.run(args.steps)
+        print(f"steps with Jack OS code: {jack_executed}")
+        if executed == args.steps or jack_executed == args.steps:
+            # the runs stopped at unrelated points
+            print(f"RAM not compared: a run did not stop within {args.steps} steps")
+        else:
+            differences = compare_ram(jack, emulator)
+            for address in differences[:20]:
+                print(
+                    f"RAM[{address}] = {jack.ram[address]} with Jack OS code, "
+                    f"{emulator.ram[address]} native"
+                )
+            print(f"RAM differs at {len(differences)} addresses")
+    for p in args.peek:
+        first, _, last = p.partition("-")
+        for address in range(int(first), int(last or first) + 1):
+            print(f"RAM[{address}] = {emulator.peek(address)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import glob
+import io
+import os
+import sys
+import unittest
+from typing import Dict, List, Optional
+
+from CPUEmulator import SCREEN, CPUEmulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "06"))
+sys.path.insert(0, os.path.join(HERE, "..", "08"))
+import Assembler  # noqa: E402
+import vm_translator  # noqa: E402
+
+
+def assemble(name: str) -> List[int]:
+    with open(os.path.join(HERE, "..", "06", name)) as f:
+        return list(Assembler.assemble(f))
+
+
+def translate(directory: str) -> List[int]:
+    # the VM program in `directory`, with bootstrap code
+    code = io.StringIO()
+    vm_translator.CodeWriter(code).writeInit()
+    for f in sorted(glob.glob(os.path.join(directory, "*.vm"))):
+        code.write(vm_translator.translate_file(f))
+    return list(Assembler.assemble(code.getvalue()))
+
+
+class TranslateTest(unittest.TestCase):
+    def run_both(
+        self, program: List[int], cycles: int, ram: Optional[Dict[int, int]] = None
+    ) -> CPUEmulator:
+        # runs `program` translated and interpreted, checks that both end
+        # in the same state and returns the translated run
+        runs = []
+        for translate in [True, False]:
+            emulator = CPUEmulator(translate=translate)
+            emulator.load(program)
+            for address, value in (ram or {}).items():
+                emulator.poke(address, value)
+            runs.append((emulator, emulator.run(cycles)))
+        (translated, executed), (interpreted, interpreted_executed) = runs
+        self.assertEqual(executed, interpreted_executed)
+        self.assertEqual(
+            (translated.pc, translated.a, translated.d),
+            (interpreted.pc, interpreted.a, interpreted.d),
+        )
+        self.assertEqual(translated.ram, interpreted.ram)
+        return translated
+
+    def test_add(self):
+        emulator = self.run_both(assemble("add/Add.asm"), 100)
+        self.assertEqual(emulator.peek(0), 5)
+
+    def test_max(self):
+        for x, y in [(3, 7), (7, 3), (-2, -5)]:
+            with self.subTest(x=x, y=y):
+                emulator = self.run_both(assemble("max/Max.asm"), 100, {0: x, 1: y})
+                self.assertEqual(emulator.peek(2), max(x, y))
+
+    def test_rect(self):
+        emulator = self.run_both(assemble("rect/Rect.asm"), 1000, {0: 4})
+        rows = [emulator.peek(SCREEN + 32 * row) for row in range(5)]
+        self.assertEqual(rows, [-1, -1, -1, -1, 0])
+
+    def test_translated_vm_program(self):
+        directory = os.path.join(HERE, "..", "08", "FunctionCalls", "FibonacciElement")
+        emulator = self.run_both(translate(directory), 6000)
+        self.assertEqual((emulator.peek(0), emulator.peek(261)), (262, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import HardwareSimulator
+from HardwareSimulator import MODELS, SPECS, Chip, EventChip, verify
+from TestRunner import run_script
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+GATE = """
+CHIP Gate {
+    IN a, b;
+    OUT out;
+    PARTS:
+    Nand(a=a, b=b, out=n);
+    Nand(a=n, b=n, out=out);
+}
+"""
+
+NAND_GATE = """
+CHIP Gate {
+    IN a, b;
+    OUT out;
+    PARTS:
+    Nand(a=a, b=b, out=out);
+}
+"""
+
+TOP = """
+CHIP Top {
+    IN a, b;
+    OUT out;
+    PARTS:
+    Gate(a=a, b=b, out=out);
+}
+"""
+
+
+class VerifyTest(unittest.TestCase):
+    def test_project_01(self):
+        for name in sorted(SPECS):
+            with self.subTest(name):
+                chip = Chip(os.path.join(ROOT, "01", f"{name}.hdl"))
+                _, _, failure = verify(chip, SPECS[name])
+                self.assertIsNone(failure)
+
+    def test_failure_is_described(self):
+        chip = Chip(os.path.join(ROOT, "01", "And.hdl"))
+        _, exhaustive, failure = verify(chip, SPECS["Or"])
+        self.assertTrue(exhaustive)
+        self.assertEqual(failure, "a=1 b=0: out=0 (expected 1)")
+
+
+class EventChipTest(unittest.TestCase):
+    def run_cycles(self, chip: Chip, words: int, cycles: int = 300) -> list:
+        # the outputs of `chip` over random cycles, checked against a list
+        # standing for its memory; writes are rare and go to a few
+        # addresses so that reads find them and inputs often repeat
+        rng = random.Random(0)
+        memory = [0] * words
+        outputs = []
+        for _ in range(cycles):
+            address = rng.choice([0, 1, words // 2, words - 1])
+            load = int(rng.random() < 0.3)
+            value = rng.randrange(1 << 16)
+            chip.set("address", address)
+            chip.set("in", value)
+            chip.set("load", load)
+            chip.eval()
+            outputs.append(chip.get("out"))
+            self.assertEqual(outputs[-1], memory[address])
+            chip.tick()
+            chip.tock()
+            if load:
+                memory[address] = value
+            outputs.append(chip.get("out"))
+            self.assertEqual(outputs[-1], memory[address])
+        return outputs
+
+    def test_same_outputs(self):
+        for name in ["RAM64", "RAM512"]:
+            directory = os.path.join(ROOT, "03", "b" if name == "RAM512" else "a")
+            path = os.path.join(directory, f"{name}.hdl")
+            expected = self.run_cycles(Chip(path), MODELS[name])
+            smaller = [m for m in MODELS if MODELS[m] < MODELS[name]]
+            for models in [[]] + [[m] for m in smaller]:
+                with self.subTest(name, models=models):
+                    chip = EventChip(path, models=models)
+                    self.assertEqual(self.run_cycles(chip, MODELS[name]), expected)
+
+
+class CacheTest(unittest.TestCase):
+    def test_hits_and_invalidation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, source in [("Gate", GATE), ("Top", TOP)]:
+                with open(os.path.join(tmp, f"{name}.hdl"), "w") as f:
+                    f.write(source)
+            path = os.path.join(tmp, "Top.hdl")
+            cache_dir = os.path.join(tmp, "__hdlcache__")
+            chip = Chip(path, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            # a second load runs the cached code without compiling
+            with mock.patch.object(
+                HardwareSimulator, "_compile", side_effect=AssertionError
+            ):
+                chip = Chip(path, cache_dir=cache_dir)
+            chip.set("a", 1)
+            self.assertEqual(chip.get("out"), 0)
+            # a changed part changes the key of the chips above it
+            with open(os.path.join(tmp, "Gate.hdl"), "w") as f:
+                f.write(NAND_GATE)
+            chip = Chip(path, cache_dir=cache_dir)
+            chip.set("a", 1)
+            self.assertEqual(chip.get("out"), 1)
+            chip.set("b", 1)
+            self.assertEqual(chip.get("out"), 0)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+
+class HDLScriptTest(unittest.TestCase):
+    def test_internal_parts_are_unknown_pins(self):
+        # with --hdl, CPU and Computer come from their HDL, whose parts'
+        # registers and RAM cannot be read by the scripts yet
+        for script, pin in [
+            ("CPU.tst", "DRegister"),
+            ("ComputerAdd.tst", "ARegister"),
+            ("ComputerAdd-external.tst", "RAM16K"),
+        ]:
+            with self.subTest(script):
+                _, status, message = run_script(
+                    os.path.join(HERE, script), simulate_hdl=True
+                )
+                self.assertEqual(status, "ERROR")
+                self.assertEqual(message, f"unknown pin: {pin}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Tuple
+
+from TestRunner import run_script
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MULT = os.path.join(HERE, "..", "04", "mult")
+
+
+class RunScriptTest(unittest.TestCase):
+    def run_mult(self, old: str, new: str) -> Tuple[str, str]:
+        # runs Mult.tst with `old` replaced by `new`
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ["Mult.asm", "Mult.cmp"]:
+                shutil.copy(os.path.join(MULT, name), tmp)
+            with open(os.path.join(MULT, "Mult.tst")) as f:
+                script = f.read()
+            self.assertIn(old, script)
+            path = os.path.join(tmp, "Mult.tst")
+            with open(path, "w") as f:
+                f.write(script.replace(old, new, 1))
+            return run_script(path)[1:]
+
+    def test_passes(self):
+        self.assertEqual(self.run_mult("", "")[0], "ok")
+
+    def test_address_out_of_range(self):
+        status, message = self.run_mult("set RAM[0] 0", "set RAM[99999] 0")
+        self.assertEqual(status, "ERROR")
+        self.assertIn("IndexError", message)
+        status, message = self.run_mult("output-list RAM[0]", "output-list RAM[99999]")
+        self.assertEqual(status, "ERROR")
+
+    def test_unknown_pin(self):
+        status, message = self.run_mult("output-list RAM[0]", "output-list foo[3]")
+        self.assertEqual((status, message), ("ERROR", "unknown pin: foo"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from typing import Dict
+
+from VMEmulator import RAM_SIZE, VMEmulator, VMError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# test programs that start at Sys.init
+PROGRAMS = [
+    os.path.join(HERE, "..", "08", "FunctionCalls", name)
+    for name in ["FibonacciElement", "NestedCall", "StaticsTest"]
+]
+
+# reads a value left above SP by pops in the same block
+STALE = {
+    "Sys": """
+        function Sys.init 0
+        push constant 11
+        push constant 12
+        pop temp 0
+        pop temp 1
+        push constant 262
+        pop pointer 1
+        push that 0
+        pop static 0
+        label END
+        goto END
+    """,
+}
+
+# calls Math.multiply, which runs natively with native_os, and then
+# reads the arguments it left above SP
+NATIVE = {
+    "Sys": """
+        function Sys.init 0
+        push constant 6
+        push constant 7
+        call Math.multiply 2
+        pop static 0
+        push constant 262
+        pop pointer 1
+        push that 0
+        pop static 1
+        label END
+        goto END
+    """,
+    "Math": """
+        function Math.multiply 1
+        push constant 0
+        pop local 0
+        label LOOP
+        push argument 1
+        push constant 0
+        eq
+        if-goto END
+        push local 0
+        push argument 0
+        add
+        pop local 0
+        push argument 1
+        push constant 1
+        sub
+        pop argument 1
+        goto LOOP
+        label END
+        push local 0
+        return
+    """,
+}
+
+
+def run(path: str, **options) -> VMEmulator:
+    emulator = VMEmulator(**options)
+    emulator.load(path)
+    emulator.bootstrap()
+    emulator.run(100_000)
+    return emulator
+
+
+def write(directory: str, program: Dict[str, str]) -> str:
+    for name, source in program.items():
+        with open(os.path.join(directory, f"{name}.vm"), "w") as f:
+            f.write(source)
+    return directory
+
+
+class TranslateTest(unittest.TestCase):
+    def assertSameRAM(self, path: str, **options) -> VMEmulator:
+        translated = run(path, **options)
+        interpreted = run(path, translate=False, **options)
+        self.assertEqual(translated.pc, interpreted.pc)
+        differences = [
+            a for a in range(RAM_SIZE) if translated.ram[a] != interpreted.ram[a]
+        ]
+        self.assertEqual(differences, [])
+        return translated
+
+    def test_programs(self):
+        for path in PROGRAMS:
+            with self.subTest(path):
+                self.assertSameRAM(path)
+
+    def test_values_left_above_sp(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            emulator = self.assertSameRAM(write(tmp, STALE))
+            self.assertEqual(emulator.ram[emulator._statics["Sys.0"]], 12)
+
+    def test_native_calls(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            emulator = self.assertSameRAM(write(tmp, NATIVE), native_os=True)
+            self.assertIn("Math.multiply", emulator._natives)
+            self.assertEqual(emulator.ram[emulator._statics["Sys.0"]], 42)
+
+
+class LoadTest(unittest.TestCase):
+    def test_directory_without_vm_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(VMError):
+                VMEmulator().load(tmp)
+
+    def test_main_reports_errors(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            result = subprocess.run(
+                [sys.executable, os.path.join(HERE, "VMEmulator.py"), tmp],
+                capture_output=True,
+                text=True,
+            )
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, f"error: no .vm files in {tmp}\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
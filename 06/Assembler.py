@@ -1,6 +1,13 @@
+import argparse
+import struct
 import sys
+from array import array
 from enum import Enum, auto
-from typing import Dict
+from itertools import permutations
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+
+_WORD = struct.Struct(">H")
 
 
 class _Command(Enum):
@@ -10,49 +17,53 @@ class _Command(Enum):
 
 
 class Parser:
-    def __init__(self, p: str):
-        self._lineno = 0
-        with open(p) as f:
-            self._lines = []
-            for l in f.readlines():
-                l = l.split("//")[0].strip()
-                if not l:
-                    continue
-                self._lines.append(l)
+    def __init__(self, source: Union[str, Iterable[str]]):
+        if isinstance(source, str):
+            source = source.splitlines()
+        # lines are pulled from the source on demand so that only the
+        # current command is held in memory
+        self._source = iter(source)
+        self._line: Optional[str] = None
+        self.advance()
 
     def hasMoreCommands(self) -> bool:
-        if len(self._lines) > self._lineno:
-            return True
-        else:
-            return False
+        return self._line is not None
 
     def advance(self) -> None:
-        self._lineno += 1
+        for l in self._source:
+            l = l.split("//")[0].strip()
+            if l:
+                self._line = l
+                return
+        self._line = None
 
     def commandType(self) -> _Command:
-        if self._lines[self._lineno][0] == "@":
+        if self._line[0] == "@":
             return _Command.A_COMMAND
-        elif self._lines[self._lineno][0] == "(":
+        elif self._line[0] == "(":
             return _Command.L_COMMAND
         else:
             return _Command.C_COMMAND
 
+    def command(self) -> str:
+        return self._line
+
     def symbol(self) -> str:
-        l = self._lines[self._lineno]
+        l = self._line
         if l[0] == "@":
             return l[1:]
         else:
             return l[1:-1]
 
     def dest(self) -> str:
-        mnemonics = self._lines[self._lineno].split("=")
+        mnemonics = self._line.split("=")
         if len(mnemonics) == 1:
             return ""
         else:
             return mnemonics[0]
 
     def comp(self) -> str:
-        dest_and_comp = self._lines[self._lineno].split(";")[0]
+        dest_and_comp = self._line.split(";")[0]
         dest_and_comp = dest_and_comp.split("=")
         if len(dest_and_comp) == 1:
             return dest_and_comp[0]
@@ -60,102 +71,97 @@ class Parser:
             return dest_and_comp[1]
 
     def jump(self) -> str:
-        dest_comp_and_jump = self._lines[self._lineno].split(";")
+        dest_comp_and_jump = self._line.split(";")
         if len(dest_comp_and_jump) == 1:
             return ""
         else:
             return dest_comp_and_jump[1]
 
 
+_DEST = {
+    "".join(p): ("A" in p) << 2 | ("D" in p) << 1 | ("M" in p)
+    for n in range(4)
+    for p in permutations("ADM", n)
+}
+
+_COMP = {
+    "0": 0b0101010,
+    "1": 0b0111111,
+    "-1": 0b0111010,
+    "D": 0b0001100,
+    "A": 0b0110000,
+    "!D": 0b0001101,
+    "!A": 0b0110001,
+    "-D": 0b0001111,
+    "-A": 0b0110011,
+    "D+1": 0b0011111,
+    "A+1": 0b0110111,
+    "D-1": 0b0001110,
+    "A-1": 0b0110010,
+    "D+A": 0b0000010,
+    "D-A": 0b0010011,
+    "A-D": 0b0000111,
+    "D&A": 0b0000000,
+    "D|A": 0b0010101,
+    "M": 0b1110000,
+    "!M": 0b1110001,
+    "-M": 0b1110011,
+    "M+1": 0b1110111,
+    "M-1": 0b1110010,
+    "D+M": 0b1000010,
+    "D-M": 0b1010011,
+    "M-D": 0b1000111,
+    "D&M": 0b1000000,
+    "D|M": 0b1010101,
+}
+# commutative forms, e.g. `M=M+D` as emitted by the VM translator
+for _c in ["D+A", "D&A", "D|A", "D+M", "D&M", "D|M"]:
+    _COMP[_c[2] + _c[1] + _c[0]] = _COMP[_c]
+
+_JUMP = {
+    "": 0b000,
+    "JGT": 0b001,
+    "JEQ": 0b010,
+    "JGE": 0b011,
+    "JLT": 0b100,
+    "JNE": 0b101,
+    "JLE": 0b110,
+    "JMP": 0b111,
+}
+
+
 class Code:
+    def __init__(self):
+        self._cache: Dict[str, int] = {}
+
     def dest(self, mnemonic: str) -> str:
-        d1 = 0
-        d2 = 0
-        d3 = 0
-        for c in mnemonic:
-            if c == "A":
-                d1 = 1
-            elif c == "D":
-                d2 = 1
-            elif c == "M":
-                d3 = 1
-        return f"{d1}{d2}{d3}"
+        return "{:03b}".format(self._lookup(_DEST, mnemonic, "dest"))
 
     def comp(self, mnemonic: str) -> str:
-        if mnemonic == "0":
-            return "0101010"
-        elif mnemonic == "1":
-            return "0111111"
-        elif mnemonic == "-1":
-            return "0111010"
-        elif mnemonic == "D":
-            return "0001100"
-        elif mnemonic == "A":
-            return "0110000"
-        elif mnemonic == "!D":
-            return "0001101"
-        elif mnemonic == "!A":
-            return "0110001"
-        elif mnemonic == "-D":
-            return "0001111"
-        elif mnemonic == "-A":
-            return "0110001"
-        elif mnemonic == "D+1":
-            return "0011111"
-        elif mnemonic == "A+1":
-            return "0110111"
-        elif mnemonic == "D-1":
-            return "0001110"
-        elif mnemonic == "A-1":
-            return "0110010"
-        elif mnemonic == "D+A":
-            return "0000010"
-        elif mnemonic == "D-A":
-            return "0010011"
-        elif mnemonic == "A-D":
-            return "0000111"
-        elif mnemonic == "D&A":
-            return "0000000"
-        elif mnemonic == "D|A":
-            return "0010101"
-        elif mnemonic == "M":
-            return "1110000"
-        elif mnemonic == "!M":
-            return "1110001"
-        elif mnemonic == "-M":
-            return "1110011"
-        elif mnemonic == "M+1":
-            return "1110111"
-        elif mnemonic == "M-1":
-            return "1110010"
-        elif mnemonic == "D+M":
-            return "1000010"
-        elif mnemonic == "D-M":
-            return "1010011"
-        elif mnemonic == "M-D":
-            return "1000111"
-        elif mnemonic == "D&M":
-            return "1000000"
-        elif mnemonic == "D|M":
-            return "1010101"
+        return "{:07b}".format(self._lookup(_COMP, mnemonic, "comp"))
 
     def jump(self, mnemonic: str) -> str:
-        if mnemonic == "JGT":
-            return "001"
-        elif mnemonic == "JEQ":
-            return "010"
-        elif mnemonic == "JGE":
-            return "011"
-        elif mnemonic == "JLT":
-            return "100"
-        elif mnemonic == "JNE":
-            return "101"
-        elif mnemonic == "JLE":
-            return "110"
-        elif mnemonic == "JMP":
-            return "111"
-        else:
-            return "000"
+        return "{:03b}".format(self._lookup(_JUMP, mnemonic, "jump"))
+
+    def instruction(self, command: str) -> int:
+        word = self._cache.get(command)
+        if word is None:
+            dest_and_comp, _, jump = command.partition(";")
+            dest, _, comp = dest_and_comp.rpartition("=")
+            word = (
+                0b111 << 13
+                | self._lookup(_COMP, comp, "comp") << 6
+                | self._lookup(_DEST, dest, "dest") << 3
+                | self._lookup(_JUMP, jump, "jump")
+            )
+            self._cache[command] = word
+        return word
+
+    def _lookup(self, table: Dict[str, int], mnemonic: str, field: str) -> int:
+        try:
+            return table[mnemonic]
+        except KeyError:
+            raise ValueError(f"unknown {field} mnemonic: {mnemonic!r}") from None
 
 
 class SymbolTable:
@@ -196,48 +202,323 @@ class SymbolTable:
         return self._table[symbol]
 
 
+class Optimizer:
+    """Peephole optimizer dropping reloads of A within basic blocks and
+    jumps to the next instruction.
+
+    Blocks end at labels and jumps; a register is only considered dead
+    when it is overwritten before being read inside the same block.
+    """
+
+    def __init__(self):
+        self.saved: Dict[str, int] = {
+            "redundant-load": 0,
+            "jump-to-next": 0,
+        }
+
+    def optimize(self, source: Union[str, Iterable[str]]) -> List[str]:
+        parser = Parser(source)
+        blocks: List[List[str]] = [[]]
+        while parser.hasMoreCommands():
+            l = parser.command()
+            if l[0] == "(":
+                blocks.append([l])
+            else:
+                blocks[-1].append(l)
+                if ";" in l:
+                    blocks.append([])
+            parser.advance()
+        for block in blocks:
+            self._redundant_load(block)
+        lines = [l for block in blocks for l in block]
+        self._jump_to_next(lines)
+        return lines
+
+    def _redundant_load(self, block: List[str]) -> None:
+        # `@X` while A is already known to hold X
+        known_a = None
+        i = 0
+        while i < len(block):
+            l = block[i]
+            if l[0] == "@":
+                if l == known_a:
+                    del block[i]
+                    self.saved["redundant-load"] += 1
+                    continue
+                known_a = l
+            elif "A" in _effects(l)[1]:
+                known_a = None
+            i += 1
+
+    def _jump_to_next(self, lines: List[str]) -> None:
+        # `@L / 0;JMP` directly followed by `(L)`
+        i = 0
+        while i + 2 < len(lines):
+            l = lines[i]
+            if l[0] == "@" and lines[i + 1] == "0;JMP":
+                j = i + 2
+                while j < len(lines) and lines[j][0] == "(":
+                    j += 1
+                labels = [x[1:-1] for x in lines[i + 2 : j]]
+                if l[1:] in labels and _is_dead(lines, j, {"A"}):
+                    del lines[i : i + 2]
+                    self.saved["jump-to-next"] += 2
+                    continue
+            i += 1
+
+
+def _effects(command: str) -> Tuple[Set[str], Set[str], bool]:
+    # Returns (registers read, registers written, is a jump) of a command;
+    # `M` stands for the memory cell addressed by A.
+    if command[0] == "@":
+        return set(), {"A"}, False
+    if command[0] == "(":
+        return set(), set(), False
+    dest_and_comp, _, jump = command.partition(";")
+    dest, _, comp = dest_and_comp.rpartition("=")
+    reads = set(comp) & {"A", "D", "M"}
+    if "M" in reads or "M" in dest or jump:
+        reads.add("A")
+    return reads, set(dest), bool(jump)
+
+
+def _is_dead(lines: List[str], start: int, registers: Set[str]) -> bool:
+    # True if every register is overwritten before use within the basic
+    # block starting at `start`; anything reaching the block end is live.
+    remaining = set(registers)
+    if not remaining:
+        return True
+    for l in lines[start:]:
+        if l[0] == "(":
+            return False
+        reads, writes, is_jump = _effects(l)
+        if reads & remaining:
+            return False
+        remaining -= writes
+        if not remaining:
+            return True
+        if is_jump:
+            return False
+    return False
+
+
+def assemble(source: Union[str, Iterable[str]]) -> array:
+    """Assembles Hack assembly given as text or lines into a ROM image."""
+    return _single_pass(Parser(source))
+
+
 def main():
-    input_file = sys.argv[1]
-    symbol_table = _first_pass(input_file)
-    _second_pass(input_file, symbol_table)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file")
+    parser.add_argument(
+        "--two-pass",
+        action="store_true",
+        help="re-read the source in a second pass instead of backpatching",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="write to this file instead of stdout",
+    )
+    parser.add_argument(
+        "--binary",
+        action="store_true",
+        help="emit packed big-endian 16-bit words instead of ASCII bit strings",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write instructions as they are assembled and patch forward "
+        "references in place; requires -o",
+    )
+    parser.add_argument(
+        "-O",
+        "--optimize",
+        action="store_true",
+        help="run the peephole optimizer first and report instructions saved",
+    )
+    args = parser.parse_args()
+    if args.two_pass and (args.stream or args.optimize):
+        parser.error("--two-pass cannot be combined with --stream or --optimize")
+    if args.stream and args.output is None:
+        parser.error("--stream requires -o")
+    try:
+        _run(args)
+    except ValueError as e:
+        # stdout may be the assembled program
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def _run(args: argparse.Namespace) -> None:
+    with open(args.input_file) as f:
+        if args.optimize:
+            optimizer = Optimizer()
+            source = optimizer.optimize(f)
+            for rule, saved in optimizer.saved.items():
+                print(f"{rule}: {saved}", file=sys.stderr)
+        else:
+            source = f
+        if args.stream:
+            with open(args.output, "wb") as out:
+                _streaming_pass(Parser(source), out, args.binary)
+            return
+        if args.two_pass:
+            symbol_table = _first_pass(args.input_file)
+            words = _second_pass(args.input_file, symbol_table)
+        else:
+            words = assemble(source)
+    if args.binary:
+        _write_binary(words, args.output)
+    else:
+        _write_text(words, args.output)
 
 
 def _first_pass(input_file: str) -> Dict[str, int]:
-    parser = Parser(input_file)
     symbol_table = SymbolTable()
     rom_addr = 0
-    while parser.hasMoreCommands():
-        if parser.commandType() == _Command.L_COMMAND:
-            symbol_table.addEntry(parser.symbol(), rom_addr)
-        else:
-            rom_addr += 1
-        parser.advance()
+    with open(input_file) as f:
+        parser = Parser(f)
+        while parser.hasMoreCommands():
+            if parser.commandType() == _Command.L_COMMAND:
+                symbol_table.addEntry(parser.symbol(), rom_addr)
+            else:
+                rom_addr += 1
+            parser.advance()
     return symbol_table
 
 
-def _second_pass(input_file: str, symbol_table: Dict[str, int]) -> None:
-    parser = Parser(input_file)
+def _second_pass(input_file: str, symbol_table: Dict[str, int]) -> array:
     code = Code()
+    words = array("H")
     next_ram_addr = 16
+    with open(input_file) as f:
+        parser = Parser(f)
+        while parser.hasMoreCommands():
+            if parser.commandType() == _Command.C_COMMAND:
+                dest = code.dest(parser.dest())
+                comp = code.comp(parser.comp())
+                jump = code.jump(parser.jump())
+                words.append(int(f"111{comp}{dest}{jump}", 2))
+            elif parser.commandType() == _Command.A_COMMAND:
+                s = parser.symbol()
+                if symbol_table.contains(s):
+                    value = symbol_table.getAddress(s)
+                elif s[0] in "0123456789":
+                    value = _constant(s)
+                else:
+                    symbol_table.addEntry(s, next_ram_addr)
+                    value = next_ram_addr
+                    next_ram_addr += 1
+                words.append(int(value))
+            parser.advance()
+    return words
+
+
+def _constant(s: str) -> int:
+    # bit 15 is what tells a C-instruction from an A-instruction
+    value = int(s)
+    if value > 32767:
+        raise ValueError(f"constant out of range: @{s}")
+    return value
+
+
+def _single_pass(parser: Parser) -> array:
+    symbol_table = SymbolTable()
+    fixups: Dict[str, array] = {}
+    words = array("H", _encode(parser, symbol_table, fixups))
+    for value, indices in _resolve(symbol_table, fixups):
+        for i in indices:
+            words[i] = value
+    return words
+
+
+def _streaming_pass(parser: Parser, out: BinaryIO, binary: bool) -> None:
+    symbol_table = SymbolTable()
+    fixups: Dict[str, array] = {}
+    if binary:
+        width = 2
+        pack = _WORD.pack
+    else:
+        width = 17
+        pack = _text_word
+    for w in _encode(parser, symbol_table, fixups):
+        out.write(pack(w))
+    for value, indices in _resolve(symbol_table, fixups):
+        packed = pack(value)
+        for i in indices:
+            out.seek(i * width)
+            out.write(packed)
+
+
+def _encode(
+    parser: Parser, symbol_table: SymbolTable, fixups: Dict[str, array]
+) -> Iterator[int]:
+    # Yields one word per instruction. A-instructions referring to symbols
+    # that are not known yet yield 0 and record their index in `fixups`.
+    code = Code()
+    rom_addr = 0
     while parser.hasMoreCommands():
-        if parser.commandType() == _Command.C_COMMAND:
-            dest = code.dest(parser.dest())
-            comp = code.comp(parser.comp())
-            jump = code.jump(parser.jump())
-            print(f"111{comp}{dest}{jump}")
-        elif parser.commandType() == _Command.A_COMMAND:
+        command_type = parser.commandType()
+        if command_type == _Command.C_COMMAND:
+            yield code.instruction(parser.command())
+            rom_addr += 1
+        elif command_type == _Command.A_COMMAND:
             s = parser.symbol()
-            if symbol_table.contains(s):
-                value = symbol_table.getAddress(s)
-            elif s[0] in "0123456789":
-                value = s
+            if s[0] in "0123456789":
+                yield _constant(s)
+            elif symbol_table.contains(s):
+                yield symbol_table.getAddress(s)
             else:
-                symbol_table.addEntry(s, next_ram_addr)
-                value = next_ram_addr
-                next_ram_addr += 1
-            print("0{:015b}".format(int(value), 2))
+                if s not in fixups:
+                    fixups[s] = array("L")
+                fixups[s].append(rom_addr)
+                yield 0
+            rom_addr += 1
+        else:  # L_COMMAND
+            symbol_table.addEntry(parser.symbol(), rom_addr)
         parser.advance()
 
 
+def _resolve(
+    symbol_table: SymbolTable, fixups: Dict[str, array]
+) -> Iterator[Tuple[int, array]]:
+    # `fixups` is ordered by first reference, so variables are allocated
+    # exactly as the two-pass assembler does
+    next_ram_addr = 16
+    for s, indices in fixups.items():
+        if symbol_table.contains(s):
+            value = symbol_table.getAddress(s)
+        else:
+            symbol_table.addEntry(s, next_ram_addr)
+            value = next_ram_addr
+            next_ram_addr += 1
+        yield value, indices
+
+
+def _text_word(w: int) -> bytes:
+    return "{:016b}\n".format(w).encode()
+
+
+def _write_text(words: array, output_file: Optional[str]) -> None:
+    text = "".join("{:016b}\n".format(w) for w in words)
+    if output_file is None:
+        sys.stdout.write(text)
+    else:
+        with open(output_file, "w") as f:
+            f.write(text)
+
+
+def _write_binary(words: array, output_file: Optional[str]) -> None:
+    if sys.byteorder == "little":
+        words = array("H", words)
+        words.byteswap()
+    if output_file is None:
+        sys.stdout.buffer.write(words.tobytes())
+    else:
+        with open(output_file, "wb") as f:
+            words.tofile(f)
+
+
 if __name__ == "__main__":
     main()
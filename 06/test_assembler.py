@@ -0,0 +1,122 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from typing import Dict, List, Tuple
+
+import Assembler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "08"))
+from test_vm_translator import run_scripts  # noqa: E402
+
+# programs with symbols, and the same programs with numbers only
+PROGRAMS = [
+    ("add/Add.asm", None),
+    ("max/Max.asm", "max/MaxL.asm"),
+    ("rect/Rect.asm", "rect/RectL.asm"),
+    ("pong/Pong.asm", "pong/PongL.asm"),
+]
+
+
+def _read(name: str) -> str:
+    with open(os.path.join(HERE, name)) as f:
+        return f.read()
+
+
+class SinglePassTest(unittest.TestCase):
+    def test_matches_two_pass(self):
+        for name, _ in PROGRAMS:
+            with self.subTest(name):
+                path = os.path.join(HERE, name)
+                symbol_table = Assembler._first_pass(path)
+                two_pass = Assembler._second_pass(path, symbol_table)
+                self.assertEqual(Assembler.assemble(_read(name)), two_pass)
+
+    def test_matches_program_without_symbols(self):
+        for name, plain in PROGRAMS:
+            if plain is None:
+                continue
+            with self.subTest(name):
+                self.assertEqual(
+                    Assembler.assemble(_read(name)), Assembler.assemble(_read(plain))
+                )
+
+    def test_forward_references_and_variables(self):
+        # variables are allocated in order of first reference, labels
+        # defined after their use are patched in
+        words = list(Assembler.assemble("@END\n0;JMP\n@i\nM=1\n@j\nM=0\n(END)\n@i\n"))
+        self.assertEqual(words[0], 6)
+        self.assertEqual([words[2], words[4], words[6]], [16, 17, 16])
+
+    def test_constant_range(self):
+        self.assertEqual(list(Assembler.assemble("@32767\n")), [32767])
+        with self.assertRaises(ValueError):
+            Assembler.assemble("@40000\n")
+
+    def test_main_reports_errors(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "Big.asm")
+            with open(path, "w") as f:
+                f.write("@40000\n")
+            result = subprocess.run(
+                [sys.executable, os.path.join(HERE, "Assembler.py"), path],
+                capture_output=True,
+                text=True,
+            )
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stderr, "error: constant out of range: @40000\n")
+
+    def test_streaming_matches(self):
+        source = _read("pong/Pong.asm")
+        words = Assembler.assemble(source)
+        binary = io.BytesIO()
+        Assembler._streaming_pass(Assembler.Parser(source), binary, binary=True)
+        data = binary.getvalue()
+        self.assertEqual(
+            [Assembler._WORD.unpack_from(data, 2 * i)[0] for i in range(len(words))],
+            list(words),
+        )
+        text = io.BytesIO()
+        Assembler._streaming_pass(Assembler.Parser(source), text, binary=False)
+        self.assertEqual(
+            text.getvalue().decode().split(), [f"{w:016b}" for w in words]
+        )
+
+
+class OptimizerTest(unittest.TestCase):
+    def optimize(self, source: str) -> Tuple[List[str], Dict[str, int]]:
+        optimizer = Assembler.Optimizer()
+        return optimizer.optimize(source), optimizer.saved
+
+    def test_redundant_load(self):
+        lines, saved = self.optimize("@5\nD=A\n@5\nM=D\n@5\nA=M\n@5\nM=0\n")
+        self.assertEqual(lines, ["@5", "D=A", "M=D", "A=M", "@5", "M=0"])
+        self.assertEqual(saved["redundant-load"], 2)
+
+    def test_reload_after_label_is_kept(self):
+        lines, _ = self.optimize("@5\nD=A\n(L)\n@5\nM=D\n")
+        self.assertEqual(lines, ["@5", "D=A", "(L)", "@5", "M=D"])
+
+    def test_jump_to_next(self):
+        lines, saved = self.optimize("@END\n0;JMP\n(END)\n@0\nM=D\n")
+        self.assertEqual(lines, ["(END)", "@0", "M=D"])
+        self.assertEqual(saved["jump-to-next"], 2)
+
+    def test_jump_to_next_keeps_A_when_read(self):
+        # A still holds END after the jump, and D=A reads it
+        lines, _ = self.optimize("@END\n0;JMP\n(END)\nD=A\n")
+        self.assertEqual(lines, ["@END", "0;JMP", "(END)", "D=A"])
+
+    def test_translated_vm_programs(self):
+        # the optimized programs still give the results of 07/ and 08/
+        def optimize(code: str) -> str:
+            return "\n".join(self.optimize(code)[0])
+
+        run_scripts(self, None, optimize)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,471 @@
+import glob
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from typing import Callable, Dict, List, Optional, Tuple
+
+from vm_translator import (
+    Command,
+    CommandType,
+    CodeWriter,
+    Parser,
+    fold_constants,
+    inline_calls,
+    inlinable_functions,
+    promote_variables,
+    reachable_functions,
+    remove_discards,
+    remove_functions,
+    translate_file,
+    _translate_cached,
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "05"))
+from TestRunner import run_script  # noqa: E402
+from VMEmulator import VMEmulator  # noqa: E402
+
+SCRIPTS = sorted(
+    s
+    for s in glob.glob(os.path.join(HERE, "..", "0[78]", "*", "*", "*.tst"))
+    if not s.endswith("VME.tst")
+)
+
+# a small program with a leaf function with a loop, one small enough to
+# inline, constant expressions and a discarded value
+PROGRAM = {
+    "Sys": """
+        function Sys.init 0
+        push constant 6
+        push constant 7
+        call Math.multiply 2
+        pop static 0
+        push constant 3
+        call Math.abs 1
+        pop static 1
+        push constant 5
+        neg
+        call Math.abs 1
+        pop static 2
+        push constant 2
+        push constant 3
+        add
+        push constant 4
+        lt
+        pop static 3
+        push static 0
+        pop temp 0
+        push constant 0
+        not
+        not
+        if-goto SKIP
+        push constant 100
+        push constant 1
+        neg
+        and
+        push constant 0
+        add
+        pop static 4
+        label SKIP
+        label END
+        goto END
+    """,
+    "Math": """
+        function Math.abs 0
+        push argument 0
+        push constant 0
+        lt
+        if-goto NEGATIVE
+        push argument 0
+        return
+        label NEGATIVE
+        push argument 0
+        neg
+        return
+        function Math.multiply 4
+        push constant 0
+        pop local 0
+        push argument 0
+        pop local 1
+        push constant 1
+        pop local 2
+        push constant 0
+        pop local 3
+        label LOOP
+        push local 3
+        push constant 16
+        lt
+        not
+        if-goto END
+        push argument 1
+        push local 2
+        and
+        push constant 0
+        eq
+        if-goto NEXT
+        push local 0
+        push local 1
+        add
+        pop local 0
+        label NEXT
+        push local 1
+        push local 1
+        add
+        pop local 1
+        push local 2
+        push local 2
+        add
+        pop local 2
+        push local 3
+        push constant 1
+        add
+        pop local 3
+        goto LOOP
+        label END
+        push local 0
+        return
+    """,
+}
+
+
+def parse(source: str) -> List[Command]:
+    with tempfile.NamedTemporaryFile("w", suffix=".vm", delete=False) as f:
+        f.write(source)
+    try:
+        return Parser(f.name).commands
+    finally:
+        os.remove(f.name)
+
+
+def program() -> Dict[str, List[Command]]:
+    return {name: parse(source) for name, source in PROGRAM.items()}
+
+
+def run(programs: Dict[str, List[Command]]) -> Dict[str, int]:
+    # the statics, by name, after running a program to its end
+    emulator = VMEmulator()
+    emulator.load_commands(programs.items())
+    emulator.bootstrap()
+    emulator.run(100_000)
+    return {name: emulator.ram[a] for name, a in emulator._statics.items()}
+
+
+def run_scripts(
+    test: unittest.TestCase,
+    passes: Optional[Callable[[List[str], List[List[Command]]], List[List[Command]]]],
+    assembly_pass: Optional[Callable[[str], str]] = None,
+    **options: int,
+) -> None:
+    """Translates each 07/ and 08/ test program, after `passes` over its
+    files and commands if given, and checks it against its .cmp file.
+    `assembly_pass`, if given, rewrites the assembly code; `options` are
+    those of translate_file()."""
+    shared = options.get("shared_calls", False), options.get("shared_compare", False)
+    for script in SCRIPTS:
+        with test.subTest(script, **options), tempfile.TemporaryDirectory() as tmp:
+            name = os.path.basename(os.path.dirname(script))
+            directory = os.path.join(tmp, name)
+            shutil.copytree(os.path.dirname(script), directory)
+            files = sorted(glob.glob(os.path.join(directory, "*.vm")))
+            programs = [Parser(f).commands for f in files]
+            if passes is not None:
+                programs = passes(files, programs)
+            code = io.StringIO()
+            # programs without Sys.init are tested without bootstrap code,
+            # so the shared routines go after a loop that ends them
+            bootstrap = any(
+                c.arg1 == "Sys.init" for commands in programs for c in commands
+            )
+            if bootstrap:
+                CodeWriter(code, *shared).writeInit()
+            for f, commands in zip(files, programs):
+                code.write(translate_file(f, commands, **options))
+            if not bootstrap:
+                code.write("(END_OF_PROGRAM)\n@END_OF_PROGRAM\n0;JMP\n")
+                CodeWriter(code, *shared).writeSharedCode()
+            asm = code.getvalue()
+            if assembly_pass is not None:
+                asm = assembly_pass(asm)
+            with open(os.path.join(directory, f"{name}.asm"), "w") as f:
+                f.write(asm)
+            _, status, message = run_script(
+                os.path.join(directory, os.path.basename(script))
+            )
+            test.assertEqual(status, "ok", message)
+
+
+def _inline(files: List[str], programs: List[List[Command]]) -> List[List[Command]]:
+    names = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    functions = inlinable_functions(zip(names, programs), 20)
+    return [inline_calls(commands, functions)[0] for commands in programs]
+
+
+class TranslateTest(unittest.TestCase):
+    def test_scripts(self):
+        for opt_level in [0, 1, 2]:
+            run_scripts(self, None, opt_level=opt_level)
+
+    def test_scripts_with_locals_loop(self):
+        run_scripts(self, None, locals_loop=1)
+
+    def test_scripts_with_shared_code(self):
+        for opt_level in [0, 1, 2]:
+            for shared_calls in [False, True]:
+                for shared_compare in [False, True]:
+                    run_scripts(
+                        self,
+                        None,
+                        opt_level=opt_level,
+                        shared_calls=shared_calls,
+                        shared_compare=shared_compare,
+                    )
+
+    def test_example_program(self):
+        self.assertEqual(
+            run(program()),
+            {"Sys.0": 42, "Sys.1": 3, "Sys.2": 5, "Sys.3": 0, "Sys.4": 100},
+        )
+
+
+class InlineTest(unittest.TestCase):
+    def test_scripts(self):
+        run_scripts(self, _inline, opt_level=2)
+
+    def test_same_result(self):
+        programs = program()
+        functions = inlinable_functions(programs.items(), 20)
+        self.assertEqual(set(functions), {"Math.abs"})
+        inlined = {}
+        for name, commands in programs.items():
+            inlined[name], counts = inline_calls(commands, functions)
+            if name == "Sys":
+                self.assertEqual(counts, {"Math.abs": 2})
+        self.assertEqual(run(inlined), run(programs))
+
+    def test_temp_live_across_call(self):
+        programs = program()
+        programs["Sys"][1:1] = parse("push constant 1\npop temp 1")
+        programs["Sys"][-2:-2] = parse("push temp 1\npop static 9")
+        self.assertEqual(inlinable_functions(programs.items(), 20), {})
+
+    def test_size_limit(self):
+        programs = program()
+        functions = inlinable_functions(programs.items(), 20)
+        commands, counts = inline_calls(programs["Sys"], functions, max_words=10)
+        self.assertEqual(counts, {})
+        self.assertEqual(list(map(str, commands)), list(map(str, programs["Sys"])))
+
+    def test_size_limit_uses_options(self):
+        # Math.abs takes 60 words inlined, and 42 calling the shared lt
+        programs = program()
+        functions = inlinable_functions(programs.items(), 20)
+        _, counts = inline_calls(programs["Sys"], functions, max_words=50)
+        self.assertEqual(counts, {})
+        _, counts = inline_calls(
+            programs["Sys"], functions, max_words=50, shared_compare=True
+        )
+        self.assertEqual(counts, {"Math.abs": 2})
+
+
+def _fold(files: List[str], programs: List[List[Command]]) -> List[List[Command]]:
+    return remove_discards([fold_constants(commands) for commands in programs])
+
+
+class FoldTest(unittest.TestCase):
+    def fold(self, source: str) -> List[str]:
+        return [str(command) for command in fold_constants(parse(source))]
+
+    def test_constants(self):
+        self.assertEqual(
+            self.fold("push constant 7\npush constant 2\nsub\npush constant 3\nlt"),
+            ["push constant 0"],
+        )
+        # -1 takes as many commands as a constant
+        self.assertEqual(self.fold("push constant 1\nneg"), ["push constant 1", "neg"])
+
+    def test_constant_conditions(self):
+        self.assertEqual(
+            self.fold("push constant 0\nnot\nnot\nif-goto A\ngoto B"), ["goto B"]
+        )
+        self.assertEqual(
+            self.fold("push constant 0\nnot\nif-goto A\ngoto B"),
+            ["goto A", "goto B"],
+        )
+
+    def test_identities(self):
+        self.assertEqual(
+            self.fold(
+                "push local 0\npush constant 0\nadd\npush constant 1\nneg\nand\n"
+                "not\nnot\nneg\nneg"
+            ),
+            ["push local 0"],
+        )
+
+    def test_discards(self):
+        programs = remove_discards(list(program().values()))
+        self.assertNotIn("pop temp 0", map(str, programs[0]))
+        # a value read back is kept
+        commands = parse("push static 0\npop temp 0\npush temp 0\npop static 1")
+        self.assertEqual(len(remove_discards([commands])[0]), 4)
+
+    def test_discards_kept_when_read_after_jump(self):
+        # temp 0 is read after a label, so no discard can be proven
+        commands = parse(
+            "push static 0\npop temp 0\nlabel L\npush temp 0\npop static 1"
+        )
+        self.assertEqual(remove_discards([commands]), [commands])
+
+    def test_same_result(self):
+        programs = program()
+        folded = dict(zip(programs, _fold(list(programs), list(programs.values()))))
+        self.assertLess(len(folded["Sys"]), len(programs["Sys"]))
+        self.assertEqual(run(folded), run(programs))
+
+    def test_scripts(self):
+        run_scripts(self, _fold, opt_level=2)
+
+
+def _promote(files: List[str], programs: List[List[Command]]) -> List[List[Command]]:
+    return promote_variables(programs, 7)[0]
+
+
+class PromoteTest(unittest.TestCase):
+    def test_leaf_loop_locals(self):
+        # Math.abs has no loop and Sys.init calls functions
+        _, promoted = promote_variables(list(program().values()), 3)
+        self.assertEqual(promoted, {"Math.multiply": ["local 1", "local 2", "local 3"]})
+
+    def test_same_result(self):
+        programs = program()
+        promoted, _ = promote_variables(list(programs.values()), 7)
+        self.assertEqual(run(dict(zip(programs, promoted))), run(programs))
+
+    def test_temps_live_across_calls_are_kept(self):
+        programs = program()
+        programs["Sys"][1:1] = parse("push constant 1\npop temp 1")
+        programs["Sys"][-2:-2] = parse("push temp 1\npop static 9")
+        promoted, variables = promote_variables(list(programs.values()), 7)
+        self.assertNotIn("pop temp 1", map(str, promoted[1]))
+        self.assertIn("Math.multiply", variables)
+        self.assertEqual(run(dict(zip(programs, promoted))), run(programs))
+
+    def test_scripts(self):
+        run_scripts(self, _promote, opt_level=2)
+
+
+def _remove_dead(
+    files: List[str], programs: List[List[Command]]
+) -> List[List[Command]]:
+    reached = reachable_functions(programs)
+    # programs without Sys.init run from their first command instead
+    if not reached:
+        return programs
+    functions = {
+        c.arg1
+        for commands in programs
+        for c in commands
+        if c.type == CommandType.C_FUNCTION
+    }
+    return [remove_functions(commands, functions - reached) for commands in programs]
+
+
+class RemoveFunctionsTest(unittest.TestCase):
+    def test_unreachable_function_is_removed(self):
+        sys_vm = parse("function Sys.init 0\ncall Main.main 0\nlabel END\ngoto END")
+        main_vm = parse(
+            "function Main.main 0\ncall Main.helper 0\nreturn\n"
+            "function Main.unused 0\ncall Main.helper 0\nreturn\n"
+            "function Main.helper 0\npush constant 0\nreturn"
+        )
+        reached = reachable_functions([sys_vm, main_vm])
+        self.assertEqual(reached, {"Sys.init", "Main.main", "Main.helper"})
+        kept = remove_functions(main_vm, {"Main.unused"})
+        self.assertEqual(
+            [str(c) for c in kept],
+            [
+                "function Main.main 0",
+                "call Main.helper 0",
+                "return",
+                "function Main.helper 0",
+                "push constant 0",
+                "return",
+            ],
+        )
+
+    def test_same_result(self):
+        programs = program()
+        programs["Math"] += parse("function Math.unused 0\npush constant 1\nreturn")
+        removed = dict(
+            zip(programs, _remove_dead(list(programs), list(programs.values())))
+        )
+        self.assertEqual(len(removed["Math"]), len(programs["Math"]) - 3)
+        self.assertEqual(run(removed), run(programs))
+
+    def test_scripts(self):
+        run_scripts(self, _remove_dead)
+
+
+class CacheTest(unittest.TestCase):
+    def test_hits_and_misses(self):
+        source = os.path.join(HERE, "FunctionCalls", "SimpleFunction")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "SimpleFunction.vm")
+            shutil.copy(os.path.join(source, "SimpleFunction.vm"), path)
+            cache_dir = os.path.join(tmp, "__vmcache__")
+
+            def translate(**options: int) -> Tuple[str, bool]:
+                return _translate_cached(path, None, cache_dir, **options)
+
+            code, hit = translate()
+            self.assertFalse(hit)
+            self.assertEqual(code, translate_file(path))
+            self.assertEqual(translate(), (code, True))
+            for options in [{"opt_level": 2}, {"shared_calls": True}]:
+                with self.subTest(**options):
+                    self.assertFalse(translate(**options)[1])
+                    self.assertTrue(translate(**options)[1])
+            with open(path, "a") as f:
+                f.write("push constant 0\n")
+            code, hit = translate()
+            self.assertFalse(hit)
+            self.assertEqual(code, translate_file(path))
+
+
+class JobsTest(unittest.TestCase):
+    def test_parallel_matches_serial(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, "StaticsTest")
+            source = os.path.join(HERE, "FunctionCalls", "StaticsTest")
+            shutil.copytree(source, directory)
+            code = {}
+            for jobs in [1, 3]:
+                output = os.path.join(tmp, f"{jobs}.asm")
+                subprocess.run(
+                    [
+                        sys.executable,
+                        os.path.join(HERE, "vm_translator.py"),
+                        directory,
+                        output,
+                        f"--jobs={jobs}",
+                        "--no-cache",
+                    ],
+                    check=True,
+                    capture_output=True,
+                )
+                with open(output) as f:
+                    code[jobs] = f.read()
+            self.assertEqual(code[3], code[1])
+            # labels are namespaced by file, so each is defined once
+            labels = [l.split()[0] for l in code[3].splitlines() if l.startswith("(")]
+            self.assertEqual(len(labels), len(set(labels)))
+            shutil.copy(output, os.path.join(directory, "StaticsTest.asm"))
+            _, status, message = run_script(os.path.join(directory, "StaticsTest.tst"))
+            self.assertEqual(status, "ok", message)
+
+
+if __name__ == "__main__":
+    unittest.main()
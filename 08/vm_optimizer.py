@@ -0,0 +1,49 @@
+import argparse
+import os
+
+from vm_translator import Parser, fold_constants, promote_variables, remove_discards
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="optimize .vm files without translating them"
+    )
+    arg_parser.add_argument("input_file_or_dir")
+    arg_parser.add_argument("output_dir")
+    arg_parser.add_argument(
+        "--promote",
+        type=int,
+        default=0,
+        metavar="N",
+        help="keep up to N of the most used locals and arguments of leaf "
+        "functions in temp",
+    )
+    args = arg_parser.parse_args()
+    input_file_or_dir = args.input_file_or_dir
+    if os.path.isfile(input_file_or_dir):
+        input_files = [input_file_or_dir]
+    else:
+        dir = input_file_or_dir
+        input_files = sorted(
+            f"{dir}/{f}" for f in os.listdir(dir) if f.endswith("vm")
+        )
+    programs = [Parser(f).commands for f in input_files]
+    # discards can only be removed knowing every file of the program
+    optimized = remove_discards([fold_constants(c) for c in programs])
+    if args.promote:
+        optimized, promoted = promote_variables(optimized, args.promote)
+        for name in sorted(promoted):
+            print(f"{name}: promoted {', '.join(promoted[name])}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    for f, before, after in zip(input_files, programs, optimized):
+        with open(os.path.join(args.output_dir, os.path.basename(f)), "w") as out:
+            out.writelines(f"{command}\n" for command in after)
+        print(f"{os.path.basename(f)}: {len(before)} -> {len(after)} commands")
+    print(
+        f"total: {sum(len(c) for c in programs)}"
+        f" -> {sum(len(c) for c in optimized)} commands"
+    )
+
+
+if __name__ == "__main__":
+    main()
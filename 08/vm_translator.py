@@ -1,9 +1,33 @@
+import argparse
+import hashlib
+import io
 import os
-import sys
-from enum import Enum, auto
+from concurrent.futures import ProcessPoolExecutor
+from enum import IntEnum, auto
+from functools import partial
+from typing import (
+    Callable,
+    Container,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 
-class _Command(Enum):
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__vmcache__")
+
+ROM_SIZE = 32768
+
+# bump when the generated code changes so stale cache entries are ignored
+_TRANSLATOR_VERSION = "3"
+
+
+class CommandType(IntEnum):
     C_ARITHMETIC = auto()
     C_PUSH = auto()
     C_POP = auto()
@@ -15,6 +39,71 @@ class _Command(Enum):
     C_CALL = auto()
 
 
+class Command:
+    """One parsed VM command.
+
+    `arg1` is the operation of an arithmetic command and the first
+    argument of the others; `arg2` is the numeric second argument of
+    push, pop, function and call. `file` names the file whose static
+    segment a push or pop uses when that is not the file being
+    translated, as in inlined code.
+    """
+
+    __slots__ = ("type", "arg1", "arg2", "file")
+
+    def __init__(
+        self,
+        type: CommandType,
+        arg1: str = "",
+        arg2: int = 0,
+        file: Optional[str] = None,
+    ):
+        self.type = type
+        self.arg1 = arg1
+        self.arg2 = arg2
+        self.file = file
+
+    def __repr__(self) -> str:
+        file = "" if self.file is None else f", file={self.file!r}"
+        return f"Command({self.type.name}, {self.arg1!r}, {self.arg2}{file})"
+
+    def __str__(self) -> str:
+        """The command as a line of VM code."""
+        if self.type == CommandType.C_ARITHMETIC:
+            return self.arg1
+        elif self.type == CommandType.C_RETURN:
+            return "return"
+        elif self.type in [CommandType.C_LABEL, CommandType.C_GOTO, CommandType.C_IF]:
+            return f"{_COMMAND_NAMES[self.type]} {self.arg1}"
+        return f"{_COMMAND_NAMES[self.type]} {self.arg1} {self.arg2}"
+
+
+# first word of a command line -> its type
+_COMMAND_TYPES = {
+    "add": CommandType.C_ARITHMETIC,
+    "sub": CommandType.C_ARITHMETIC,
+    "neg": CommandType.C_ARITHMETIC,
+    "eq": CommandType.C_ARITHMETIC,
+    "gt": CommandType.C_ARITHMETIC,
+    "lt": CommandType.C_ARITHMETIC,
+    "and": CommandType.C_ARITHMETIC,
+    "or": CommandType.C_ARITHMETIC,
+    "not": CommandType.C_ARITHMETIC,
+    "push": CommandType.C_PUSH,
+    "pop": CommandType.C_POP,
+    "label": CommandType.C_LABEL,
+    "goto": CommandType.C_GOTO,
+    "if-goto": CommandType.C_IF,
+    "function": CommandType.C_FUNCTION,
+    "return": CommandType.C_RETURN,
+    "call": CommandType.C_CALL,
+}
+
+_COMMAND_NAMES = {
+    t: name for name, t in _COMMAND_TYPES.items() if t != CommandType.C_ARITHMETIC
+}
+
+
 _SEGMENT_TO_LABEL = {
     "local": "LCL",
     "argument": "ARG",
@@ -27,67 +116,85 @@ _SEGMENT_BASE = {
     "temp": 5,
 }
 
+# jump taken when a comparison is true, given D = x - y
+_COMPARISON_JUMP = {
+    "eq": "JEQ",
+    "gt": "JGT",
+    "lt": "JLT",
+}
+
 
 class Parser:
     def __init__(self, file: str):
+        """Parses the whole file into `commands` up front."""
         self._lineno = 0
-        self._lines = []
+        self.commands: List[Command] = []
         with open(file) as f:
-            for l in f.readlines():
-                l = l.split("//")[0].strip()
-                if not l:
+            for l in f:
+                words = l.split("//")[0].split()
+                if not words:
                     continue
-                self._lines.append(l)
+                command_type = _COMMAND_TYPES.get(words[0])
+                if command_type is None:
+                    raise ValueError(f"unknown VM command: {l.strip()}")
+                if command_type == CommandType.C_ARITHMETIC:
+                    command = Command(command_type, words[0])
+                elif len(words) > 2:
+                    command = Command(command_type, words[1], int(words[2]))
+                elif len(words) > 1:
+                    command = Command(command_type, words[1])
+                else:
+                    command = Command(command_type)
+                self.commands.append(command)
 
     def hasMoreCommands(self) -> bool:
-        if len(self._lines) > self._lineno:
-            return True
-        else:
-            return False
+        return len(self.commands) > self._lineno
 
     def advance(self) -> None:
         self._lineno += 1
 
-    def commandType(self) -> _Command:
-        l = self._lines[self._lineno]
-        if l in ["add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"]:
-            return _Command.C_ARITHMETIC
-        elif l.startswith("push "):
-            return _Command.C_PUSH
-        elif l.startswith("pop "):
-            return _Command.C_POP
-        elif l.startswith("label "):
-            return _Command.C_LABEL
-        elif l.startswith("if-goto "):
-            return _Command.C_IF
-        elif l.startswith("goto "):
-            return _Command.C_GOTO
-        elif l.startswith("function "):
-            return _Command.C_FUNCTION
-        elif l.startswith("return"):
-            return _Command.C_RETURN
-        elif l.startswith("call "):
-            return _Command.C_CALL
+    def commandType(self) -> CommandType:
+        return self.commands[self._lineno].type
 
     def arg1(self) -> str:
-        args = self._lines[self._lineno].split(" ")
-        if self.commandType() == _Command.C_ARITHMETIC:
-            return args[0]
-        else:
-            return args[1]
+        return self.commands[self._lineno].arg1
 
-    def arg2(self) -> str:
-        args = self._lines[self._lineno].split(" ")
-        return args[2]
+    def arg2(self) -> int:
+        return self.commands[self._lineno].arg2
 
 
 class CodeWriter:
-    def __init__(self, file: str):
-        self._writer = open(file, "w")
+    def __init__(
+        self,
+        file: Union[str, TextIO],
+        shared_calls: bool = False,
+        shared_compare: bool = False,
+        locals_loop: int = 0,
+    ):
+        """`file` is a path or an open text stream. `shared_calls` makes
+        call and return sites jump to one copy of the calling sequence,
+        and `shared_compare` makes eq, gt and lt call one routine per
+        operator, instead of inlining them. The shared code is emitted by
+        writeInit. Functions with at least `locals_loop` locals, if it is
+        not 0, zero them in a loop, which is shorter but slower.
+        """
+        self._writer = open(file, "w") if isinstance(file, str) else file
         self._label_id = 1
+        # prefix of generated labels; empty for the bootstrap code
+        self._label_prefix = ""
+        self._shared_calls = shared_calls
+        self._shared_compare = shared_compare
+        self._locals_loop = locals_loop
 
     def setFileName(self, filename: str) -> None:
+        """Starts a new file. Generated labels are namespaced by the file
+        name and numbered from 1, so each file translates to the same code
+        whatever was translated before it."""
         self._filename = os.path.splitext(os.path.basename(filename))[0]
+        # labels outside any function are scoped to the file
+        self._function = self._filename
+        self._label_prefix = f"{self._filename}$"
+        self._label_id = 1
 
     def writeArithmetic(self, command: str) -> None:
         writelines = []
@@ -104,6 +211,15 @@ class CodeWriter:
                     "A=M-1",
                     "M=-M",
                 ]
+        elif command in ["eq", "gt", "lt"] and self._shared_compare:
+            writelines += [
+                f"@{self._label_prefix}RETURN_COMPARE{self._label_id}  // {command}",
+                "D=A",
+                f"@${command.upper()}",
+                "0;JMP",
+                f"({self._label_prefix}RETURN_COMPARE{self._label_id})",
+            ]
+            self._label_id += 1
         else:
             writelines += [
                 f"@SP  // {command}",
@@ -124,94 +240,82 @@ class CodeWriter:
             else:
                 writelines += [
                     "D=M-D",
-                    f"@TRUE{self._label_id}",
+                    f"@{self._label_prefix}TRUE{self._label_id}",
                 ]
                 if command == "eq":
                     writelines += [
                         "D;JEQ",
-                        f"@FALSE{self._label_id}",
+                        f"@{self._label_prefix}FALSE{self._label_id}",
                         "D;JNE",
                     ]
                 elif command == "gt":
                     writelines += [
                         "D;JGT",
-                        f"@FALSE{self._label_id}",
+                        f"@{self._label_prefix}FALSE{self._label_id}",
                         "D;JLE",
                     ]
                 else:  # lt
                     writelines += [
                         "D;JLT",
-                        f"@FALSE{self._label_id}",
+                        f"@{self._label_prefix}FALSE{self._label_id}",
                         "D;JGE",
                     ]
                 writelines += [
-                    f"(TRUE{self._label_id})",
+                    f"({self._label_prefix}TRUE{self._label_id})",
                     "D=-1",
                     "@SP",
                     "A=M-1",
                     "M=D",
-                    f"@END{self._label_id}",
+                    f"@{self._label_prefix}END{self._label_id}",
                     "0;JMP",
-                    f"(FALSE{self._label_id})",
+                    f"({self._label_prefix}FALSE{self._label_id})",
                     "@SP",
                     "A=M-1",
                     "M=0",
-                    f"@END{self._label_id}",
+                    f"@{self._label_prefix}END{self._label_id}",
                     "0;JMP",
-                    f"(END{self._label_id})",
+                    f"({self._label_prefix}END{self._label_id})",
                 ]
                 self._label_id += 1
         self._writer.write("\n".join(writelines))
         self._writer.write("\n")
 
-    def writePushPop(self, command: _Command, segment: str, index: int) -> None:
-        if command == _Command.C_PUSH:
+    def writePushPop(
+        self,
+        command: CommandType,
+        segment: str,
+        index: int,
+        file: Optional[str] = None,
+    ) -> None:
+        if command == CommandType.C_PUSH and segment == "constant" and index in [0, 1]:
             writelines = [
-                f"@{index}  // push {segment} {index}",
-                "D=A",
+                f"@SP  // push {segment} {index}",
+                "AM=M+1",
+                "A=A-1",
+                f"M={index}",
             ]
-            if segment in ["temp", "pointer"]:
-                writelines += [
-                    f"@{_SEGMENT_BASE[segment] + index}",
-                    "D=M",
-                ]
-            elif segment == "static":
-                writelines += [
-                    f"@{self._filename}.{index}",
-                    "D=M",
-                ]
-            elif segment != "constant":
-                writelines += [
-                    f"@{_SEGMENT_TO_LABEL[segment]}",
-                    "A=M+D",
-                    "D=M",
-                ]
-            writelines += [
+        elif command == CommandType.C_PUSH:
+            writelines = self._load(segment, index, file) + [
                 "@SP",
-                "A=M",
+                "AM=M+1",
+                "A=A-1",
+                "M=D",
+            ]
+            writelines[0] += f"  // push {segment} {index}"
+        elif self._point(segment, index, file) is not None:  # C_POP
+            writelines = [
+                f"@SP  // pop {segment} {index}",
+                "AM=M-1",
+                "D=M",
+                *self._point(segment, index, file),
                 "M=D",
-                "@SP",
-                "M=M+1",
             ]
         else:  # C_POP
-            if segment in ["temp", "pointer"]:
-                writelines = [
-                    f"@{_SEGMENT_BASE[segment] + index}  // pop {segment} {index}",
-                    "D=A",
-                ]
-            elif segment == "static":
-                writelines = [
-                    f"@{self._filename}.{index}  // pop {segment} {index}",
-                    "D=A",
-                ]
-            else:
-                writelines = [
-                    f"@{index}  // pop {segment} {index}",
-                    "D=A",
-                    f"@{_SEGMENT_TO_LABEL[segment]}",
-                    "D=M+D",
-                ]
-            writelines += [
+            writelines = [
+                f"@{index}  // pop {segment} {index}",
+                "D=A",
+                f"@{_SEGMENT_TO_LABEL[segment]}",
+                "D=M+D",
                 "@SP",
                 "A=M",
                 "M=D",
@@ -226,6 +330,30 @@ class CodeWriter:
         self._writer.write("\n".join(writelines))
         self._writer.write("\n")
 
+    def _point(
+        self, segment: str, index: int, file: Optional[str] = None
+    ) -> Optional[List[str]]:
+        # instructions that set A to the address of segment[index] and
+        # leave D alone, or None where the index has to be added with D
+        if segment == "static":
+            return [f"@{file or self._filename}.{index}"]
+        elif segment in _SEGMENT_BASE:
+            return [f"@{_SEGMENT_BASE[segment] + index}"]
+        elif segment in _SEGMENT_TO_LABEL and index in [0, 1]:
+            # the first two entries are reached through the base pointer
+            # without loading the index
+            return [f"@{_SEGMENT_TO_LABEL[segment]}", "A=M" if index == 0 else "A=M+1"]
+        return None
+
+    def _load(self, segment: str, index: int, file: Optional[str] = None) -> List[str]:
+        # instructions that set D to segment[index]
+        if segment == "constant":
+            return [f"@{index}", "D=A"]
+        point = self._point(segment, index, file)
+        if point is not None:
+            return point + ["D=M"]
+        return [f"@{index}", "D=A", f"@{_SEGMENT_TO_LABEL[segment]}", "A=M+D", "D=M"]
+
     def writeInit(self) -> None:
         self._writer.write("\n".join([
             # SP=256
@@ -236,16 +364,105 @@ class CodeWriter:
         ]))
         self._writer.write("\n")
         self.writeCall("Sys.init", 0)
+        # Sys.init never returns, so the routines can follow it
+        self.writeSharedCode()
+
+    def writeSharedCode(self) -> None:
+        """Writes the routines that shared calls and comparisons jump to.
+        writeInit writes them after the bootstrap code; programs without
+        one must keep them where execution cannot run into them."""
+        if self._shared_calls:
+            self._writeSharedCall()
+            self._writeSharedReturn()
+        if self._shared_compare:
+            for command in _COMPARISON_JUMP:
+                self._writeSharedComparison(command)
+
+    def _writeSharedComparison(self, command: str) -> None:
+        # ($EQ), ($GT) and ($LT) expect the return address in D and
+        # replace the top two stack values with the result
+        name = command.upper()
+        self._writer.write("\n".join([
+            f"(${name})",
+            "@R15",
+            "M=D",
+            "@SP",
+            "AM=M-1",
+            "D=M",
+            "A=A-1",
+            "D=M-D",
+            "M=-1",
+            f"@${name}_TRUE",
+            f"D;{_COMPARISON_JUMP[command]}",
+            "@SP",
+            "A=M-1",
+            "M=0",
+            f"(${name}_TRUE)",
+            "@R15",
+            "A=M",
+            "0;JMP",
+        ]))
+        self._writer.write("\n")
+
+    def _writeSharedCall(self) -> None:
+        # ($CALL) expects the return address in D, the function in R13
+        # and the number of arguments in R14
+        writelines = [
+            "($CALL)",
+            # push return-address
+            "@SP",
+            "AM=M+1",
+            "A=A-1",
+            "M=D",
+        ]
+        for register in ["LCL", "ARG", "THIS", "THAT"]:
+            writelines += [
+                # push LCL/ARG/THIS/THAT
+                f"@{register}",
+                "D=M",
+                "@SP",
+                "AM=M+1",
+                "A=A-1",
+                "M=D",
+            ]
+        writelines += [
+            # ARG = SP - n - 5
+            "@R14",
+            "D=M",
+            "@5",
+            "D=D+A",
+            "@SP",
+            "D=M-D",
+            "@ARG",
+            "M=D",
+
+            # LCL = SP
+            "@SP",
+            "D=M",
+            "@LCL",
+            "M=D",
+
+            # goto f
+            "@R13",
+            "A=M",
+            "0;JMP",
+        ]
+        self._writer.write("\n".join(writelines))
+        self._writer.write("\n")
+
+    def _writeSharedReturn(self) -> None:
+        self._writer.write("($RETURN)\n")
+        self._writeReturnSequence()
 
     def writeLabel(self, label: str) -> None:
         self._writer.write("\n".join([
-            f"({self._filename}.{label})  // label {label}",
+            f"({self._function}${label})  // label {label}",
         ]))
         self._writer.write("\n")
 
     def writeGoto(self, label: str) -> None:
         self._writer.write("\n".join([
-            f"@{self._filename}.{label}  // goto {label}",
+            f"@{self._function}${label}  // goto {label}",
             "0;JMP",
         ]))
         self._writer.write("\n")
@@ -256,15 +473,141 @@ class CodeWriter:
             "M=M-1",
             "A=M",
             "D=M",
-            f"@{self._filename}.{label}",
+            f"@{self._function}${label}",
             "D;JNE",
         ]))
         self._writer.write("\n")
 
+    def writeCompareIf(self, command: str, label: str) -> None:
+        """Writes eq, gt or lt directly followed by if-goto `label` as one
+        conditional jump, without pushing the boolean."""
+        self._writer.write("\n".join([
+            f"@SP  // {command}, if-goto {label}",
+            "AM=M-1",
+            "D=M",
+            "@SP",
+            "AM=M-1",
+            "D=M-D",
+            f"@{self._function}${label}",
+            f"D;{_COMPARISON_JUMP[command]}",
+        ]))
+        self._writer.write("\n")
+
+    def writeMove(self, push: Command, pop: Command) -> None:
+        """Writes a push directly followed by a pop as one copy through D,
+        without going through the stack."""
+        point = self._point(pop.arg1, pop.arg2, pop.file)
+        if push.arg1 == "constant" and push.arg2 in [0, 1] and point is not None:
+            writelines = point + [f"M={push.arg2}"]
+        elif point is not None:
+            writelines = self._load(push.arg1, push.arg2, push.file) + point + ["M=D"]
+        else:
+            writelines = [
+                f"@{pop.arg2}",
+                "D=A",
+                f"@{_SEGMENT_TO_LABEL[pop.arg1]}",
+                "D=M+D",
+                "@R13",
+                "M=D",
+                *self._load(push.arg1, push.arg2, push.file),
+                "@R13",
+                "A=M",
+                "M=D",
+            ]
+        writelines[0] += f"  // {push}, {pop}"
+        self._writer.write("\n".join(writelines))
+        self._writer.write("\n")
+
+    def writePushArithmetic(self, push: Command, command: str) -> None:
+        """Writes a push directly followed by add, sub, and or or as one
+        update of the top of the stack."""
+        op = {"add": "+", "sub": "-", "and": "&", "or": "|"}[command]
+        if push.arg1 == "constant" and push.arg2 == 1 and command in ["add", "sub"]:
+            writelines = ["@SP", "A=M-1", f"M=M{op}1"]
+        else:
+            writelines = self._load(push.arg1, push.arg2, push.file) + [
+                "@SP",
+                "A=M-1",
+                f"M=M{op}D",
+            ]
+        writelines[0] += f"  // {push}, {command}"
+        self._writer.write("\n".join(writelines))
+        self._writer.write("\n")
+
+    def writeAddInPlace(self, push: Command, constant: int, command: str) -> None:
+        """Writes push x, push constant n, add or sub, pop x as one update
+        of x."""
+        op = "+" if command == "add" else "-"
+        point = self._point(push.arg1, push.arg2, push.file)
+        if constant == 1 and point is not None:
+            writelines = point + [f"M=M{op}1"]
+        elif point is not None:
+            writelines = [f"@{constant}", "D=A", *point, f"M=M{op}D"]
+        else:
+            writelines = [
+                f"@{push.arg2}",
+                "D=A",
+                f"@{_SEGMENT_TO_LABEL[push.arg1]}",
+                "D=M+D",
+                "@R13",
+                "M=D",
+                f"@{constant}",
+                "D=A",
+                "@R13",
+                "A=M",
+                f"M=M{op}D",
+            ]
+        writelines[0] += f"  // {push}, push constant {constant}, {command}, pop"
+        self._writer.write("\n".join(writelines))
+        self._writer.write("\n")
+
+    def writeArrayStore(self) -> None:
+        """Writes the `a[i] = x` sequence of compiled Jack code, pop temp 0,
+        pop pointer 1, push temp 0, pop that 0, without the stack round
+        trip of x."""
+        self._writer.write("\n".join([
+            "@SP  // pop temp 0, pop pointer 1, push temp 0, pop that 0",
+            "AM=M-1",
+            "D=M",
+            "@5",
+            "M=D",
+            "@SP",
+            "AM=M-1",
+            "D=M",
+            "@THAT",
+            "M=D",
+            "@5",
+            "D=M",
+            "@THAT",
+            "A=M",
+            "M=D",
+        ]))
+        self._writer.write("\n")
+
     def writeCall(self, functionName: str, numArgs: int) -> None:
+        if self._shared_calls:
+            if numArgs in [0, 1]:
+                set_num_args = ["@R14", f"M={numArgs}"]
+            else:
+                set_num_args = [f"@{numArgs}", "D=A", "@R14", "M=D"]
+            self._writer.write("\n".join([
+                f"@{functionName}  // call {functionName} {numArgs}",
+                "D=A",
+                "@R13",
+                "M=D",
+                *set_num_args,
+                f"@{self._label_prefix}{functionName}.RETURN_ADDRESS.{self._label_id}",
+                "D=A",
+                "@$CALL",
+                "0;JMP",
+                f"({self._label_prefix}{functionName}.RETURN_ADDRESS.{self._label_id})",
+            ]))
+            self._writer.write("\n")
+            self._label_id += 1
+            return
         self._writer.write("\n".join([
             # push return-address
-            f"@{functionName}.RETURN_ADDRESS.{self._label_id}  // call {functionName} {numArgs}",
+            f"@{self._label_prefix}{functionName}.RETURN_ADDRESS.{self._label_id}  // call {functionName} {numArgs}",
             "D=A",
             "@SP",
             "A=M",
@@ -329,28 +672,61 @@ class CodeWriter:
             "0;JMP",
 
             # (return-address)
-            f"({functionName}.RETURN_ADDRESS.{self._label_id})",
+            f"({self._label_prefix}{functionName}.RETURN_ADDRESS.{self._label_id})",
         ]))
         self._writer.write("\n")
         self._label_id += 1
 
     def writeFunction(self, functionName: str, numLocals: int) -> None:
+        self._function = functionName
         writelines = [
             f"({functionName}) // function {functionName} {numLocals}",
         ]
-        for _ in range(numLocals):
+        if self._locals_loop and numLocals >= self._locals_loop:
+            # LCL = SP on entry, so zero LCL[n-1] down to LCL[0]
+            loop = f"{self._label_prefix}{functionName}.LOCALS.{self._label_id}"
+            self._label_id += 1
             writelines += [
-                # push 0
+                f"@{numLocals}",
+                "D=A",
                 "@SP",
-                "A=M",
+                "M=M+D",
+                f"({loop})",
+                "D=D-1",
+                "@LCL",
+                "A=D+M",
                 "M=0",
-                "@SP",
-                "M=M+1",
+                f"@{loop}",
+                "D;JGT",
             ]
+        elif numLocals > 2:
+            writelines += ["@SP", "A=M", "M=0"]
+            for _ in range(numLocals - 1):
+                writelines += ["A=A+1", "M=0"]
+            writelines += ["D=A+1", "@SP", "M=D"]
+        else:
+            for _ in range(numLocals):
+                writelines += [
+                    # push 0
+                    "@SP",
+                    "AM=M+1",
+                    "A=A-1",
+                    "M=0",
+                ]
         self._writer.write("\n".join(writelines))
         self._writer.write("\n")
 
     def writeReturn(self) -> None:
+        if self._shared_calls:
+            self._writer.write("\n".join([
+                "@$RETURN  // return",
+                "0;JMP",
+            ]))
+            self._writer.write("\n")
+        else:
+            self._writeReturnSequence()
+
+    def _writeReturnSequence(self) -> None:
         writelines = [
             # FRAME (R13) = LCL
             "@LCL  // return",
@@ -425,49 +801,962 @@ class CodeWriter:
         self._writer.close()
 
 
+_WRITERS: Dict[CommandType, Callable[["CodeWriter", Command], None]] = {
+    CommandType.C_ARITHMETIC: lambda w, c: w.writeArithmetic(c.arg1),
+    CommandType.C_PUSH: lambda w, c: w.writePushPop(c.type, c.arg1, c.arg2, c.file),
+    CommandType.C_POP: lambda w, c: w.writePushPop(c.type, c.arg1, c.arg2, c.file),
+    CommandType.C_LABEL: lambda w, c: w.writeLabel(c.arg1),
+    CommandType.C_GOTO: lambda w, c: w.writeGoto(c.arg1),
+    CommandType.C_IF: lambda w, c: w.writeIf(c.arg1),
+    CommandType.C_FUNCTION: lambda w, c: w.writeFunction(c.arg1, c.arg2),
+    CommandType.C_RETURN: lambda w, c: w.writeReturn(),
+    CommandType.C_CALL: lambda w, c: w.writeCall(c.arg1, c.arg2),
+}
+
+
+def _is_compare_if(commands: List[Command], i: int) -> bool:
+    return (
+        commands[i].type == CommandType.C_ARITHMETIC
+        and commands[i].arg1 in _COMPARISON_JUMP
+        and i + 1 < len(commands)
+        and commands[i + 1].type == CommandType.C_IF
+    )
+
+
+_ARRAY_STORE = [
+    (CommandType.C_POP, "temp", 0),
+    (CommandType.C_POP, "pointer", 1),
+    (CommandType.C_PUSH, "temp", 0),
+    (CommandType.C_POP, "that", 0),
+]
+
+
+def _is_array_store(commands: List[Command], i: int) -> bool:
+    return [(c.type, c.arg1, c.arg2) for c in commands[i : i + 4]] == _ARRAY_STORE
+
+
+def _is_add_in_place(commands: List[Command], i: int) -> bool:
+    if i + 4 > len(commands):
+        return False
+    push, constant, arithmetic, pop = commands[i : i + 4]
+    return (
+        push.type == CommandType.C_PUSH
+        and push.arg1 != "constant"
+        and constant.type == CommandType.C_PUSH
+        and constant.arg1 == "constant"
+        and arithmetic.type == CommandType.C_ARITHMETIC
+        and arithmetic.arg1 in ["add", "sub"]
+        and pop.type == CommandType.C_POP
+        and (pop.arg1, pop.arg2, pop.file) == (push.arg1, push.arg2, push.file)
+    )
+
+
+def _is_move(commands: List[Command], i: int) -> bool:
+    return (
+        commands[i].type == CommandType.C_PUSH
+        and i + 1 < len(commands)
+        and commands[i + 1].type == CommandType.C_POP
+    )
+
+
+def _is_push_arithmetic(commands: List[Command], i: int) -> bool:
+    return (
+        commands[i].type == CommandType.C_PUSH
+        and i + 1 < len(commands)
+        and commands[i + 1].type == CommandType.C_ARITHMETIC
+        and commands[i + 1].arg1 in ["add", "sub", "and", "or"]
+    )
+
+
+# command sequences written as one piece of code, tried in this order:
+# name -> (lowest -O level, number of commands, matches, writer)
+_FUSED: Dict[
+    str,
+    Tuple[
+        int,
+        int,
+        Callable[[List[Command], int], bool],
+        Callable[[CodeWriter, List[Command]], None],
+    ],
+] = {
+    "compare, if-goto": (
+        1,
+        2,
+        _is_compare_if,
+        lambda w, c: w.writeCompareIf(c[0].arg1, c[1].arg1),
+    ),
+    "array store": (2, 4, _is_array_store, lambda w, c: w.writeArrayStore()),
+    "add in place": (
+        2,
+        4,
+        _is_add_in_place,
+        lambda w, c: w.writeAddInPlace(c[0], c[1].arg2, c[2].arg1),
+    ),
+    "push, pop": (2, 2, _is_move, lambda w, c: w.writeMove(c[0], c[1])),
+    "push, arithmetic": (
+        2,
+        2,
+        _is_push_arithmetic,
+        lambda w, c: w.writePushArithmetic(c[0], c[1].arg1),
+    ),
+}
+
+
+def _fused(commands: List[Command], i: int, opt_level: int) -> Optional[str]:
+    # the fused sequence that starts at commands[i], if any
+    for name, (level, _, matches, _) in _FUSED.items():
+        if level <= opt_level and matches(commands, i):
+            return name
+    return None
+
+
+def fused_sequences(commands: List[Command], opt_level: int) -> Dict[str, int]:
+    """Returns how many times translate() fuses each sequence."""
+    counts: Dict[str, int] = {}
+    i = 0
+    while i < len(commands):
+        name = _fused(commands, i, opt_level)
+        if name is None:
+            i += 1
+        else:
+            counts[name] = counts.get(name, 0) + 1
+            i += _FUSED[name][1]
+    return counts
+
+
+def translate(
+    code_writer: CodeWriter, commands: List[Command], opt_level: int = 0
+) -> None:
+    """Writes the commands of one file; setFileName() must be called first.
+
+    At `opt_level` 1 eq, gt and lt followed by if-goto become one jump;
+    at 2 the other sequences of _FUSED are also written as one piece of
+    code each, without the stack round trips in between.
+    """
+    writers = _WRITERS
+    i = 0
+    while i < len(commands):
+        name = _fused(commands, i, opt_level) if opt_level else None
+        if name is not None:
+            _, length, _, write = _FUSED[name]
+            write(code_writer, commands[i : i + length])
+            i += length
+            continue
+        command = commands[i]
+        writers[command.type](code_writer, command)
+        i += 1
+
+
+def reachable_functions(
+    programs: Iterable[List[Command]], entry: str = "Sys.init"
+) -> Set[str]:
+    """Returns the functions that can be called, directly or indirectly,
+    from `entry` or from code outside any function."""
+    calls: Dict[str, Set[str]] = {}
+    roots = [entry]
+    for commands in programs:
+        function = None
+        for command in commands:
+            if command.type == CommandType.C_FUNCTION:
+                function = command.arg1
+                calls.setdefault(function, set())
+            elif command.type == CommandType.C_CALL:
+                if function is None:
+                    roots.append(command.arg1)
+                else:
+                    calls[function].add(command.arg1)
+    reached: Set[str] = set()
+    while roots:
+        function = roots.pop()
+        if function in reached or function not in calls:
+            continue
+        reached.add(function)
+        roots += calls[function]
+    return reached
+
+
+def remove_functions(
+    commands: List[Command], removed: Container[str]
+) -> List[Command]:
+    """Returns the commands without the bodies of the `removed` functions."""
+    kept = []
+    keep = True
+    for command in commands:
+        if command.type == CommandType.C_FUNCTION:
+            keep = command.arg1 not in removed
+        if keep:
+            kept.append(command)
+    return kept
+
+
+def _live_in(
+    body: List[Command], segments: Container[str]
+) -> List[Set[Tuple[str, int]]]:
+    # for each command of a function body, the (segment, index) variables
+    # of `segments` that it or a command after it may read before they
+    # are written
+    labels = {c.arg1: i for i, c in enumerate(body) if c.type == CommandType.C_LABEL}
+    successors = []
+    for i, command in enumerate(body):
+        if command.type == CommandType.C_GOTO:
+            targets = [labels.get(command.arg1)]
+        elif command.type == CommandType.C_IF:
+            targets = [i + 1, labels.get(command.arg1)]
+        elif command.type == CommandType.C_RETURN:
+            targets = []
+        else:
+            targets = [i + 1]
+        successors.append([j for j in targets if j is not None and j < len(body)])
+    live: List[Set[Tuple[str, int]]] = [set() for _ in body]
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(body))):
+            command = body[i]
+            variables = set().union(*(live[j] for j in successors[i]))
+            if (
+                command.type in [CommandType.C_PUSH, CommandType.C_POP]
+                and command.arg1 in segments
+            ):
+                if command.type == CommandType.C_PUSH:
+                    variables.add((command.arg1, command.arg2))
+                else:
+                    variables.discard((command.arg1, command.arg2))
+            if variables != live[i]:
+                live[i] = variables
+                changed = True
+    return live
+
+
+def _functions(
+    commands: List[Command],
+) -> List[Tuple[Optional[Command], List[Command]]]:
+    # splits commands into (function command, body) pairs; code before the
+    # first function has no function command
+    functions: List[Tuple[Optional[Command], List[Command]]] = [(None, [])]
+    for command in commands:
+        if command.type == CommandType.C_FUNCTION:
+            functions.append((command, []))
+        else:
+            functions[-1][1].append(command)
+    return functions
+
+
+def _temps_live_across_calls(programs: Iterable[List[Command]]) -> Set[int]:
+    # the temp cells that some function may read after a call without
+    # writing them first, which code run by the call must leave alone
+    taken: Set[int] = set()
+    for commands in programs:
+        for _, body in _functions(commands):
+            live = _live_in(body, ["temp"])
+            for command, variables in zip(body, live):
+                if command.type == CommandType.C_CALL:
+                    taken.update(index for _, index in variables)
+    return taken
+
+
+# arithmetic commands that take two values off the stack
+_BINARY = ["add", "sub", "eq", "gt", "lt", "and", "or"]
+
+# the Jack compiler only uses temp 0, so inlined functions keep their
+# arguments, locals and the caller's pointers in the rest of temp
+_INLINE_TEMP = range(1, 8)
+
+
+def _inlinable(body: List[Command]) -> bool:
+    # a leaf function can run on its caller's stack if, as in compiled
+    # Jack, the stack is empty at labels and jumps and holds just the
+    # result at each return. Functions with loops are left alone, as the
+    # call costs little next to them.
+    if not body or body[-1].type not in [CommandType.C_RETURN, CommandType.C_GOTO]:
+        return False
+    depth = 0
+    labels = set()
+    for command in body:
+        if command.type == CommandType.C_LABEL:
+            labels.add(command.arg1)
+        elif command.type in [CommandType.C_GOTO, CommandType.C_IF]:
+            if command.arg1 in labels:
+                return False
+        if command.type == CommandType.C_CALL:
+            return False
+        elif command.type in [CommandType.C_PUSH, CommandType.C_POP]:
+            if command.arg1 == "temp" and command.arg2 in _INLINE_TEMP:
+                return False
+            depth += 1 if command.type == CommandType.C_PUSH else -1
+        elif command.type == CommandType.C_ARITHMETIC:
+            depth -= command.arg1 in _BINARY
+        elif command.type == CommandType.C_IF:
+            depth -= 1
+        elif command.type == CommandType.C_RETURN:
+            if depth != 1:
+                return False
+            depth = 0
+        if depth < 0:
+            return False
+        if command.type in [
+            CommandType.C_LABEL, CommandType.C_GOTO, CommandType.C_IF
+        ] and depth != 0:
+            return False
+    return True
+
+
+def inlinable_functions(
+    programs: Iterable[Tuple[str, List[Command]]], max_size: int
+) -> Dict[str, Tuple[str, int, List[Command]]]:
+    """Returns the leaf functions of at most `max_size` commands that
+    inline_calls() can substitute, as name -> (file, locals, body).
+    `programs` pairs each file name (without .vm) with its commands.
+
+    Inlined code keeps its variables in temp 1 to 7, so there are none
+    if some function keeps a value there across a call.
+    """
+    programs = list(programs)
+    if _temps_live_across_calls(c for _, c in programs) & set(_INLINE_TEMP):
+        return {}
+    functions = {}
+    for file, commands in programs:
+        function = None
+        body: List[Command] = []
+        for command in commands + [Command(CommandType.C_FUNCTION)]:
+            if command.type != CommandType.C_FUNCTION:
+                body.append(command)
+                continue
+            if function is not None and len(body) <= max_size and _inlinable(body):
+                functions[function.arg1] = (file, function.arg2, body)
+            function = command
+            body = []
+    return functions
+
+
+def inline_calls(
+    commands: List[Command],
+    functions: Dict[str, Tuple[str, int, List[Command]]],
+    max_words: Optional[int] = None,
+    **options: int,
+) -> Tuple[List[Command], Dict[str, int]]:
+    """Replaces calls of `functions` (see inlinable_functions()) with
+    their bodies, with arguments and locals kept in temp. Calls whose
+    inlined code would take more than `max_words` instructions, if it is
+    given, are kept; `options` are the translate_file() options the code
+    is translated with. Returns the new commands and how many calls of
+    each function were inlined."""
+    inlined: Dict[str, int] = {}
+    for command in commands:
+        if (
+            command.type in [CommandType.C_PUSH, CommandType.C_POP]
+            and command.arg1 == "temp"
+            and command.arg2 in _INLINE_TEMP
+        ):
+            # the file needs its temp segment for itself
+            return commands, inlined
+    result = []
+    site = 0
+    # inlined code has the same size at every site of a call
+    sizes: Dict[Tuple[str, int], int] = {}
+    for command in commands:
+        if command.type == CommandType.C_CALL and command.arg1 in functions:
+            body = _inline_call(command, functions[command.arg1], site)
+            if body is not None and max_words is not None:
+                key = (command.arg1, command.arg2)
+                if key not in sizes:
+                    file = functions[command.arg1][0]
+                    code = translate_file(file, body, **options)
+                    sizes[key] = count_words(code)
+                if sizes[key] > max_words:
+                    body = None
+            if body is not None:
+                result += body
+                inlined[command.arg1] = inlined.get(command.arg1, 0) + 1
+                site += 1
+                continue
+        result.append(command)
+    return result, inlined
+
+
+def _inline_call(
+    call: Command, function: Tuple[str, int, List[Command]], site: int
+) -> Optional[List[Command]]:
+    # the commands replacing one call, or None if they do not fit in temp
+    file, n_locals, body = function
+    n_args = call.arg2
+    pointers = sorted({
+        c.arg2 for c in body if c.type == CommandType.C_POP and c.arg1 == "pointer"
+    })
+    if n_args + n_locals + len(pointers) > len(_INLINE_TEMP):
+        return None
+    base = _INLINE_TEMP[0]
+    sizes = {"argument": n_args, "local": n_locals}
+    slots = {"argument": base, "local": base + n_args}
+    saved = base + n_args + n_locals
+    for c in body:
+        if c.arg1 in sizes and c.arg2 >= sizes[c.arg1]:
+            return None
+    push = CommandType.C_PUSH
+    pop = CommandType.C_POP
+    result = [Command(pop, "temp", base + i) for i in reversed(range(n_args))]
+    for k, p in enumerate(pointers):
+        result += [Command(push, "pointer", p), Command(pop, "temp", saved + k)]
+    for i in range(n_locals):
+        result += [
+            Command(push, "constant", 0),
+            Command(pop, "temp", slots["local"] + i),
+        ]
+    end = f"{call.arg1}.RETURN.{site}"
+    jumps_to_end = False
+    for i, c in enumerate(body):
+        if c.type in [push, pop] and c.arg1 in slots:
+            c = Command(c.type, "temp", slots[c.arg1] + c.arg2)
+        elif c.type in [push, pop] and c.arg1 == "static":
+            c = Command(c.type, "static", c.arg2, c.file or file)
+        elif c.type in [CommandType.C_LABEL, CommandType.C_GOTO, CommandType.C_IF]:
+            c = Command(c.type, f"{call.arg1}.{c.arg1}.{site}")
+        elif c.type == CommandType.C_RETURN:
+            if i == len(body) - 1:
+                continue
+            c = Command(CommandType.C_GOTO, end)
+            jumps_to_end = True
+        result.append(c)
+    if jumps_to_end:
+        result.append(Command(CommandType.C_LABEL, end))
+    for k, p in enumerate(pointers):
+        result += [Command(push, "temp", saved + k), Command(pop, "pointer", p)]
+    return result
+
+
+def _word(value: int) -> int:
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+# operations on constants, as the VM language defines them; eq, gt and lt
+# compare the 16-bit values, true is -1
+_FOLD_UNARY: Dict[str, Callable[[int], int]] = {
+    "neg": lambda a: _word(-a),
+    "not": lambda a: ~a,
+}
+_FOLD_BINARY: Dict[str, Callable[[int, int], int]] = {
+    "add": lambda a, b: _word(a + b),
+    "sub": lambda a, b: _word(a - b),
+    "and": lambda a, b: a & b,
+    "or": lambda a, b: a | b,
+    "eq": lambda a, b: -(a == b),
+    "gt": lambda a, b: -(a > b),
+    "lt": lambda a, b: -(a < b),
+}
+# x op constant that leaves x as it is
+_IDENTITY = {("add", 0), ("sub", 0), ("or", 0), ("and", -1)}
+
+
+def _constant(value: int) -> List[Command]:
+    # the shortest commands that push `value`
+    if value >= 0:
+        return [Command(CommandType.C_PUSH, "constant", value)]
+    elif value == -0x8000:
+        return [
+            Command(CommandType.C_PUSH, "constant", 0x7FFF),
+            Command(CommandType.C_ARITHMETIC, "not"),
+        ]
+    return [
+        Command(CommandType.C_PUSH, "constant", -value),
+        Command(CommandType.C_ARITHMETIC, "neg"),
+    ]
+
+
+def fold_constants(commands: List[Command]) -> List[Command]:
+    """Evaluates arithmetic and logic on constants, including the if-goto
+    of a constant condition, and drops operations that leave their operand
+    as it is: adding, subtracting or or-ing 0, and-ing with true, and
+    double not or neg."""
+    result: List[Command] = []
+    # for each command of result, the value and first command of the
+    # constant expression that ends there, if it does
+    constants: List[Optional[Tuple[int, int]]] = []
+
+    def replace(start: int, value: int) -> None:
+        del result[start:]
+        del constants[start:]
+        for command in _constant(value):
+            result.append(command)
+            constants.append((value, start))
+
+    for command in commands:
+        top = constants[-1] if constants else None
+        if command.type == CommandType.C_PUSH and command.arg1 == "constant":
+            result.append(command)
+            constants.append((command.arg2, len(result) - 1))
+            continue
+        elif (
+            command.type == CommandType.C_ARITHMETIC
+            and command.arg1 in _FOLD_UNARY
+        ):
+            if top is not None:
+                value, start = top
+                value = _FOLD_UNARY[command.arg1](value)
+                if len(_constant(value)) <= len(result) - start:
+                    replace(start, value)
+                else:
+                    result.append(command)
+                    constants.append((value, start))
+                continue
+            elif result[-1:] and str(result[-1]) == command.arg1:
+                del result[-1]
+                del constants[-1]
+                continue
+        elif command.type == CommandType.C_ARITHMETIC and top is not None:
+            b, start = top
+            below = constants[start - 1] if start > 0 else None
+            if below is not None:
+                a, start = below
+                replace(start, _FOLD_BINARY[command.arg1](a, b))
+                continue
+            elif (command.arg1, b) in _IDENTITY:
+                del result[start:]
+                del constants[start:]
+                continue
+        elif command.type == CommandType.C_IF and top is not None:
+            value, start = top
+            del result[start:]
+            del constants[start:]
+            if value:
+                result.append(Command(CommandType.C_GOTO, command.arg1))
+                constants.append(None)
+            continue
+        result.append(command)
+        constants.append(None)
+    return result
+
+
+def _reads_temp_0(command: Command) -> bool:
+    return command.type == CommandType.C_PUSH and (command.arg1, command.arg2) == (
+        "temp",
+        0,
+    )
+
+
+def _writes_temp_0(command: Command) -> bool:
+    return command.type == CommandType.C_POP and (command.arg1, command.arg2) == (
+        "temp",
+        0,
+    )
+
+
+def _straight(command: Command) -> bool:
+    # commands that can neither jump nor be jumped to
+    return command.type in [
+        CommandType.C_ARITHMETIC,
+        CommandType.C_PUSH,
+        CommandType.C_POP,
+    ]
+
+
+def remove_discards(programs: List[List[Command]]) -> List[List[Command]]:
+    """Removes `push x, pop temp 0` pairs whose value is never read.
+
+    That is only known when temp 0 is read nowhere but shortly after it
+    is written, as compiled Jack code does in array stores: each push
+    temp 0 must follow a pop temp 0 with no label, jump, call or return
+    in between, in every file of the program. Otherwise the programs are
+    returned as they are.
+    """
+    for commands in programs:
+        for i, command in enumerate(commands):
+            if _reads_temp_0(command):
+                j = i - 1
+                while (
+                    j >= 0
+                    and _straight(commands[j])
+                    and not _writes_temp_0(commands[j])
+                ):
+                    j -= 1
+                if j < 0 or not _writes_temp_0(commands[j]):
+                    return programs
+    result = []
+    for commands in programs:
+        kept: List[Command] = []
+        for i, command in enumerate(commands):
+            if (
+                _writes_temp_0(command)
+                and kept
+                and kept[-1].type == CommandType.C_PUSH
+                and not _reads_temp_0(kept[-1])
+            ):
+                # the value is read if a push temp 0 follows before the
+                # next write or jump
+                j = i + 1
+                while (
+                    j < len(commands)
+                    and _straight(commands[j])
+                    and not _writes_temp_0(commands[j])
+                    and not _reads_temp_0(commands[j])
+                ):
+                    j += 1
+                if not (j < len(commands) and _reads_temp_0(commands[j])):
+                    kept.pop()
+                    continue
+            kept.append(command)
+        result.append(kept)
+    return result
+
+
+def promote_variables(
+    programs: List[List[Command]], count: int
+) -> Tuple[List[List[Command]], Dict[str, List[str]]]:
+    """Moves up to `count` of the most used locals and arguments of each
+    leaf function into temp 1 to 7, which compiles to direct @R6 to @R12
+    accesses instead of going through LCL and ARG.
+
+    A leaf function calls nothing, so no other call of it can be running
+    and the only other code running is its callers, stopped at a call.
+    A temp cell is therefore free for it unless some function may read
+    the cell after a call without writing it first, or it uses the cell
+    itself. Uses inside loops count more; a variable used just once, or
+    an argument only used outside loops, is left alone. Returns the new
+    programs and the promoted variables of each function.
+    """
+    taken = _temps_live_across_calls(programs)
+    temps = [k for k in _INLINE_TEMP if k not in taken]
+    promoted: Dict[str, List[str]] = {}
+    result = []
+    for commands in programs:
+        promoted_commands: List[Command] = []
+        for function, body in _functions(commands):
+            if function is None:
+                promoted_commands += body
+                continue
+            if any(c.type == CommandType.C_CALL for c in body):
+                promoted_commands += [function] + body
+                continue
+            function_commands, variables = _promote(function, body, temps, count)
+            promoted_commands += function_commands
+            if variables:
+                promoted[function.arg1] = variables
+        result.append(promoted_commands)
+    return result, promoted
+
+
+def _promote(
+    function: Command, body: List[Command], temps: List[int], count: int
+) -> Tuple[List[Command], List[str]]:
+    # the commands of one leaf function with its variables promoted
+    push = CommandType.C_PUSH
+    pop = CommandType.C_POP
+    used = {c.arg2 for c in body if c.type in [push, pop] and c.arg1 == "temp"}
+    temps = [k for k in temps if k not in used]
+    # each use counts 8 times more for each loop around it
+    depth = [0] * len(body)
+    labels: Dict[str, int] = {}
+    for i, command in enumerate(body):
+        if command.type == CommandType.C_LABEL:
+            labels[command.arg1] = i
+        elif command.type in [CommandType.C_GOTO, CommandType.C_IF]:
+            for j in range(labels.get(command.arg1, i + 1), i + 1):
+                depth[j] += 1
+    uses: Dict[Tuple[str, int], int] = {}
+    for command, d in zip(body, depth):
+        if command.type in [push, pop] and command.arg1 in ["local", "argument"]:
+            key = (command.arg1, command.arg2)
+            uses[key] = uses.get(key, 0) + 8 ** d
+    # variables read before they are written start as the argument or 0,
+    # which only pays off if they are used in a loop
+    entry = _live_in(body, ["local", "argument"])[0] if body else set()
+    chosen = sorted(
+        (key for key in uses if uses[key] >= (8 if key in entry else 2)),
+        key=lambda k: (-uses[k], k),
+    )
+    slots = dict(zip(chosen[:count], temps))
+    if not slots:
+        return [function] + body, []
+    # promoted locals at the end of the frame need not be allocated
+    kept = [
+        c.arg2 for c in body
+        if c.type in [push, pop]
+        and c.arg1 == "local"
+        and ("local", c.arg2) not in slots
+    ]
+    n_locals = 1 + max(kept, default=-1)
+    result = [Command(CommandType.C_FUNCTION, function.arg1, n_locals)]
+    for (segment, index), temp in slots.items():
+        if (segment, index) in entry:
+            if segment == "argument":
+                result.append(Command(push, segment, index))
+            else:
+                result.append(Command(push, "constant", 0))
+            result.append(Command(pop, "temp", temp))
+    for command in body:
+        if command.type in [push, pop] and (command.arg1, command.arg2) in slots:
+            command = Command(command.type, "temp", slots[command.arg1, command.arg2])
+        result.append(command)
+    return result, [f"{segment} {index}" for segment, index in slots]
+
+
+def count_words(code: str) -> int:
+    """Returns the number of instructions in assembly code."""
+    count = 0
+    for l in code.splitlines():
+        l = l.split("//")[0].strip()
+        if l and not l.startswith("("):
+            count += 1
+    return count
+
+
+def translate_file(
+    path: str,
+    commands: Optional[List[Command]] = None,
+    shared_calls: bool = False,
+    shared_compare: bool = False,
+    opt_level: int = 0,
+    locals_loop: int = 0,
+) -> str:
+    """Translates one .vm file on its own and returns the assembly.
+    `commands` replaces the file's own commands, for instance after
+    whole-program passes."""
+    if commands is None:
+        commands = Parser(path).commands
+    output = io.StringIO()
+    code_writer = CodeWriter(output, shared_calls, shared_compare, locals_loop)
+    code_writer.setFileName(path)
+    translate(code_writer, commands, opt_level)
+    return output.getvalue()
+
+
+def _translate_cached(
+    path: str,
+    commands: Optional[List[Command]],
+    cache_dir: Optional[str],
+    **options: int,
+) -> Tuple[str, bool]:
+    # translates one file unless its assembly is cached, and tells which
+    if cache_dir is None:
+        return translate_file(path, commands, **options), False
+    h = hashlib.sha256(_TRANSLATOR_VERSION.encode())
+    # statics and labels are named after the file
+    name = os.path.basename(path)
+    h.update(name.encode() + b"\0")
+    h.update(repr(sorted(options.items())).encode() + b"\0")
+    if commands is None:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    else:
+        h.update("\n".join(map(repr, commands)).encode())
+    cache_file = os.path.join(
+        cache_dir, f"{os.path.splitext(name)[0]}-{h.hexdigest()}.asm"
+    )
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return f.read(), True
+    code = translate_file(path, commands, **options)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file + ".tmp", "w") as f:
+        f.write(code)
+    os.replace(cache_file + ".tmp", cache_file)
+    return code, False
+
+
 def main():
-    input_file_or_dir = sys.argv[1]
-    output_file = sys.argv[2]
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("input_file_or_dir")
+    arg_parser.add_argument("output_file")
+    arg_parser.add_argument(
+        "--shared-calls",
+        action="store_true",
+        help="share one copy of the call and return sequences to save ROM",
+    )
+    arg_parser.add_argument(
+        "--shared-compare",
+        action="store_true",
+        help="call one shared routine for each of eq, gt and lt",
+    )
+    arg_parser.add_argument(
+        "--fuse-branches",
+        action="store_true",
+        help="jump directly on eq, gt and lt followed by if-goto (same as -O 1)",
+    )
+    arg_parser.add_argument(
+        "-O",
+        "--opt-level",
+        type=int,
+        choices=[0, 1, 2],
+        default=0,
+        help="1 fuses eq, gt and lt with if-goto; 2 also fuses common "
+        "push, pop and arithmetic sequences",
+    )
+    arg_parser.add_argument(
+        "--locals-loop",
+        type=int,
+        default=0,
+        metavar="N",
+        help="zero the locals of functions with at least N locals in a loop",
+    )
+    arg_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of files to translate in parallel (default: one per CPU)",
+    )
+    arg_parser.add_argument(
+        "--inline",
+        type=int,
+        default=0,
+        metavar="SIZE",
+        help="inline calls of leaf functions of at most SIZE commands",
+    )
+    arg_parser.add_argument(
+        "--fold-constants",
+        action="store_true",
+        help="evaluate arithmetic on constants and drop unused pop temp 0 values",
+    )
+    arg_parser.add_argument(
+        "--promote",
+        type=int,
+        default=0,
+        metavar="N",
+        help="keep up to N of the most used locals and arguments of leaf "
+        "functions in temp",
+    )
+    arg_parser.add_argument(
+        "--remove-dead-functions",
+        action="store_true",
+        help="leave out functions that Sys.init can never call",
+    )
+    arg_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="translate every file instead of reusing unchanged ones",
+    )
+    args = arg_parser.parse_args()
+    opt_level = max(args.opt_level, 1 if args.fuse_branches else 0)
+    input_file_or_dir = args.input_file_or_dir
+    output_file = args.output_file
     if os.path.isfile(input_file_or_dir):
         input_files = [input_file_or_dir]
     else:
         dir = input_file_or_dir
-        input_files = [f"{dir}/{f}" for f in os.listdir(dir) if f.endswith("vm")]
-    code_writer = CodeWriter(output_file)
+        input_files = sorted(
+            f"{dir}/{f}" for f in os.listdir(dir) if f.endswith("vm")
+        )
+    # whole-program passes work on the commands of all files at once
+    programs: List[Optional[List[Command]]] = [None] * len(input_files)
+    if (
+        args.inline
+        or args.fold_constants
+        or args.promote
+        or args.remove_dead_functions
+    ):
+        programs = [Parser(f).commands for f in input_files]
+    if args.inline:
+        file_names = [os.path.splitext(os.path.basename(f))[0] for f in input_files]
+        functions = inlinable_functions(zip(file_names, programs), args.inline)
+        # calls are only inlined where that does not make the code longer
+        call_code = io.StringIO()
+        code_writer = CodeWriter(call_code, args.shared_calls)
+        code_writer.setFileName("Main")
+        code_writer.writeCall("Main.main", 2)
+        call_words = count_words(call_code.getvalue())
+        inlined: Dict[str, int] = {}
+        for i, commands in enumerate(programs):
+            programs[i], counts = inline_calls(
+                commands,
+                functions,
+                call_words,
+                shared_calls=args.shared_calls,
+                shared_compare=args.shared_compare,
+                opt_level=opt_level,
+            )
+            for name, count in counts.items():
+                inlined[name] = inlined.get(name, 0) + count
+    if args.fold_constants:
+        unfolded = sum(len(commands) for commands in programs)
+        programs = remove_discards([fold_constants(c) for c in programs])
+        folded = sum(len(commands) for commands in programs)
+    if args.promote:
+        programs, promoted = promote_variables(programs, args.promote)
+    if args.remove_dead_functions:
+        reached = reachable_functions(programs)
+        removed = [
+            {
+                c.arg1 for c in commands
+                if c.type == CommandType.C_FUNCTION and c.arg1 not in reached
+            }
+            for commands in programs
+        ]
+        # translate the removed functions alone to tell what they cost
+        dead_code = io.StringIO()
+        code_writer = CodeWriter(
+            dead_code, args.shared_calls, args.shared_compare, args.locals_loop
+        )
+        for f, commands, names in zip(input_files, programs, removed):
+            dead = []
+            function = None
+            for command in commands:
+                if command.type == CommandType.C_FUNCTION:
+                    function = command.arg1
+                if function in names:
+                    dead.append(command)
+            code_writer.setFileName(f)
+            translate(code_writer, dead, opt_level)
+        programs = [remove_functions(c, r) for c, r in zip(programs, removed)]
+    cache_dir = None if args.no_cache else CACHE_DIR
+    translate_one = partial(
+        _translate_cached,
+        cache_dir=cache_dir,
+        shared_calls=args.shared_calls,
+        shared_compare=args.shared_compare,
+        opt_level=opt_level,
+        locals_loop=args.locals_loop,
+    )
+    jobs = min(args.jobs or os.cpu_count() or 1, len(input_files))
+    if jobs <= 1:
+        results = [translate_one(f, c) for f, c in zip(input_files, programs)]
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(translate_one, input_files, programs))
+    code_writer = CodeWriter(output_file, args.shared_calls, args.shared_compare)
     code_writer.writeInit()
-    for input_file in input_files:
-        parser = Parser(input_file)
-        code_writer.setFileName(input_file)
-        while parser.hasMoreCommands():
-            command_type = parser.commandType()
-            if command_type == _Command.C_ARITHMETIC:
-                arg1 = parser.arg1()
-                code_writer.writeArithmetic(arg1)
-            elif command_type in [_Command.C_PUSH, _Command.C_POP]:
-                arg1 = parser.arg1()
-                arg2 = parser.arg2()
-                code_writer.writePushPop(command_type, arg1, int(arg2))
-            elif command_type == _Command.C_LABEL:
-                arg1 = parser.arg1()
-                code_writer.writeLabel(arg1)
-            elif command_type == _Command.C_IF:
-                arg1 = parser.arg1()
-                code_writer.writeIf(arg1)
-            elif command_type == _Command.C_GOTO:
-                arg1 = parser.arg1()
-                code_writer.writeGoto(arg1)
-            elif command_type == _Command.C_FUNCTION:
-                arg1 = parser.arg1()
-                arg2 = parser.arg2()
-                code_writer.writeFunction(arg1, int(arg2))
-            elif command_type == _Command.C_RETURN:
-                code_writer.writeReturn()
-            elif command_type == _Command.C_CALL:
-                arg1 = parser.arg1()
-                arg2 = parser.arg2()
-                code_writer.writeCall(arg1, int(arg2))
-            parser.advance()
     code_writer.close()
+    # the files are linked in name order, so the output does not depend on
+    # the number of workers
+    with open(output_file, "a") as f:
+        f.writelines(code for code, _ in results)
+    with open(output_file) as f:
+        words = count_words(f.read())
+    if words > ROM_SIZE:
+        print(f"warning: the program takes {words} words, ROM holds {ROM_SIZE}")
+    if cache_dir is not None:
+        hits = sum(hit for _, hit in results)
+        print(f"cache: {hits} hits, {len(results) - hits} misses")
+    if opt_level:
+        fused: Dict[str, int] = {}
+        for f, commands in zip(input_files, programs):
+            if commands is None:
+                commands = Parser(f).commands
+            counts = fused_sequences(commands, opt_level)
+            for name, count in counts.items():
+                fused[name] = fused.get(name, 0) + count
+        print(f"fused sequences (-O {opt_level}):")
+        for name, (level, _, _, _) in _FUSED.items():
+            if level <= opt_level:
+                print(f"  {name:20} {fused.get(name, 0):6}")
+    if args.inline:
+        print(
+            f"inlined {sum(inlined.values())} calls of {len(inlined)} functions: "
+            + ", ".join(f"{name} ({inlined[name]})" for name in sorted(inlined))
+        )
+    if args.fold_constants:
+        print(f"folded constants: {unfolded} -> {folded} commands")
+    if args.promote:
+        print(
+            f"promoted {sum(len(v) for v in promoted.values())} variables"
+            f" of {len(promoted)} functions: "
+            + ", ".join(
+                f"{name} ({', '.join(promoted[name])})" for name in sorted(promoted)
+            )
+        )
+    if args.remove_dead_functions:
+        names = sorted(name for r in removed for name in r)
+        print(
+            f"removed {len(names)} functions"
+            f" ({count_words(dead_code.getvalue())} words): {', '.join(names)}"
+        )
 
 
 if __name__ == "__main__":